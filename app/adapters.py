@@ -0,0 +1,155 @@
+"""
+Several LoRA adapters served from one copy of the base model.
+
+Every subdirectory of the adapter directory holding an adapter_config.json
+is registered under its directory name (e.g. adapters/finance). Adapters
+are loaded into the shared PeftModel the first time a batch needs them and
+kept in an LRU: when the loaded adapters exceed the memory budget, the least
+recently used ones are unloaded (the default adapter always stays).
+
+PEFT has one active adapter per model, so batches are single-adapter (the
+scheduler groups requests by adapter) and `use()` lets any number of
+batches of the *active* adapter run at once while a batch that needs a
+different one waits for them to finish, then switches.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from peft import PeftModel
+
+from app.metrics import ADAPTER_EVICTIONS, ADAPTER_MEMORY_BYTES, ADAPTER_SWAP_SECONDS
+from app.sectors import sector_of
+
+BASE = "base"  # Adapter name that means "no adapter"
+
+
+def discover_adapters(adapter_dir):
+    """{name: path} for every PEFT adapter directly under `adapter_dir`."""
+    if not os.path.isdir(adapter_dir):
+        return {}
+    return {
+        name: os.path.join(adapter_dir, name)
+        for name in sorted(os.listdir(adapter_dir))
+        if os.path.exists(os.path.join(adapter_dir, name, "adapter_config.json"))
+    }
+
+
+class AdapterRegistry:
+    def __init__(self, base_model, adapters, budget_bytes, default=None):
+        """
+        base_model: the loaded base model (not yet wrapped by PEFT).
+        adapters: {name: path}. `default` (a key of it, or None for the
+        bare base model) serves requests that don't ask for an adapter.
+        """
+        if default is not None and default not in adapters:
+            raise ValueError(f"Default adapter {default!r} is not registered")
+        self.paths = dict(adapters)
+        self.budget_bytes = budget_bytes
+        self.default = default or BASE
+        self._loaded = OrderedDict()  # name -> bytes, least recently used first
+        self._cond = threading.Condition()
+        self._users = 0
+        self._switch_pending = None
+
+        # PEFT needs one adapter to wrap the model; it stays loaded if default
+        first = default or next(iter(self.paths))
+        started = time.perf_counter()
+        self.model = PeftModel.from_pretrained(base_model, self.paths[first], adapter_name=first)
+        self.model.eval()
+        ADAPTER_SWAP_SECONDS.labels(kind="load").observe(time.perf_counter() - started)
+        self._loaded[first] = self._adapter_bytes(first)
+        self._active = first
+        self._activate(self.default)
+        self._update_memory()
+
+    def names(self):
+        return [BASE] + list(self.paths)
+
+    def loaded(self):
+        return list(self._loaded)
+
+    def resolve(self, adapter=None, ticker=None):
+        """
+        The adapter a request should use: the one it names, else its
+        ticker's sector adapter if registered, else the default.
+        Raises ValueError for an unknown adapter name.
+        """
+        if adapter:
+            if adapter != BASE and adapter not in self.paths:
+                raise ValueError(f"Unknown adapter {adapter!r}; available: {', '.join(self.names())}")
+            return adapter
+        sector = sector_of(ticker)
+        if sector in self.paths:
+            return sector
+        return self.default
+
+    def _adapter_bytes(self, name):
+        marker = f".{name}."
+        return sum(p.numel() * p.element_size() for n, p in self.model.named_parameters() if marker in n)
+
+    def _update_memory(self):
+        ADAPTER_MEMORY_BYTES.set(sum(self._loaded.values()))
+
+    def _load(self, name):
+        started = time.perf_counter()
+        self.model.load_adapter(self.paths[name], adapter_name=name)
+        ADAPTER_SWAP_SECONDS.labels(kind="load").observe(time.perf_counter() - started)
+        self._loaded[name] = self._adapter_bytes(name)
+
+    def _evict(self):
+        """Unload least recently used adapters (never the default or the active one)."""
+        for old in list(self._loaded):
+            # PEFT needs at least one adapter to stay loaded
+            if sum(self._loaded.values()) <= self.budget_bytes or len(self._loaded) == 1:
+                break
+            if old in (self._active, self.default):
+                continue
+            self.model.delete_adapter(old)
+            del self._loaded[old]
+            ADAPTER_EVICTIONS.inc()
+            print(f"Unloaded adapter {old} (adapter memory budget {self.budget_bytes / 2**20:.0f}MB).")
+        self._update_memory()
+
+    def _activate(self, name):
+        """Make `name` the active adapter. Only called with no batch running."""
+        started = time.perf_counter()
+        if name == BASE:
+            self.model.base_model.disable_adapter_layers()
+        else:
+            if name not in self._loaded:
+                self._load(name)
+                started = None
+            self.model.base_model.enable_adapter_layers()
+            self.model.set_adapter(name)
+            self._loaded.move_to_end(name)
+        if started is not None:
+            ADAPTER_SWAP_SECONDS.labels(kind="switch").observe(time.perf_counter() - started)
+        self._active = name
+        self._evict()
+
+    @contextmanager
+    def use(self, name):
+        """Run a batch with adapter `name` active (blocks while others use a different one)."""
+        with self._cond:
+            while True:
+                if self._active == name and self._switch_pending in (None, name):
+                    break
+                if self._users == 0:
+                    self._activate(name)
+                    break
+                # Hold back new batches of the current adapter so this one gets its turn
+                if self._switch_pending is None:
+                    self._switch_pending = name
+                self._cond.wait()
+            if self._switch_pending == name:
+                self._switch_pending = None
+            self._users += 1
+        try:
+            yield self.model
+        finally:
+            with self._cond:
+                self._users -= 1
+                self._cond.notify_all()
@@ -0,0 +1,284 @@
+"""
+Dynamic micro-batching for /analyze.
+
+Requests are queued and a single background task drains the queue: it takes
+the first waiting request, then keeps collecting for up to `max_wait_ms` or
+until `max_batch_size` requests are in hand, and runs them as one batched
+generation. Each caller awaits a future that resolves to its own answer.
+Requests carry a `group` (the LoRA adapter they need) and a batch only ever
+holds one group: requests of other groups met while collecting are held
+back, in order, and start the next batch.
+
+Bulk requests (job items, app/jobs.py) wait in a separate lane that is only
+served when no interactive request is waiting, in batches of up to
+`bulk_batch_size`: they soak up idle capacity in large, efficient batches
+without adding latency to interactive traffic beyond the batch in progress.
+
+Generation runs on a dedicated thread pool with `concurrency` workers, so the
+event loop (and with it /health and /metrics) never waits on the model. The
+wait queue is bounded; when it is full `submit` raises `QueueFullError`
+straight away so the API can shed load instead of piling up work. Other
+model work (a /score forward pass) goes through `run`: it waits in the same
+queue, under the same bound and deadlines, and takes a batch's place.
+"""
+import asyncio
+import functools
+import math
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Hashable, Optional
+
+from app.metrics import (
+    BATCH_QUEUE_DEPTH,
+    BATCH_SIZE,
+    BULK_QUEUE_DEPTH,
+    REQUESTS_EXPIRED,
+    REQUESTS_SHED,
+    STAGE_SECONDS,
+)
+
+
+class QueueFullError(Exception):
+    """Raised by `BatchScheduler.submit` when the wait queue is at capacity."""
+
+
+@dataclass
+class _PendingRequest:
+    prompt: Any  # token-id segments from app/prompts.py (or a plain string)
+    deadline: float  # time.monotonic() after which nobody wants the answer
+    future: asyncio.Future = field(repr=False)
+    on_token: Optional[Callable[[int], None]] = field(default=None, repr=False)
+    enqueued_at: float = field(default_factory=time.monotonic)
+    group: Optional[Hashable] = None
+    max_new_tokens: Optional[int] = None  # None: generate_fn's default
+    call: Optional[Callable[[], Any]] = field(default=None, repr=False)  # `run` work, run alone
+
+    def expired(self):
+        # Read from the inference thread; a cancelled future means the
+        # caller stopped waiting (deadline hit or client went away).
+        return self.future.done() or time.monotonic() >= self.deadline
+
+
+class BatchScheduler:
+    def __init__(self, generate_fn, max_batch_size=8, max_wait_ms=10, concurrency=1, max_queue_size=64,
+                 bulk_batch_size=32):
+        """
+        generate_fn: blocking callable
+        `generate_fn(prompts, should_stop, on_token, group, max_new_tokens)`
+        returning a list of answers in prompt order. `should_stop(i)` tells
+        it that prompt i has been abandoned and can be dropped mid-generation;
+        `on_token(i, token_id)` must be called for every token generated;
+        `group` is the group shared by every request in the batch;
+        `max_new_tokens` holds each prompt's limit (None for the default).
+        """
+        self.generate_fn = generate_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.concurrency = concurrency
+        self.max_queue_size = max_queue_size
+        self.queue = asyncio.Queue(maxsize=max_queue_size)
+        self._held = deque()  # Dequeued, but for a different group than the batch being collected
+        self.bulk_batch_size = bulk_batch_size
+        self._bulk = deque()  # Low-priority lane; its producer (the job runner) bounds it
+        self._wakeup = asyncio.Event()
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="inference")
+        self._slots = asyncio.Semaphore(concurrency)
+        self._task = None
+        self._inflight = set()
+        self._avg_batch_s = 1.0  # running average of one batched generation
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            # Before Python 3.12, asyncio.wait_for swallows a cancellation that
+            # lands as its awaitable completes (e.g. queue.get() returning a
+            # request while a batch is collected), so cancel until it sticks
+            while not self._task.done():
+                self._task.cancel()
+                await asyncio.wait({self._task}, timeout=0.1)
+            self._task = None
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def depth(self):
+        """Requests waiting for a batch, including ones held back for their group."""
+        return self.queue.qsize() + len(self._held)
+
+    def enqueue(self, prompt, timeout, on_token=None, group=None, bulk=False, max_new_tokens=None):
+        """
+        Queue a prompt and return the future that will hold its answer.
+
+        Raises QueueFullError when the queue is at capacity. `on_token`, if
+        given, is called with each generated token id from the inference
+        thread as soon as it is produced. Only requests of the same `group`
+        are batched together. `bulk` requests go to the low-priority lane,
+        which is never full.
+        """
+        future = asyncio.get_running_loop().create_future()
+        request = _PendingRequest(prompt, time.monotonic() + timeout, future, on_token, group=group,
+                                  max_new_tokens=max_new_tokens)
+        if bulk:
+            self._wakeup.set()
+            self._bulk.append(request)
+            BULK_QUEUE_DEPTH.set(len(self._bulk))
+            return future
+        return self._admit(request)
+
+    def _admit(self, request):
+        """Put an interactive request in the wait queue, or shed it if full."""
+        self._wakeup.set()
+        try:
+            if self.depth() >= self.max_queue_size:
+                raise asyncio.QueueFull()
+            self.queue.put_nowait(request)
+        except asyncio.QueueFull:
+            REQUESTS_SHED.inc()
+            raise QueueFullError()
+        BATCH_QUEUE_DEPTH.set(self.depth())
+        return request.future
+
+    async def submit(self, prompt, timeout, group=None, bulk=False, max_new_tokens=None):
+        """
+        Queue a prompt and wait up to `timeout` seconds for its answer.
+
+        Raises QueueFullError when the queue is at capacity and
+        asyncio.TimeoutError when the deadline passes first; in the latter
+        case the request is dropped from its batch at the next decode step.
+        """
+        future = self.enqueue(prompt, timeout, group=group, bulk=bulk, max_new_tokens=max_new_tokens)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            REQUESTS_EXPIRED.inc()
+            raise
+
+    async def run(self, fn, *args, timeout):
+        """
+        Run blocking `fn(*args)` on an inference thread in place of a batch.
+
+        It queues like `submit` (QueueFullError when the queue is full,
+        asyncio.TimeoutError when the deadline passes first) and is dropped
+        if its deadline passes before it starts; once started it runs to
+        the end.
+        """
+        future = asyncio.get_running_loop().create_future()
+        # A group of its own: never batched with anything
+        self._admit(_PendingRequest(None, time.monotonic() + timeout, future, group=object(),
+                                    call=functools.partial(fn, *args)))
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            REQUESTS_EXPIRED.inc()
+            raise
+
+    def _interactive_waiting(self):
+        return bool(self._held) or not self.queue.empty()
+
+    def _collect_bulk(self):
+        """Oldest bulk request plus the next ones of its group, up to bulk_batch_size."""
+        batch = [self._bulk.popleft()]
+        group = batch[0].group
+        others = deque()
+        while self._bulk and len(batch) < self.bulk_batch_size:
+            req = self._bulk.popleft()
+            (batch if req.group == group else others).append(req)
+        others.extend(self._bulk)
+        self._bulk = others
+        BULK_QUEUE_DEPTH.set(len(self._bulk))
+        return [req for req in batch if not req.expired()]
+
+    async def _collect(self):
+        while not (self._interactive_waiting() or self._bulk):
+            self._wakeup.clear()
+            await self._wakeup.wait()
+        if not self._interactive_waiting():
+            return self._collect_bulk()
+
+        loop = asyncio.get_running_loop()
+        # Held-back requests are older than anything in the queue: they go first
+        batch = [self._held.popleft() if self._held else self.queue.get_nowait()]
+        group = batch[0].group
+        still_held = deque()
+        while self._held:
+            req = self._held.popleft()
+            if req.group == group and len(batch) < self.max_batch_size:
+                batch.append(req)
+            else:
+                still_held.append(req)
+        self._held = still_held
+        if batch[0].call is not None:
+            return [req for req in batch if not req.expired()]
+
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                req = await asyncio.wait_for(self.queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if req.group == group:
+                batch.append(req)
+            else:
+                self._held.append(req)
+        # Callers that gave up while queued don't need a slot in the batch
+        return [req for req in batch if not req.expired()]
+
+    async def _run(self):
+        while True:
+            # Wait for a free worker first so requests keep accumulating in
+            # the queue (and form a bigger batch) while the model is busy.
+            await self._slots.acquire()
+            try:
+                batch = await self._collect()
+            except BaseException:
+                self._slots.release()
+                raise
+            BATCH_QUEUE_DEPTH.set(self.depth())
+            if not batch:
+                self._slots.release()
+                continue
+            if batch[0].call is None:
+                BATCH_SIZE.observe(len(batch))
+            task = asyncio.create_task(self._execute(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _execute(self, batch):
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        for req in batch:
+            STAGE_SECONDS.labels(stage="queue").observe(started - req.enqueued_at)
+        try:
+            if batch[0].call is not None:
+                answers = [await loop.run_in_executor(self.executor, batch[0].call)]
+            else:
+                answers = await loop.run_in_executor(
+                    self.executor,
+                    self.generate_fn,
+                    [req.prompt for req in batch],
+                    lambda i: batch[i].expired(),
+                    lambda i, token_id: batch[i].on_token and batch[i].on_token(token_id),
+                    batch[0].group,
+                    [req.max_new_tokens for req in batch],
+                )
+        except Exception as e:
+            for req in batch:
+                if not req.future.done():
+                    req.future.set_exception(e)
+            return
+        finally:
+            self._slots.release()
+            self._avg_batch_s = 0.8 * self._avg_batch_s + 0.2 * (time.monotonic() - started)
+        for req, answer in zip(batch, answers):
+            if not req.future.done():
+                req.future.set_result(answer)
+
+    def retry_after(self):
+        """Rough seconds until the current queue drains, for the Retry-After header."""
+        batches_ahead = self.depth() / (self.max_batch_size * self.concurrency)
+        return max(1, math.ceil(batches_ahead * self._avg_batch_s))
@@ -0,0 +1,176 @@
+"""
+Response cache for /analyze.
+
+Analysts ask the same canned questions about the same filing excerpts all the
+time, and decoding is greedy, so an identical request always produces the
+same answer. Answers are cached under a hash of the normalized request, the
+generation parameters and the model version, in two tiers:
+
+* a byte-bounded in-process LRU with a TTL (fast, per replica), and
+* an optional shared tier that every replica reads and writes. The bundled
+  implementation is SQLite on a shared volume; anything with the same
+  `get`/`set` methods (Redis, memcached, ...) can be plugged in instead.
+"""
+import asyncio
+import hashlib
+import json
+import math
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from app.metrics import CACHE_EVICTIONS, CACHE_HITS, CACHE_MISSES
+
+
+def _normalize(text):
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def cache_key(text, query, params, model_version):
+    """Stable hash of everything that determines the generated answer."""
+    payload = json.dumps(
+        {
+            "text": _normalize(text),
+            "query": _normalize(query),
+            "params": params,
+            "model": model_version,
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    """In-process LRU bounded by the total size of keys and values in bytes."""
+
+    def __init__(self, max_bytes, ttl_s):
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self.size = 0
+        self._entries = OrderedDict()  # key -> (expires_at, value, nbytes)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value, nbytes = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.size -= nbytes
+                CACHE_EVICTIONS.labels(reason="ttl").inc()
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        nbytes = len(key) + len(value.encode("utf-8"))
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old[2]
+            self._entries[key] = (time.monotonic() + self.ttl_s, value, nbytes)
+            self.size += nbytes
+            while self.size > self.max_bytes:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self.size -= evicted
+                CACHE_EVICTIONS.labels(reason="size").inc()
+
+
+class SQLiteCache:
+    """
+    Shared cache tier backed by a SQLite file.
+
+    Point every replica at the same file on a shared volume and they all see
+    each other's answers. WAL mode lets readers and a writer work at once.
+    With `ttl_s=None` rows never expire (a persistent store rather than a
+    cache).
+    """
+
+    PURGE_EVERY = 500  # writes between sweeps of expired rows
+
+    def __init__(self, path, ttl_s):
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM responses WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, value):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, math.inf if self.ttl_s is None else time.time() + self.ttl_s),
+            )
+            self._writes += 1
+            if self.ttl_s is not None and self._writes % self.PURGE_EVERY == 0:
+                cur = self._conn.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+                CACHE_EVICTIONS.labels(reason="ttl").inc(cur.rowcount)
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def shared_cache_from_url(url, ttl_s):
+    """Build the shared tier from a URL such as `sqlite:////cache/responses.db`."""
+    if not url:
+        return None
+    if url.startswith("sqlite:///"):
+        return SQLiteCache(url[len("sqlite:///"):], ttl_s)
+    raise ValueError(f"Unsupported shared cache URL: {url}")
+
+
+class ResponseCache:
+    """Local LRU in front of an optional shared tier."""
+
+    def __init__(self, local, shared=None):
+        self.local = local
+        self.shared = shared
+
+    async def get(self, key):
+        value = self.local.get(key)
+        if value is not None:
+            CACHE_HITS.labels(tier="local").inc()
+            return value
+        if self.shared is not None:
+            try:
+                value = await asyncio.to_thread(self.shared.get, key)
+            except Exception as e:
+                print(f"Shared cache read failed: {e}")
+                value = None
+            if value is not None:
+                CACHE_HITS.labels(tier="shared").inc()
+                self.local.set(key, value)
+                return value
+        CACHE_MISSES.inc()
+        return None
+
+    async def set(self, key, value):
+        self.local.set(key, value)
+        if self.shared is not None:
+            try:
+                await asyncio.to_thread(self.shared.set, key, value)
+            except Exception as e:
+                print(f"Shared cache write failed: {e}")
+
+    def close(self):
+        if self.shared is not None and hasattr(self.shared, "close"):
+            self.shared.close()
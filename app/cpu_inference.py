@@ -0,0 +1,173 @@
+"""
+CPU serving mode: int8 weights, bf16/fp32 compute and thread tuning.
+
+An fp16 8B model on CPU is both slow (most CPUs have no fast fp16 matmul)
+and large (16GB). In this mode the weights of the Linear layers are stored
+as int8 with one scale per output channel, which halves memory and the bytes
+read per decoded token, while embeddings and norms run in `compute_dtype`.
+The output projection (lm_head, see SKIP_MODULES) keeps 16-bit weights: its
+logits are what /score's label probabilities are computed from, and int8
+rounding over a 128k vocabulary shifts them noticeably. So do the LoRA
+matrices of an adapter loaded with the model (ADAPTER_PATH): PEFT casts
+their input to their weight dtype, and they are small anyway.
+
+* "int8": weight-only int8. Activations stay in bf16/fp32; the matmul goes
+  through torch's packed int8-weight kernel where available.
+* "dynamic": torch's dynamic quantization (int8 weights and activations,
+  fbgemm kernels). Computes in fp32.
+* "none": plain bf16/fp32 weights.
+
+Layers are quantized one at a time straight from the memory-mapped
+checkpoint, so peak memory stays close to the size of the bf16 weights.
+"""
+import math
+import os
+import warnings
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from transformers import AutoModelForCausalLM
+
+QUANTIZATION_MODES = ("int8", "dynamic", "none")
+# Linear layers left unquantized, matched by their last name component
+SKIP_MODULES = ("lm_head",)
+# ...and everything under a module whose name starts with one of these
+SKIP_PREFIXES = ("lora_",)
+
+
+def container_cpu_limit():
+    """CPUs this process may use: the cgroup quota if any, else the affinity mask."""
+    limits = []
+    try:
+        limits.append(len(os.sched_getaffinity(0)))
+    except AttributeError:  # macOS
+        limits.append(os.cpu_count() or 1)
+    try:
+        # cgroup v2: "<quota> <period>" or "max <period>"
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            limits.append(math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        try:
+            # cgroup v1: quota is -1 when unlimited
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                quota = int(f.read())
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                period = int(f.read())
+            if quota > 0:
+                limits.append(math.ceil(quota / period))
+        except (OSError, ValueError):
+            pass
+    return max(1, min(limits))
+
+
+def configure_threads(threads=0, concurrency=1):
+    """
+    Size torch's intra-op pool to the container's CPU limit (or `threads`).
+
+    Without this torch starts one thread per host core, and a pod limited
+    to 4 CPUs on a 64-core node spends its quota on contention. The pool is
+    split between `concurrency` batches running at once.
+    """
+    n = threads or max(1, container_cpu_limit() // max(1, concurrency))
+    torch.set_num_threads(n)
+    try:
+        # Inter-op parallelism does not help a decode loop; only settable once
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+    return n
+
+
+class Int8Linear(nn.Module):
+    """Linear layer with int8 weights and a per-output-channel scale."""
+
+    def __init__(self, weight, scale, bias=None):
+        super().__init__()
+        self.in_features = weight.shape[1]
+        self.out_features = weight.shape[0]
+        self.register_buffer("weight", weight)
+        self.register_buffer("scale", scale)
+        self.bias = None if bias is None else nn.Parameter(bias, requires_grad=False)
+
+    @classmethod
+    def from_linear(cls, linear, dtype):
+        w = linear.weight.detach().float()
+        scale = w.abs().amax(dim=1).clamp(min=1e-8) / 127
+        q = torch.round(w / scale[:, None]).clamp(-127, 127).to(torch.int8)
+        bias = None if linear.bias is None else linear.bias.detach().to(dtype)
+        return cls(q, scale.to(dtype), bias)
+
+    def forward(self, x):
+        shape = x.shape
+        x = x.reshape(-1, self.in_features)
+        if hasattr(torch, "_weight_int8pack_mm"):
+            out = torch._weight_int8pack_mm(x.contiguous(), self.weight, self.scale.to(x.dtype))
+        else:
+            out = F.linear(x, self.weight.to(x.dtype)) * self.scale.to(x.dtype)
+        if self.bias is not None:
+            out = out + self.bias.to(x.dtype)
+        return out.reshape(*shape[:-1], self.out_features)
+
+    def extra_repr(self):
+        return f"in_features={self.in_features}, out_features={self.out_features}, bias={self.bias is not None}"
+
+
+def _dynamic_int8(linear):
+    with warnings.catch_warnings():
+        # torch.ao.quantization is deprecated in favour of torchao, but still ships
+        warnings.simplefilter("ignore")
+        from torch.ao.quantization import quantize_dynamic
+        wrapped = quantize_dynamic(nn.Sequential(linear.float()), {nn.Linear}, dtype=torch.qint8)
+    return wrapped[0]
+
+
+def quantize_linears(model, mode, dtype, skip=SKIP_MODULES, skip_prefixes=SKIP_PREFIXES):
+    """
+    Replace every nn.Linear not named in `skip`, nor inside a module whose
+    name starts with one of `skip_prefixes`, in place, one at a time;
+    returns how many were replaced.
+    """
+    replaced = 0
+    for path, parent in list(model.named_modules()):
+        if any(part.startswith(skip_prefixes) for part in path.split(".")):
+            continue
+        for name, child in list(parent.named_children()):
+            if not isinstance(child, nn.Linear) or name in skip:
+                continue
+            if mode == "int8":
+                setattr(parent, name, Int8Linear.from_linear(child, dtype))
+            else:
+                setattr(parent, name, _dynamic_int8(child))
+            replaced += 1
+    return replaced
+
+
+def load_cpu_model(path, quantization="int8", compute_dtype=torch.bfloat16, **kwargs):
+    """Load `path` for CPU serving (see module docstring for the modes)."""
+    if quantization not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown CPU quantization {quantization!r}; expected one of {QUANTIZATION_MODES}")
+    if quantization == "dynamic":
+        compute_dtype = torch.float32  # Dynamic int8 kernels take fp32 activations
+    # safetensors checkpoints are memory-mapped; quantized runs read the
+    # weights at 16 bits and convert them layer by layer.
+    load_dtype = compute_dtype if quantization == "none" else torch.bfloat16
+    model = AutoModelForCausalLM.from_pretrained(
+        path,
+        torch_dtype=load_dtype,
+        low_cpu_mem_usage=True,
+        device_map={"": "cpu"},
+        **kwargs,
+    )
+    if quantization != "none":
+        n = quantize_linears(model, quantization, compute_dtype)
+        # Embeddings, norms and lm_head (the remaining parameters) compute in compute_dtype
+        for param in model.parameters():
+            if param.is_floating_point() and param.dtype != compute_dtype:
+                param.data = param.data.to(compute_dtype)
+        print(f"Quantized {n} linear layers to int8 ({quantization}, {str(compute_dtype).replace('torch.', '')} compute; "
+              f"{', '.join(SKIP_MODULES)} and LoRA layers kept unquantized).")
+    model.eval()
+    return model
@@ -0,0 +1,168 @@
+"""
+Near-duplicate detection with MinHash and LSH.
+
+Risk-factor sections are largely copied from one 10-K to the next, so most
+of what the SFT builder and the index writer see is text they have already
+seen. A MinHash signature (NUM_PERM minimum hashes of a text's word
+5-grams) estimates the Jaccard similarity of two texts; LSH buckets the
+signatures by bands so only likely matches are ever compared, which keeps
+deduplication linear in the number of texts.
+
+    dups = NearDuplicateFilter(threshold=0.8)
+    dups.seen(text, key="AAPL:2023:1a")   # None: new text, now remembered
+    dups.seen(text2, key="AAPL:2022:1a")  # "AAPL:2023:1a" if near-duplicate
+
+Lives with the API (like app/retrieval.py) so the index writer can use it.
+"""
+import re
+import zlib
+from functools import lru_cache
+
+import numpy as np
+
+NUM_PERM = 128
+SHINGLE_WORDS = 5
+DEFAULT_THRESHOLD = 0.8
+
+_MERSENNE = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def shingle_hashes(text, shingle_words=SHINGLE_WORDS):
+    """uint64 hashes of the text's lower-cased word n-grams (one shingle if shorter)."""
+    words = _WORD_RE.findall(text.lower())
+    if not words:
+        return np.zeros(0, dtype=np.uint64)
+    h = np.array([zlib.crc32(w.encode("utf-8")) for w in words], dtype=np.uint64)
+    n = max(1, len(words) - shingle_words + 1)
+    # Polynomial combination of each window of word hashes (wrapping uint64)
+    combined = np.zeros(n, dtype=np.uint64)
+    for j in range(min(shingle_words, len(words))):
+        combined = combined * np.uint64(1000003) + h[j:j + n]
+    return np.unique(combined)
+
+
+class MinHasher:
+    def __init__(self, num_perm=NUM_PERM, shingle_words=SHINGLE_WORDS, seed=1):
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.shingle_words = shingle_words
+        self.a = rng.randint(1, 1 << 31, size=num_perm, dtype=np.uint64)[:, None]
+        self.b = rng.randint(0, 1 << 31, size=num_perm, dtype=np.uint64)[:, None]
+
+    def signature(self, text):
+        """uint64 [num_perm] MinHash signature; an empty text gets all-max values."""
+        sig = np.full(self.num_perm, _MAX_HASH, dtype=np.uint64)
+        hashes = shingle_hashes(text, self.shingle_words)
+        for start in range(0, len(hashes), 4096):  # Bound the [num_perm, n] temporary
+            block = hashes[start:start + 4096][None, :]
+            permuted = ((self.a * block + self.b) % _MERSENNE) & _MAX_HASH
+            np.minimum(sig, permuted.min(axis=1), out=sig)
+        return sig
+
+
+def similarity(sig_a, sig_b):
+    """Jaccard similarity estimated from two signatures."""
+    return float(np.mean(sig_a == sig_b))
+
+
+@lru_cache(maxsize=None)
+def lsh_params(threshold, num_perm=NUM_PERM):
+    """
+    (bands, rows) for LSH: the split of the signature whose S-curve
+    1 - (1 - s^rows)^bands has the least false positive plus false negative
+    mass around `threshold`.
+    """
+    best, best_error = (1, num_perm), float("inf")
+    below = np.linspace(0, threshold, 100)
+    above = np.linspace(threshold, 1, 100)
+    for bands in range(1, num_perm + 1):
+        rows = num_perm // bands
+        false_pos = np.mean(1 - (1 - below ** rows) ** bands) * threshold
+        false_neg = np.mean((1 - above ** rows) ** bands) * (1 - threshold)
+        if false_pos + false_neg < best_error:
+            best, best_error = (bands, rows), false_pos + false_neg
+    return best
+
+
+class LSHIndex:
+    """Signatures bucketed by band; `query` returns verified near-duplicates."""
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, num_perm=NUM_PERM):
+        self.threshold = threshold
+        self.bands, self.rows = lsh_params(threshold, num_perm)
+        self._buckets = [{} for _ in range(self.bands)]
+        self._sigs = {}
+
+    def __len__(self):
+        return len(self._sigs)
+
+    def _band_keys(self, sig):
+        return [sig[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def insert(self, key, sig):
+        self._sigs[key] = sig
+        for bucket, band in zip(self._buckets, self._band_keys(sig)):
+            bucket.setdefault(band, []).append(key)
+
+    def query(self, sig):
+        """(key, similarity) of stored signatures at or above the threshold, most similar first."""
+        candidates = set()
+        for bucket, band in zip(self._buckets, self._band_keys(sig)):
+            candidates.update(bucket.get(band, ()))
+        matches = [(key, similarity(sig, self._sigs[key])) for key in candidates]
+        return sorted((m for m in matches if m[1] >= self.threshold), key=lambda m: -m[1])
+
+
+class NearDuplicateFilter:
+    """
+    Remembers texts and flags near-duplicates of earlier ones. Texts only
+    match within the same `scope` (e.g. a ticker), when one is given.
+    """
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, num_perm=NUM_PERM):
+        self.threshold = threshold
+        self.hasher = MinHasher(num_perm)
+        self._indexes = {}
+
+    def seen(self, text, key, scope=None):
+        """Key of an earlier near-duplicate of `text`, or None (and `text` is remembered)."""
+        sig = self.hasher.signature(text)
+        index = self._indexes.get(scope)
+        if index is None:
+            index = self._indexes[scope] = LSHIndex(self.threshold, self.hasher.num_perm)
+        matches = index.query(sig)
+        if matches:
+            return matches[0][0]
+        index.insert(key, sig)
+        return None
+
+
+def keep_priority(record):
+    """
+    Sort key (highest first) of the copy kept from a group of near-duplicate
+    filings: the newest, by fiscal year, then accession (so an amendment
+    filed later wins). Section dedup and index-time chunk dedup both order
+    by it, so they keep the same filing's text.
+    """
+    return (record.get("fiscal_year") or 0, record.get("accession") or "")
+
+
+def changed_passages(old, new, threshold=DEFAULT_THRESHOLD, hasher=None):
+    """
+    Diff of two versions of a section given as lists of passages (e.g.
+    paragraphs): (added, removed), the passages of each version with no
+    near-duplicate in the other.
+    """
+    hasher = hasher or MinHasher()
+    old_index, new_index = LSHIndex(threshold, hasher.num_perm), LSHIndex(threshold, hasher.num_perm)
+    old_sigs = [hasher.signature(p) for p in old]
+    new_sigs = [hasher.signature(p) for p in new]
+    for i, sig in enumerate(old_sigs):
+        old_index.insert(i, sig)
+    for i, sig in enumerate(new_sigs):
+        new_index.insert(i, sig)
+    added = [p for p, sig in zip(new, new_sigs) if not old_index.query(sig)]
+    removed = [p for p, sig in zip(old, old_sigs) if not new_index.query(sig)]
+    return added, removed
@@ -0,0 +1,277 @@
+"""
+Batched greedy decoding used by the inference service.
+
+`model.generate` keeps every row of a batch alive until the longest one is
+done, so short answers pay for the long ones. This decode loop drops a row
+from the batch (and from the KV cache) as soon as it emits an EOS token.
+"""
+import inspect
+import time
+
+import torch
+
+from app.metrics import (
+    DECODE_TOKENS_PER_SECOND,
+    GENERATED_TOKENS,
+    PREFILL_TOKENS,
+    PROMPT_TOKENS,
+    STAGE_SECONDS,
+)
+from app.prefix_cache import cache_to_pairs, pairs_to_cache
+from app.prompts import prompt_token_ids
+
+
+def eos_token_ids(model, tokenizer):
+    """All token ids that end a generation (Llama 3 Instruct has several)."""
+    ids = set()
+    config_eos = getattr(getattr(model, "generation_config", None), "eos_token_id", None)
+    if isinstance(config_eos, int):
+        ids.add(config_eos)
+    elif config_eos:
+        ids.update(config_eos)
+    if tokenizer.eos_token_id is not None:
+        ids.add(tokenizer.eos_token_id)
+    # End of an assistant turn; the chat model stops here even if the
+    # checkpoint's generation config only lists <|end_of_text|>.
+    eot_id = tokenizer.convert_tokens_to_ids("<|eot_id|>")
+    if eot_id is not None and eot_id != tokenizer.unk_token_id:
+        ids.add(eot_id)
+    return ids
+
+
+def _select_rows(past_key_values, rows):
+    """Keep only `rows` (batch indices) of the KV cache."""
+    if past_key_values is None:
+        return None
+    if hasattr(past_key_values, "batch_select_indices"):
+        past_key_values.batch_select_indices(rows)
+        return past_key_values
+    # Legacy tuple-of-tuples cache
+    return tuple(tuple(t[rows] for t in layer) for layer in past_key_values)
+
+
+def _last_logits_kwargs(model):
+    # Only materialise logits for the last position; the prefill step would
+    # otherwise allocate (batch x prompt_len x 128k vocab) floats.
+    # A PEFT wrapper's forward takes **kwargs and passes them through
+    base = model.get_base_model() if hasattr(model, "get_base_model") else model
+    params = inspect.signature(base.forward).parameters
+    if "logits_to_keep" in params:
+        return {"logits_to_keep": 1}
+    if "num_logits_to_keep" in params:
+        return {"num_logits_to_keep": 1}
+    return {}
+
+
+def _prefill_inputs(prompt_ids, prefixes, pad_token_id, device):
+    """
+    Batch tensors for the prefill step when some rows reuse a cached prefix.
+
+    Row layout (columns): [pad][cached prefix][pad][rest of prompt]. Cached
+    prefixes are right-aligned in a zero-filled KV block and the uncached
+    tails are left-padded after it; padding is masked out and positions skip
+    it, so every row sees exactly its own prompt.
+    """
+    prefix_lens = [n for n, _ in prefixes]
+    tails = [ids[n:] for ids, n in zip(prompt_ids, prefix_lens)]
+    max_prefix = max(prefix_lens)
+    max_tail = max(len(t) for t in tails)
+
+    input_ids = torch.full((len(tails), max_tail), pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(tails), max_prefix + max_tail), dtype=torch.long)
+    for row, (tail, n) in enumerate(zip(tails, prefix_lens)):
+        input_ids[row, max_tail - len(tail):] = torch.tensor(tail)
+        attention_mask[row, max_prefix - n:max_prefix] = 1
+        attention_mask[row, max_prefix + max_tail - len(tail):] = 1
+    tail_mask = attention_mask[:, max_prefix:]
+    position_ids = (torch.tensor(prefix_lens).unsqueeze(-1) + tail_mask.cumsum(-1) - 1).clamp(min=0)
+
+    past_key_values = None
+    if max_prefix > 0:
+        template = next(pairs for _, pairs in prefixes if pairs is not None)
+        layers = []
+        for layer, (k0, v0) in enumerate(template):
+            keys = k0.new_zeros((len(tails), k0.shape[1], max_prefix, k0.shape[3]))
+            values = v0.new_zeros((len(tails), v0.shape[1], max_prefix, v0.shape[3]))
+            for row, (n, pairs) in enumerate(prefixes):
+                if n:
+                    keys[row, :, max_prefix - n:] = pairs[layer][0][0]
+                    values[row, :, max_prefix - n:] = pairs[layer][1][0]
+            layers.append((keys, values))
+        past_key_values = pairs_to_cache(layers)
+
+    return (
+        input_ids.to(device),
+        attention_mask.to(device),
+        position_ids.to(device),
+        past_key_values,
+        max_prefix,
+    )
+
+
+def _row_prefix(past_key_values, row, columns):
+    """Copy one row's KV at `columns` out of a batched cache, as batch-size-1 pairs."""
+    return [
+        (k[row:row + 1, :, columns].clone(), v[row:row + 1, :, columns].clone())
+        for k, v in cache_to_pairs(past_key_values)
+    ]
+
+
+@torch.no_grad()
+def generate_batch(
+    model,
+    tokenizer,
+    prompts,
+    max_new_tokens=200,
+    eos_ids=None,
+    should_stop=None,
+    on_token=None,
+    prefix_cache=None,
+):
+    """
+    Greedy-decode `prompts` together and return one completion per prompt.
+
+    Prompts are left-padded so the last prompt token of every row sits in the
+    same column. Only the newly generated tokens are decoded.
+    `max_new_tokens` is one limit for all prompts or a list with one per prompt.
+    `should_stop(i)`, if given, is polled every step; prompt i is dropped
+    from the batch once it returns True (its completion is left partial).
+    `on_token(i, token_id)`, if given, is called for every generated token.
+
+    A prompt may be a string or a tuple of token-id segments
+    (app/prompts.py). With a `prefix_cache`, segmented prompts skip prefill
+    for any cached prefix, and the prefix up to the last segment (system +
+    context) is offered to the cache so repeat questions on the same context
+    can reuse it.
+    """
+    if eos_ids is None:
+        eos_ids = eos_token_ids(model, tokenizer)
+    if isinstance(max_new_tokens, int):
+        max_new_tokens = [max_new_tokens] * len(prompts)
+
+    tokenize_started = time.perf_counter()
+    prompt_ids = [prompt_token_ids(p, tokenizer) for p in prompts]
+    segments = [(ids,) if isinstance(p, str) else tuple(p) for p, ids in zip(prompts, prompt_ids)]
+    STAGE_SECONDS.labels(stage="tokenize").observe(time.perf_counter() - tokenize_started)
+    for ids in prompt_ids:
+        PROMPT_TOKENS.observe(len(ids))
+    if prefix_cache is not None:
+        prefixes = [prefix_cache.match(s, ids) for s, ids in zip(segments, prompt_ids)]
+    else:
+        prefixes = [(0, None)] * len(prompts)
+
+    prefill_started = time.perf_counter()
+    input_ids, attention_mask, position_ids, past_key_values, max_prefix = _prefill_inputs(
+        prompt_ids, prefixes, tokenizer.pad_token_id, model.device
+    )
+    extra = _last_logits_kwargs(model)
+    reused = sum(n for n, _ in prefixes)
+    PREFILL_TOKENS.labels(source="cache").inc(reused)
+    PREFILL_TOKENS.labels(source="computed").inc(sum(len(ids) for ids in prompt_ids) - reused)
+
+    # Prefixes worth keeping after this prefill: everything before the last
+    # segment, seen often enough and not already cached
+    to_admit = []
+    if prefix_cache is not None:
+        for row, (segs, ids) in enumerate(zip(segments, prompt_ids)):
+            if len(segs) < 2:
+                continue
+            n = sum(len(segment) for segment in segs[:-1])
+            prefix_ids = tuple(ids[:n])
+            if n <= prefixes[row][0] or n >= len(ids):
+                continue
+            if prefix_cache.should_admit(prefix_ids):
+                to_admit.append((row, prefix_ids))
+
+    active = list(range(len(prompts)))  # original prompt index of each live row
+    generated = [[] for _ in prompts]
+    decode_started = None
+
+    for step in range(max(max_new_tokens, default=0)):
+        outputs = model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=past_key_values,
+            use_cache=True,
+            **extra,
+        )
+        past_key_values = outputs.past_key_values
+        next_tokens = outputs.logits[:, -1, :].argmax(dim=-1)
+        next_list = next_tokens.tolist()  # syncs with the device
+
+        if step == 0:
+            decode_started = time.perf_counter()
+            STAGE_SECONDS.labels(stage="prefill").observe(decode_started - prefill_started)
+            for row, prefix_ids in to_admit:
+                # Real (unmasked) columns of this row, in prompt order
+                columns = attention_mask[row].nonzero().squeeze(-1)[:len(prefix_ids)]
+                prefix_cache.put(prefix_ids, _row_prefix(past_key_values, row, columns))
+
+        keep = []
+        for row, token in enumerate(next_list):
+            idx = active[row]
+            if token in eos_ids or (should_stop is not None and should_stop(idx)):
+                continue
+            generated[idx].append(token)
+            if on_token is not None:
+                on_token(idx, token)
+            if len(generated[idx]) < max_new_tokens[idx]:
+                keep.append(row)
+        if not keep:
+            break
+
+        if len(keep) < len(active):
+            rows = torch.tensor(keep, device=input_ids.device)
+            past_key_values = _select_rows(past_key_values, rows)
+            attention_mask = attention_mask[rows]
+            position_ids = position_ids[rows]
+            next_tokens = next_tokens[rows]
+            active = [active[r] for r in keep]
+
+        input_ids = next_tokens.unsqueeze(-1)
+        attention_mask = torch.cat([attention_mask, attention_mask.new_ones((len(active), 1))], dim=-1)
+        position_ids = position_ids[:, -1:] + 1
+
+    if decode_started is not None:
+        # The first token of each row comes out of the prefill step
+        decode_seconds = time.perf_counter() - decode_started
+        STAGE_SECONDS.labels(stage="decode").observe(decode_seconds)
+        decoded_tokens = sum(max(len(ids) - 1, 0) for ids in generated)
+        if decode_seconds > 0 and decoded_tokens:
+            DECODE_TOKENS_PER_SECOND.observe(decoded_tokens / decode_seconds)
+    for ids in generated:
+        GENERATED_TOKENS.observe(len(ids))
+
+    detokenize_started = time.perf_counter()
+    answers = [tokenizer.decode(ids, skip_special_tokens=True).strip() for ids in generated]
+    STAGE_SECONDS.labels(stage="detokenize").observe(time.perf_counter() - detokenize_started)
+    return answers
+
+
+class IncrementalDecoder:
+    """
+    Turns a stream of token ids into text deltas for streaming responses.
+
+    Decoding tokens one by one mangles byte-level BPE (multi-byte characters
+    span tokens, leading spaces depend on context), so each step decodes a
+    short window of recent tokens and emits only the text that is new and
+    complete. Only generated tokens are ever decoded, never the prompt.
+    """
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.ids = []
+        self.prefix_offset = 0
+        self.read_offset = 0
+
+    def add(self, token_id):
+        self.ids.append(token_id)
+        prefix = self.tokenizer.decode(self.ids[self.prefix_offset:self.read_offset], skip_special_tokens=True)
+        text = self.tokenizer.decode(self.ids[self.prefix_offset:], skip_special_tokens=True)
+        if len(text) > len(prefix) and not text.endswith("\ufffd"):
+            self.prefix_offset = self.read_offset
+            self.read_offset = len(self.ids)
+            return text[len(prefix):]
+        # Incomplete UTF-8 sequence; wait for the next token
+        return ""
@@ -0,0 +1,227 @@
+"""
+Bulk analysis jobs: many (context, query) items submitted at once.
+
+Jobs and their items live in a SQLite file, so a restart picks up where it
+left off: items that were in flight go back to pending. Results are
+appended to a results table in completion order, which is what the JSONL
+stream of a job reads from.
+
+`JobRunner` feeds pending items to the batch scheduler's low-priority lane,
+keeping `max_inflight` of them queued so the scheduler can form large
+batches whenever interactive traffic leaves the model idle.
+"""
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+from app.metrics import JOB_ITEMS, JOBS_RUNNING
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    finished_at REAL,
+    total INTEGER NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS items (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    request TEXT NOT NULL,
+    status TEXT NOT NULL,
+    PRIMARY KEY (job_id, idx)
+);
+CREATE INDEX IF NOT EXISTS items_pending ON items (status, job_id, idx);
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    line TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_job ON results (job_id, id);
+"""
+
+
+class JobStore:
+    """SQLite-backed jobs, items and results; safe to call from any thread."""
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        # Items that were running when the process stopped get another go
+        self._conn.execute("UPDATE items SET status = 'pending' WHERE status = 'running'")
+        self._conn.commit()
+        self._update_gauge()
+
+    def _update_gauge(self):
+        (running,) = self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('pending', 'running')").fetchone()
+        JOBS_RUNNING.set(running)
+
+    def create(self, requests):
+        """Store a job with one item per request dict; returns its id."""
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, created_at, total) VALUES (?, 'pending', ?, ?)",
+                (job_id, time.time(), len(requests)),
+            )
+            self._conn.executemany(
+                "INSERT INTO items (job_id, idx, request, status) VALUES (?, ?, ?, 'pending')",
+                ((job_id, i, json.dumps(r)) for i, r in enumerate(requests)),
+            )
+            self._conn.commit()
+            self._update_gauge()
+        return job_id
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, status, created_at, finished_at, total, done, failed FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        keys = ("id", "status", "created_at", "finished_at", "total", "done", "failed")
+        return dict(zip(keys, row))
+
+    def claim(self, limit):
+        """Mark up to `limit` pending items running, oldest job first; returns (job_id, idx, request)."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT i.job_id, i.idx, i.request FROM items i JOIN jobs j ON j.id = i.job_id "
+                "WHERE i.status = 'pending' ORDER BY j.created_at, i.idx LIMIT ?",
+                (limit,),
+            ).fetchall()
+            self._conn.executemany(
+                "UPDATE items SET status = 'running' WHERE job_id = ? AND idx = ?", ((r[0], r[1]) for r in rows)
+            )
+            self._conn.executemany(
+                "UPDATE jobs SET status = 'running' WHERE id = ? AND status = 'pending'", {(r[0],) for r in rows}
+            )
+            self._conn.commit()
+        return [(job_id, idx, json.loads(request)) for job_id, idx, request in rows]
+
+    def finish(self, job_id, idx, result):
+        """Record one item's result line (a dict with "answer" or "error")."""
+        failed = "error" in result
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE items SET status = ? WHERE job_id = ? AND idx = ? AND status = 'running'",
+                ("failed" if failed else "done", job_id, idx),
+            )
+            if cur.rowcount == 0:  # Cancelled meanwhile
+                self._conn.commit()
+                return
+            self._conn.execute("INSERT INTO results (job_id, line) VALUES (?, ?)", (job_id, json.dumps(result)))
+            column = "failed" if failed else "done"
+            self._conn.execute(f"UPDATE jobs SET {column} = {column} + 1 WHERE id = ?", (job_id,))
+            self._conn.execute(
+                "UPDATE jobs SET status = 'done', finished_at = ? WHERE id = ? AND done + failed = total",
+                (time.time(), job_id),
+            )
+            self._conn.commit()
+            self._update_gauge()
+        JOB_ITEMS.labels(outcome="failed" if failed else "done").inc()
+
+    def cancel(self, job_id):
+        """Drop a job's unfinished items; returns False if there is no such job."""
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status IN ('pending', 'running')",
+                (time.time(), job_id),
+            )
+            self._conn.execute(
+                "UPDATE items SET status = 'cancelled' WHERE job_id = ? AND status IN ('pending', 'running')",
+                (job_id,),
+            )
+            self._conn.commit()
+            self._update_gauge()
+            exists = cur.rowcount > 0 or self._conn.execute("SELECT 1 FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(exists)
+
+    def results(self, job_id, after=0, limit=500):
+        """Result lines of a job in completion order, as (id, line) after result id `after`."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT id, line FROM results WHERE job_id = ? AND id > ? ORDER BY id LIMIT ?",
+                (job_id, after, limit),
+            ).fetchall()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class JobRunner:
+    def __init__(self, store, process_fn, max_inflight=64, poll_s=1.0):
+        """
+        process_fn: `async process_fn(request) -> dict` answering one item
+        (it submits to the scheduler's bulk lane); exceptions become the
+        item's error. Up to `max_inflight` items are processed at once.
+        """
+        self.store = store
+        self.process_fn = process_fn
+        self.max_inflight = max_inflight
+        self.poll_s = poll_s
+        self._task = None
+        self._inflight = {}  # task -> job id
+        self._wakeup = asyncio.Event()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def notify(self):
+        """A job was submitted: look for work now rather than at the next poll."""
+        self._wakeup.set()
+
+    async def stop(self):
+        if self._task is not None:
+            # Cancel until it sticks, as in BatchScheduler.stop: before Python
+            # 3.12 asyncio.wait_for can swallow it
+            while not self._task.done():
+                self._task.cancel()
+                await asyncio.wait({self._task}, timeout=0.1)
+            self._task = None
+        for task in list(self._inflight):
+            task.cancel()
+
+    def cancel(self, job_id):
+        """Drop a cancelled job's queued items from the scheduler too."""
+        for task, owner in list(self._inflight.items()):
+            if owner == job_id:
+                task.cancel()
+
+    def _finished(self, task):
+        self._inflight.pop(task, None)
+        self._wakeup.set()  # Room for more items
+
+    async def _process(self, job_id, idx, request):
+        try:
+            result = {"index": idx, **await self.process_fn(request)}
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            result = {"index": idx, "error": str(getattr(e, "detail", e)) or type(e).__name__}
+        result["request"] = request
+        await asyncio.to_thread(self.store.finish, job_id, idx, result)
+
+    async def _run(self):
+        while True:
+            free = self.max_inflight - len(self._inflight)
+            claimed = await asyncio.to_thread(self.store.claim, free) if free > 0 else []
+            # Similar-length contexts end up in the same bulk batch: less padding
+            claimed.sort(key=lambda item: len(item[2].get("text", "")))
+            for job_id, idx, request in claimed:
+                task = asyncio.create_task(self._process(job_id, idx, request))
+                self._inflight[task] = job_id
+                task.add_done_callback(self._finished)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_s)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,107 @@
+"""
+Map-reduce analysis of whole sections and filings.
+
+A full Item 1A is far beyond one prompt, so the document is split into
+chunks that fit the context budget (map): each chunk is asked for the risk
+findings it contains, as a short list. The per-chunk lists are merged,
+near-duplicate findings collapsed (keeping every chunk that raised them as
+a citation), and summarized into one answer (reduce), in rounds if the
+findings themselves exceed the budget. If they still do not fit after the
+last round, every finding is shortened to an equal share of the budget
+(`fit_findings`) rather than dropping whole groups.
+
+Chunks are content-defined (`app.retrieval.content_chunks`): an edited or
+inserted paragraph changes only the chunk around it, so next year's filing
+reuses the stored answers for every chunk whose text did not change.
+"""
+import re
+
+from app.retrieval import terms
+
+MAP_INSTRUCTION = (
+    "List each distinct risk in this excerpt that is relevant to the question, one per line, "
+    "starting with '- '. Answer '- None' if there is none."
+)
+REDUCE_INSTRUCTION = (
+    "Using only these findings, write a concise summary answering the question. "
+    "Cite the chunk IDs in brackets after each point."
+)
+DUPLICATE_JACCARD = 0.7  # findings sharing this share of their terms are merged
+
+_BULLET_RE = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s*")
+_NONE_RE = re.compile(r"^(none|n/a|no (relevant )?risks?)\b", re.IGNORECASE)
+
+
+def parse_findings(answer):
+    """Findings listed in a map answer, one per line; '- None' gives []."""
+    findings = []
+    for line in answer.splitlines():
+        line = _BULLET_RE.sub("", line).strip()
+        if line and not _NONE_RE.match(line):
+            findings.append(line)
+    return findings
+
+
+def merge_findings(per_chunk):
+    """
+    per_chunk: (chunk_id, findings) pairs in document order. Returns
+    [{"finding", "citations"}], near-duplicates merged into the first
+    occurrence with the citations of all of them.
+    """
+    merged = []
+    for chunk_id, findings in per_chunk:
+        for finding in findings:
+            finding_terms = set(terms(finding))
+            for entry in merged:
+                union = finding_terms | entry["terms"]
+                if union and len(finding_terms & entry["terms"]) / len(union) >= DUPLICATE_JACCARD:
+                    if chunk_id not in entry["citations"]:
+                        entry["citations"].append(chunk_id)
+                    break
+            else:
+                merged.append({"finding": finding, "citations": [chunk_id], "terms": finding_terms})
+    return [{"finding": e["finding"], "citations": e["citations"]} for e in merged]
+
+
+def format_findings(findings):
+    """Findings as reduce-prompt context lines: `- finding [chunk ids]`."""
+    return "\n".join(f"- {f['finding']} [{', '.join(f['citations'])}]" for f in findings)
+
+
+def group_findings(findings, tokenizer, budget):
+    """Split findings into groups whose formatted text fits `budget` tokens."""
+    groups, current, used = [], [], 0
+    for finding in findings:
+        n_tokens = len(tokenizer(format_findings([finding]), add_special_tokens=False)["input_ids"]) + 1
+        if current and used + n_tokens > budget:
+            groups.append(current)
+            current, used = [], 0
+        current.append(finding)
+        used += n_tokens
+    if current:
+        groups.append(current)
+    return groups
+
+
+def fit_findings(findings, tokenizer, budget):
+    """
+    (findings, complete): the findings cut down to one `budget`-token group
+    for the last reduce round. Each keeps an equal share of the budget,
+    citations included, with its text shortened to fit. If even that leaves
+    no room for some, only the first group that fits is kept. `complete` is
+    False when anything was shortened or left out.
+    """
+    groups = group_findings(findings, tokenizer, budget)
+    if len(groups) <= 1:
+        return findings, True
+    share = budget // len(findings)
+    fitted = []
+    for finding in findings:
+        overhead = len(tokenizer(format_findings([{**finding, "finding": ""}]), add_special_tokens=False)["input_ids"]) + 1
+        if share <= overhead:
+            fitted = None  # Too many findings to keep them all
+            break
+        ids = tokenizer(finding["finding"], add_special_tokens=False)["input_ids"][:share - overhead]
+        fitted.append({**finding, "finding": tokenizer.decode(ids).strip()})
+    # Decoding and re-encoding can shift a token or two; the first group always fits
+    return group_findings(fitted or findings, tokenizer, budget)[0], False
@@ -1,22 +1,172 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
-from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+from contextlib import asynccontextmanager, nullcontext
 from prometheus_fastapi_instrumentator import Instrumentator
+import asyncio
+import hashlib
+import json
 import os
+import time
 import torch
 from transformers import AutoTokenizer, AutoModelForCausalLM
 
+from app.batching import BatchScheduler, QueueFullError
+from app.cache import LRUCache, ResponseCache, SQLiteCache, cache_key, shared_cache_from_url
+from app.generation import IncrementalDecoder, generate_batch
+from app.prefix_cache import PrefixKVCache
+from app.prompts import TEMPLATE_ID, PromptBuilder
+from app.retrieval import SectionIndex, content_chunks, select_from_text
+from app.section_store import SectionStore, normalize_item
+from app.profiling import SlowBatchProfiler, record_memory
+from app.cpu_inference import configure_threads, load_cpu_model
+from app.adapters import AdapterRegistry, discover_adapters
+from app.speculative import SpeculativeDecoder, check_compatible
+from app.jobs import JobRunner, JobStore
+from app.scoring import RiskScorer, load_calibration
+from app.longdoc import (
+    MAP_INSTRUCTION,
+    REDUCE_INSTRUCTION,
+    fit_findings,
+    format_findings,
+    group_findings,
+    merge_findings,
+    parse_findings,
+)
+from app.metrics import (
+    ADAPTER_REQUESTS,
+    DOCUMENT_CHUNKS,
+    DOCUMENT_REDUCE_ROUNDS,
+    INTER_TOKEN_LATENCY,
+    MODEL_LOAD_SECONDS,
+    REQUESTS_EXPIRED,
+    STARTUP_SECONDS,
+    TIME_TO_FIRST_TOKEN,
+)
+
 # Configuration
 # In production, this would be the path to the downloaded adapter from Colab
 ADAPTER_PATH = "./llama-3-8b-financial-risk" # Explicit local path
 BASE_MODEL = "meta-llama/Meta-Llama-3-8B-Instruct"
 
+# Micro-batching: how many concurrent requests share one generation, and how
+# long the first request in a batch waits for company.
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "8"))
+BATCH_WAIT_MS = float(os.getenv("BATCH_WAIT_MS", "10"))
+# Answer length: MAX_NEW_TOKENS unless a request asks for fewer or more, up
+# to MAX_NEW_TOKENS_LIMIT. Generation also stops at <|eot_id|>.
+MAX_NEW_TOKENS = int(os.getenv("MAX_NEW_TOKENS", "200"))
+MAX_NEW_TOKENS_LIMIT = int(os.getenv("MAX_NEW_TOKENS_LIMIT", "512"))
+
+# Admission control: generations running at once, requests allowed to wait
+# behind them, and the default/maximum time a request may take end to end.
+INFERENCE_CONCURRENCY = int(os.getenv("INFERENCE_CONCURRENCY", "1"))
+MAX_QUEUE_SIZE = int(os.getenv("MAX_QUEUE_SIZE", "64"))
+REQUEST_TIMEOUT_S = float(os.getenv("REQUEST_TIMEOUT_S", "120"))
+DISCONNECT_POLL_S = 0.5
+
+# Response cache: in-process LRU (bytes, seconds) plus an optional shared tier
+# such as sqlite:////cache/responses.db on a volume all replicas mount.
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+CACHE_TTL_S = float(os.getenv("CACHE_TTL_S", "86400"))
+CACHE_SHARED_URL = os.getenv("CACHE_SHARED_URL", "")
+CACHE_BYPASS_HEADER = "X-Cache-Bypass"
+
+# Prefix KV reuse: the system turn is prefilled once at startup; system +
+# context prefixes asked about repeatedly are kept in an LRU of this size.
+# Set PREFIX_CACHE_ENABLED=0 to compare prefill latency without it.
+PREFIX_CACHE_ENABLED = os.getenv("PREFIX_CACHE_ENABLED", "1") == "1"
+PREFIX_CACHE_MAX_MB = int(os.getenv("PREFIX_CACHE_MAX_MB", "1024"))
+
+# Retrieval: contexts longer than CONTEXT_TOKEN_BUDGET tokens (or named by
+# ticker and section) are reduced to the most relevant chunks within it; the
+# prompt builder cuts whatever is still over the budget.
+RETRIEVAL_INDEX_DIR = os.getenv("RETRIEVAL_INDEX_DIR", "data/index")
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "768"))
+# Section store written by parse_10k.py: requests naming ticker, fiscal_year
+# and section read that exact section instead of searching the index.
+SECTION_STORE_DIR = os.getenv("SECTION_STORE_DIR", "data/processed")
+
+# Whole-document analysis (/analyze/document): chunks of up to
+# CONTEXT_TOKEN_BUDGET tokens are analyzed DOCUMENT_PARALLEL at a time (enough
+# to fill a batch without flooding the queue), then their findings reduced.
+DOCUMENT_PARALLEL = int(os.getenv("DOCUMENT_PARALLEL", str(MAX_BATCH_SIZE)))
+DOCUMENT_TIMEOUT_S = float(os.getenv("DOCUMENT_TIMEOUT_S", "900"))
+MAX_REDUCE_ROUNDS = 4
+# Chunk (map) answers are also kept in MAP_STORE_PATH with no TTL, so a
+# filing analyzed next year reuses them for every unchanged chunk long after
+# the response cache has forgotten them. Rows are keyed by model version and
+# prompt template, so a retrained model or a new template never reads an old
+# answer. Empty = response cache only.
+MAP_STORE_PATH = os.getenv("MAP_STORE_PATH", "document_cache/map_answers.db")
+
+# Cold start: a merged export from train/export_merged.py is loaded when
+# present (no adapter to apply); WARMUP_TOKENS are generated once before
+# /ready reports ready.
+MERGED_MODEL_PATH = os.getenv("MERGED_MODEL_PATH", "./llama-3-8b-financial-risk-merged")
+WARMUP_TOKENS = int(os.getenv("WARMUP_TOKENS", "8"))
+
+# Device: "auto" picks MPS, then CUDA, then CPU. On CPU the Linear weights
+# are int8 (CPU_QUANTIZATION: int8 | dynamic | none, see app/cpu_inference.py),
+# the rest computes in CPU_DTYPE (bfloat16 needs AVX512-BF16/AMX to be fast,
+# otherwise use float32), on CPU_THREADS threads (0 = the container CPU limit).
+INFERENCE_DEVICE = os.getenv("INFERENCE_DEVICE", "auto")
+CPU_QUANTIZATION = os.getenv("CPU_QUANTIZATION", "int8")
+CPU_DTYPE = os.getenv("CPU_DTYPE", "bfloat16")
+CPU_THREADS = int(os.getenv("CPU_THREADS", "0"))
+
+# Multi-adapter serving: every PEFT adapter under ADAPTER_DIR (one per sector
+# in app/sectors.py, e.g. adapters/finance) is served from a single copy of
+# BASE_MODEL, with ADAPTER_PATH as the default. Requests pick one by name or
+# by ticker; loaded adapters stay within ADAPTER_CACHE_MB (LRU).
+ADAPTER_DIR = os.getenv("ADAPTER_DIR", "./adapters")
+ADAPTER_CACHE_MB = int(os.getenv("ADAPTER_CACHE_MB", "512"))
+
+# Speculative decoding (app/speculative.py): a small draft model sharing the
+# tokenizer (e.g. meta-llama/Llama-3.2-1B-Instruct) proposes SPEC_LOOKAHEAD
+# tokens per target pass. Used for single-request batches; it turns itself
+# off while acceptance is below SPEC_MIN_ACCEPTANCE. Empty SPEC_DRAFT_MODEL = off.
+SPEC_DRAFT_MODEL = os.getenv("SPEC_DRAFT_MODEL", "")
+SPEC_LOOKAHEAD = int(os.getenv("SPEC_LOOKAHEAD", "4"))
+SPEC_MIN_ACCEPTANCE = float(os.getenv("SPEC_MIN_ACCEPTANCE", "0.5"))
+
+# Bulk jobs (app/jobs.py): persisted in JOB_STORE_PATH and answered through
+# the scheduler's low-priority lane in batches of up to BULK_BATCH_SIZE, with
+# JOB_MAX_INFLIGHT items queued at a time. Items wait behind interactive
+# traffic, so their deadline (JOB_ITEM_TIMEOUT_S) is generous.
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", "jobs/jobs.db")
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "32"))
+JOB_MAX_INFLIGHT = int(os.getenv("JOB_MAX_INFLIGHT", "128"))
+JOB_ITEM_TIMEOUT_S = float(os.getenv("JOB_ITEM_TIMEOUT_S", "3600"))
+JOB_RESULTS_POLL_S = 1.0
+
+# Risk scoring (/score, app/scoring.py): one forward pass, no decoding, per
+# batch of up to SCORE_MAX_BATCH_TOKENS prompt tokens. SCORE_CALIBRATION is
+# the Platt fit from eval/calibrate_score.py; without it scores are the raw
+# expected rating.
+SCORE_MAX_BATCH_TOKENS = int(os.getenv("SCORE_MAX_BATCH_TOKENS", "16384"))
+SCORE_CALIBRATION = os.getenv("SCORE_CALIBRATION", "results/score_calibration.json")
+MAX_SCORE_TEXTS = 1024
+
+# Opt-in profiling of slow batches (app/profiling.py): batches slower than
+# PROFILE_SLOW_MS get a stack dump, and a PROFILE_SAMPLE_RATE share of
+# batches run under torch.profiler with the trace kept if they were slow.
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/risk-api-profiles")
 
 
 class AnalysisRequest(BaseModel):
-    text: str
+    text: str = "" # Context to analyze; long texts are narrowed down by retrieval
     query: str
+    ticker: Optional[str] = None # Or: pull context from the section index...
+    section: Optional[str] = None # ...optionally limited to e.g. "Item 1A"
+    fiscal_year: Optional[int] = None # With ticker+section: that filing's section only
+    timeout_s: Optional[float] = None # Per-request deadline, capped at REQUEST_TIMEOUT_S
+    adapter: Optional[str] = None # LoRA adapter to answer with; default: the ticker's sector adapter
+    max_new_tokens: Optional[int] = None # Answer length limit; default MAX_NEW_TOKENS, capped at MAX_NEW_TOKENS_LIMIT
+    verbatim: bool = False # Use `text` as the context without retrieval (still cut to CONTEXT_TOKEN_BUDGET tokens)
 
 # Request Models
 class QueryRequest(BaseModel):
@@ -25,54 +175,338 @@ class QueryRequest(BaseModel):
 
 class AnalysisResponse(BaseModel):
     answer: str
+    citations: List[str] = [] # Chunk IDs the context was built from
+
+class Finding(BaseModel):
+    finding: str
+    citations: List[str] # Chunks that raised it
+
+class DocumentAnalysisResponse(BaseModel):
+    answer: str
+    citations: List[str] = []
+    findings: List[Finding] = []
+    chunks: int # Map-step chunks the document was split into...
+    chunks_cached: int # ...of which this many were answered from the cache
+    truncated: bool = False # Findings were shortened or left out to fit the final summary
+
+class ScoreRequest(BaseModel):
+    texts: List[str] # Passages to score; each is cut to CONTEXT_TOKEN_BUDGET tokens
+    ticker: Optional[str] = None # Picks the sector adapter, as for /analyze
+    adapter: Optional[str] = None
+    timeout_s: Optional[float] = None # Deadline for all passes, capped at REQUEST_TIMEOUT_S
+
+class RiskScore(BaseModel):
+    score: float # Calibrated probability of material risk (the raw score if uncalibrated)
+    raw_score: float # Expected rating from the label probabilities: low 0, medium 0.5, high 1
+    probabilities: Dict[str, float]
+
+class ScoreResponse(BaseModel):
+    scores: List[RiskScore]
+    calibrated: bool
+
+class JobRequest(BaseModel):
+    items: List[AnalysisRequest] = [] # Explicit (text or section reference, query) pairs...
+    queries: List[str] = [] # ...and/or these queries asked of every stored `section`
+    section: Optional[str] = None # e.g. "Item 1A": every such section in the section store...
+    tickers: Optional[List[str]] = None # ...optionally only these tickers'
+    adapter: Optional[str] = None # Adapter for the expanded (queries x sections) items
 
 # Global Variables
 model = None
 tokenizer = None
+scheduler = None
+prompts = None
+prefix_cache = None
+response_cache = None
+section_index = None
+section_store = None
+adapters = None
+speculative = None
+scorer = None
+job_store = None
+map_store = None
+job_runner = None
+model_version = None
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    # Load model on startup
-    global model, tokenizer
-    print("Loading model... (This may take time)")
-    
-    model_path = "./llama-3-8b-financial-risk" # Force use local fine-tuned model
-    # model_path = os.getenv("MODEL_PATH", "meta-llama/Meta-Llama-3-8B-Instruct")
+startup = {"phase": "starting", "timings": {}, "error": None}
+_startup_clock = {"started": time.monotonic(), "phase_started": time.monotonic()}
+
+def _enter_phase(phase):
+    """Record how long the current startup phase took and move to `phase`."""
+    now = time.monotonic()
+    finished = startup["phase"]
+    seconds = now - _startup_clock["phase_started"]
+    startup["timings"][finished] = round(seconds, 3)
+    STARTUP_SECONDS.labels(phase=finished).set(seconds)
+    startup["phase"] = phase
+    _startup_clock["phase_started"] = now
+    if phase == "ready":
+        total = now - _startup_clock["started"]
+        startup["timings"]["total"] = round(total, 3)
+        STARTUP_SECONDS.labels(phase="total").set(total)
+
+def _load_draft(device):
+    """SpeculativeDecoder for SPEC_DRAFT_MODEL, or None (plain decoding) if it can't be used."""
     try:
-        # 1. Detect Device (Same as eval_qa.py)
-        if torch.backends.mps.is_available():
-            device = "mps"
-            print("✨ Using MPS (Mac Metal).")
-        elif torch.cuda.is_available():
-            device = "cuda"
-            print("✨ Using CUDA.")
+        check_compatible(tokenizer, AutoTokenizer.from_pretrained(SPEC_DRAFT_MODEL))
+        if device == "cpu":
+            draft = load_cpu_model(SPEC_DRAFT_MODEL, "none", getattr(torch, CPU_DTYPE))
         else:
-            device = "cpu"
-            print("⚠️ Using CPU.")
+            draft = AutoModelForCausalLM.from_pretrained(
+                SPEC_DRAFT_MODEL,
+                device_map=None if device == "mps" else {"": device},
+                torch_dtype=torch.float16,
+                low_cpu_mem_usage=True,
+            )
+            if device == "mps":
+                draft = draft.to(device)
+        draft.eval()
+    except Exception as e:
+        print(f"⚠️ Draft model {SPEC_DRAFT_MODEL} not usable, speculative decoding off: {e}")
+        return None
+    print(f"✅ Speculative decoding with {SPEC_DRAFT_MODEL} (lookahead {SPEC_LOOKAHEAD}).")
+    return SpeculativeDecoder(model, draft, tokenizer, SPEC_LOOKAHEAD, SPEC_MIN_ACCEPTANCE)
+
+def _checkpoint_version(path):
+    """
+    `path` plus a hash of its files' names, sizes and modification times:
+    a model retrained into the same directory gets a new version. A hub id
+    is returned as is.
+    """
+    if not os.path.isdir(path):
+        return path
+    h = hashlib.sha256()
+    for name in sorted(os.listdir(path)):
+        stat = os.stat(os.path.join(path, name))
+        h.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns}\n".encode("utf-8"))
+    return f"{path}@{h.hexdigest()[:12]}"
+
+def _load():
+    """Blocking part of startup, run in a worker thread so /live answers meanwhile."""
+    global model, tokenizer, prompts, prefix_cache, section_index, section_store, adapters, speculative, scorer
+    global model_version
+    # 1. Detect Device (Same as eval_qa.py), unless INFERENCE_DEVICE pins it
+    if INFERENCE_DEVICE != "auto":
+        device = INFERENCE_DEVICE
+        print(f"✨ Using {device} (INFERENCE_DEVICE).")
+    elif torch.backends.mps.is_available():
+        device = "mps"
+        print("✨ Using MPS (Mac Metal).")
+    elif torch.cuda.is_available():
+        device = "cuda"
+        print("✨ Using CUDA.")
+    else:
+        device = "cpu"
+        print("⚠️ Using CPU.")
+    if device == "cpu":
+        threads = configure_threads(CPU_THREADS, INFERENCE_CONCURRENCY)
+        print(f"CPU mode: {CPU_QUANTIZATION} weights, {CPU_DTYPE} compute, {threads} threads.")
 
-        tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL)
-        
-        # 2. Load Model (Mirroring eval_qa.py logic)
-        # We load directly from the adapter path if it exists, letting transformers handle the base model fetch
+    _enter_phase("loading_tokenizer")
+    load_started = time.perf_counter()
+    sector_adapters = discover_adapters(ADAPTER_DIR)
+    # Sector adapters are trained on the base model, not on the merged export
+    merged = not sector_adapters and os.path.exists(os.path.join(MERGED_MODEL_PATH, "config.json"))
+    tokenizer = AutoTokenizer.from_pretrained(MERGED_MODEL_PATH if merged else BASE_MODEL)
+    # Batched prompts are left-padded so generation continues from aligned positions
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    tokenizer.padding_side = "left"
+    # Template pieces are tokenized once, here
+    prompts = PromptBuilder(tokenizer)
+    
+    # 2. Load Model. The merged export (train/export_merged.py) is a plain
+    # safetensors checkpoint: it is memory-mapped and materialized straight
+    # on the target device, with no adapter to fetch and apply. Otherwise we
+    # load from the adapter path, letting transformers handle the base model fetch.
+    _enter_phase("loading_model")
+    if merged:
+        load_path = MERGED_MODEL_PATH
+    elif sector_adapters:
+        load_path = BASE_MODEL
+    else:
         load_path = ADAPTER_PATH if os.path.exists(ADAPTER_PATH) else BASE_MODEL
-        print(f"Loading model from {load_path}...")
-        
+    print(f"Loading model from {load_path}...")
+    
+    quantization = CPU_QUANTIZATION
+    if device == "cpu":
+        if sector_adapters and quantization != "none":
+            # PEFT cannot attach LoRA layers to our int8 Linear replacements
+            print(f"⚠️ CPU_QUANTIZATION={quantization} is not supported with adapters; using {CPU_DTYPE} weights.")
+            quantization = "none"
+        model = load_cpu_model(load_path, quantization, getattr(torch, CPU_DTYPE))
+    else:
         model = AutoModelForCausalLM.from_pretrained(
             load_path, 
-            device_map=None, # Disable auto-splitting which breaks MPS
+            # A single-device map loads weights directly where they run (no
+            # full CPU copy first); MPS still goes through .to(), since
+            # auto-splitting breaks it.
+            device_map=None if device == "mps" else {"": device},
             torch_dtype=torch.float16,
-        ).to(device)
-        
-        print("✅ Model loaded successfully!")
+            low_cpu_mem_usage=True,
+        )
+        if device == "mps":
+            model = model.to(device)
+    model.eval()
+    if sector_adapters:
+        registered = dict(sector_adapters)
+        default = None
+        if os.path.exists(os.path.join(ADAPTER_PATH, "adapter_config.json")):
+            registered.setdefault("default", ADAPTER_PATH)
+            default = "default"
+        adapters = AdapterRegistry(model, registered, ADAPTER_CACHE_MB * 1024 * 1024, default)
+        model = adapters.model
+        print(f"Serving adapters {', '.join(adapters.names())} (default: {adapters.default}).")
+    # Part of the cache keys, so a new adapter or a retrained model never
+    # serves stale answers
+    model_version = os.getenv("MODEL_VERSION") or _checkpoint_version(load_path)
+    if device == "cpu":
+        # Quantized weights give (slightly) different answers
+        model_version += f":{quantization}-{CPU_DTYPE}"
+    load_seconds = time.perf_counter() - load_started
+    MODEL_LOAD_SECONDS.set(load_seconds)
+    record_memory(device)
+    
+    print(f"✅ Model loaded successfully in {load_seconds:.1f}s!")
+
+    if SPEC_DRAFT_MODEL:
+        speculative = _load_draft(device)
+
+    try:
+        calibration = load_calibration(SCORE_CALIBRATION)
+        scorer = RiskScorer(model, tokenizer, prompts, CONTEXT_TOKEN_BUDGET, SCORE_MAX_BATCH_TOKENS, calibration)
+        print(f"Risk scoring ready ({'calibrated' if calibration else 'uncalibrated'}).")
+    except ValueError as e:
+        print(f"⚠️ /score disabled: {e}")
+
+    _enter_phase("loading_indexes")
+    if PREFIX_CACHE_ENABLED:
+        prefix_cache = PrefixKVCache(model, PREFIX_CACHE_MAX_MB * 1024 * 1024)
+        n_tokens = prefix_cache.pin(prompts.system)
+        print(f"Cached KV for the {n_tokens}-token system prompt.")
+
+    if os.path.exists(os.path.join(RETRIEVAL_INDEX_DIR, "meta.json")):
+        section_index = SectionIndex(RETRIEVAL_INDEX_DIR)
+        print(f"Loaded retrieval index with {len(section_index)} chunks.")
+    else:
+        print(f"No retrieval index at {RETRIEVAL_INDEX_DIR}; ticker/section requests are disabled.")
+
+    if os.path.exists(os.path.join(SECTION_STORE_DIR, "sections_index.npy")):
+        section_store = SectionStore(SECTION_STORE_DIR)
+        print(f"Opened section store with {len(section_store)} sections.")
+
+    # 3. Warmup: the first forward passes allocate buffers and pick kernels,
+    # so run one short generation before taking traffic.
+    _enter_phase("warming_up")
+    if WARMUP_TOKENS > 0:
+        generate_batch(
+            model, tokenizer, [build_prompt("Warmup context.", "What is the main risk?")],
+            max_new_tokens=WARMUP_TOKENS, prefix_cache=prefix_cache,
+        )
+    return device
+
+async def _startup():
+    global model, scheduler, response_cache, job_runner
+    try:
+        device = await asyncio.to_thread(_load)
+
+        response_cache = ResponseCache(
+            LRUCache(CACHE_MAX_BYTES, CACHE_TTL_S),
+            shared_cache_from_url(CACHE_SHARED_URL, CACHE_TTL_S),
+        )
+
+        profiler = SlowBatchProfiler(PROFILE_SLOW_MS / 1000, PROFILE_SAMPLE_RATE, PROFILE_DIR)
+
+        def decode(batch, should_stop, on_token, batch_prefix_cache, max_new_tokens):
+            max_new_tokens = [MAX_NEW_TOKENS if n is None else n for n in max_new_tokens]
+            # A lone request is latency-bound: let the draft model speed it up
+            if speculative is not None and len(batch) == 1 and speculative.enabled():
+                return [speculative.generate(batch[0], max_new_tokens[0], should_stop, on_token)]
+            return generate_batch(
+                model, tokenizer, batch, max_new_tokens=max_new_tokens,
+                should_stop=should_stop, on_token=on_token, prefix_cache=batch_prefix_cache,
+            )
+
+        def run_batch(batch, should_stop, on_token, adapter, max_new_tokens):
+            if adapters is None:
+                with profiler.batch():
+                    answers = decode(batch, should_stop, on_token, prefix_cache, max_new_tokens)
+            else:
+                # The batch is single-adapter (the scheduler groups by adapter).
+                # Cached prefix KV was computed with the default adapter only.
+                with adapters.use(adapter), profiler.batch():
+                    answers = decode(batch, should_stop, on_token,
+                                     prefix_cache if adapter == adapters.default else None, max_new_tokens)
+            record_memory(device)
+            return answers
+
+        batch_scheduler = BatchScheduler(
+            run_batch,
+            max_batch_size=MAX_BATCH_SIZE,
+            max_wait_ms=BATCH_WAIT_MS,
+            concurrency=INFERENCE_CONCURRENCY,
+            max_queue_size=MAX_QUEUE_SIZE,
+            bulk_batch_size=BULK_BATCH_SIZE,
+        )
+        batch_scheduler.start()
+        scheduler = batch_scheduler
+        # Picks up jobs submitted while loading, and ones left from the last run
+        job_runner = JobRunner(job_store, _run_job_item, JOB_MAX_INFLIGHT)
+        job_runner.start()
+        _enter_phase("ready")
+        print(f"✅ Ready in {startup['timings']['total']:.1f}s: {startup['timings']}")
 
     except Exception as e:
         print(f"❌ Critical Error loading model: {e}")
-        # In a real app, we might want to crash here, or fallback
+        # /live turns 503 so the orchestrator restarts the pod
+        startup["error"] = str(e)
+        _enter_phase("failed")
         model = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load model on startup, in the background: the server answers /live
+    # (and reports progress on /ready) while the weights are loading.
+    global scheduler, prefix_cache, response_cache, section_index, section_store, adapters, speculative, model
+    global scorer, job_store, job_runner, map_store
+    print("Loading model... (This may take time)")
+    # Opened first so jobs can be submitted (and queue up) while the model loads
+    os.makedirs(os.path.dirname(JOB_STORE_PATH) or ".", exist_ok=True)
+    job_store = JobStore(JOB_STORE_PATH)
+    if MAP_STORE_PATH:
+        os.makedirs(os.path.dirname(MAP_STORE_PATH) or ".", exist_ok=True)
+        map_store = SQLiteCache(MAP_STORE_PATH, ttl_s=None)
+    _startup_clock["started"] = _startup_clock["phase_started"] = time.monotonic()
+    startup_task = asyncio.create_task(_startup())
     
     yield
     
     # Cleaning up
+    if not startup_task.done():
+        startup_task.cancel()
+    if job_runner is not None:
+        # Unfinished items go back to pending when the store is next opened
+        await job_runner.stop()
+        job_runner = None
+    if scheduler is not None:
+        await scheduler.stop()
+        scheduler = None
+    prefix_cache = None
+    section_index = None
+    if section_store is not None:
+        section_store.close()
+        section_store = None
+    if response_cache is not None:
+        response_cache.close()
+        response_cache = None
+    adapters = None
+    speculative = None
+    scorer = None
+    job_store.close()
+    job_store = None
+    if map_store is not None:
+        map_store.close()
+        map_store = None
     model = None
 
 app = FastAPI(title="Financial Risk Intelligence API", version="1.0.0", lifespan=lifespan)
@@ -84,34 +518,551 @@ def health_check():
          raise HTTPException(status_code=503, detail="Model not loaded")
     return {"status": "healthy", "model_loaded": True}
 
+@app.get("/live")
+def live():
+    """Liveness: the process is up and startup has not failed (loading counts as alive)."""
+    if startup["phase"] == "failed":
+        raise HTTPException(status_code=503, detail=startup)
+    return {"status": "alive", **startup}
+
+@app.get("/ready")
+def ready():
+    """Readiness: model loaded, warmed up and the scheduler taking requests."""
+    if startup["phase"] != "ready" or scheduler is None:
+        raise HTTPException(status_code=503, detail=startup)
+    return {"status": "ready", **startup}
+
+@app.get("/adapters")
+def list_adapters():
+    """Adapters a request may name, which are loaded right now, and the default."""
+    if adapters is None:
+        return {"adapters": [], "loaded": [], "default": None}
+    return {"adapters": adapters.names(), "loaded": adapters.loaded(), "default": adapters.default}
+
+def retrieve_context(request: AnalysisRequest):
+    """
+    Context text and chunk-ID citations for a request.
+
+    Named ticker/fiscal year/section: top chunks of that section from the
+    section store. Named ticker/section: top chunks from the section index.
+    Text over CONTEXT_TOKEN_BUDGET tokens: top chunks of that text, unless
+    the request is `verbatim`. Otherwise the text as given.
+    """
+    if request.ticker and request.fiscal_year and request.section:
+        if section_store is None:
+            raise HTTPException(status_code=503, detail="Section store is not loaded")
+        try:
+            text = section_store.get(request.ticker, request.fiscal_year, request.section)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        if text is None:
+            raise HTTPException(status_code=404, detail="No stored section for ticker/fiscal_year/section")
+        item = request.section.lower().replace(" ", "")
+        chunks = select_from_text(
+            text, request.query, tokenizer, CONTEXT_TOKEN_BUDGET,
+            id_prefix=f"{request.ticker.upper()}:{request.fiscal_year}:{item}",
+        )
+    elif request.ticker:
+        if section_index is None:
+            raise HTTPException(status_code=503, detail="Retrieval index is not loaded")
+        chunks = section_index.search(request.query, CONTEXT_TOKEN_BUDGET, request.ticker, request.section)
+        if not chunks:
+            raise HTTPException(status_code=404, detail="No indexed sections match ticker/section")
+    elif not request.verbatim and _over_budget(request.text):
+        chunks = select_from_text(request.text, request.query, tokenizer, CONTEXT_TOKEN_BUDGET)
+    else:
+        return request.text, []
+    context = "\n\n".join(f"[{chunk_id}]\n{text}" for chunk_id, text in chunks)
+    return context, [chunk_id for chunk_id, _ in chunks]
+
+def _over_budget(text):
+    # A token is at least one character, so short texts need no tokenizing
+    return len(text) > CONTEXT_TOKEN_BUDGET and len(prompts.encode(text)) > CONTEXT_TOKEN_BUDGET
+
+def build_prompt(context, query):
+    """
+    Prompt as (system, context, question) token-id segments, the context cut
+    to CONTEXT_TOKEN_BUDGET tokens. The first two are the reusable prefixes
+    looked up in the prefix KV cache.
+    """
+    return prompts.build(context, query, CONTEXT_TOKEN_BUDGET)
+
+def _max_new_tokens(request: AnalysisRequest):
+    if request.max_new_tokens is None:
+        return MAX_NEW_TOKENS
+    return max(1, min(request.max_new_tokens, MAX_NEW_TOKENS_LIMIT))
+
+def _cache_key(context, query, adapter=None, max_new_tokens=MAX_NEW_TOKENS):
+    params = {"max_new_tokens": max_new_tokens, "decoding": "greedy", "template": TEMPLATE_ID}
+    return cache_key(context, query, params, model_version if adapter is None else f"{model_version}+{adapter}")
+
+def _resolve_adapter(request: AnalysisRequest):
+    """Adapter serving this request: None unless several adapters are registered."""
+    if adapters is None:
+        if request.adapter:
+            raise HTTPException(status_code=422, detail="This server does not serve multiple adapters")
+        ADAPTER_REQUESTS.labels(adapter="default").inc()
+        return None
+    try:
+        adapter = adapters.resolve(request.adapter, request.ticker)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    ADAPTER_REQUESTS.labels(adapter=adapter).inc()
+    return adapter
+
+def _bypass_cache(http_request: Request):
+    """`X-Cache-Bypass: 1` or `Cache-Control: no-cache` forces a fresh generation."""
+    bypass = http_request.headers.get(CACHE_BYPASS_HEADER, "").lower() in ("1", "true", "yes")
+    return bypass or "no-cache" in http_request.headers.get("Cache-Control", "").lower()
+
+def _busy_error():
+    return HTTPException(
+        status_code=503,
+        detail="Server busy, try again later",
+        headers={"Retry-After": str(scheduler.retry_after())},
+    )
+
+async def _unless_disconnected(http_request: Request, coro):
+    """Await `coro`, cancelling it (and its generation) if the client hangs up."""
+    task = asyncio.ensure_future(coro)
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_S)
+        if done:
+            return task.result()
+        if await http_request.is_disconnected():
+            task.cancel()
+            REQUESTS_EXPIRED.inc()
+            raise HTTPException(status_code=499, detail="Client closed request")
+
 @app.post("/analyze", response_model=AnalysisResponse)
-async def analyze_risk(request: AnalysisRequest):
+async def analyze_risk(request: AnalysisRequest, http_request: Request, response: Response):
     """
     Analyzes the provided text for risks based on the query.
     """
-    if model is None:
+    if model is None or scheduler is None:
         raise HTTPException(status_code=503, detail="Model is loading or failed to load")
     
+    adapter = _resolve_adapter(request)
+    # Chunking/BM25 over a long context is CPU work; keep it off the event loop
+    context, citations = await asyncio.to_thread(retrieve_context, request)
+
+    # Repeated (context, query) pairs are answered from the cache; a bypass
+    # request still refreshes the cached answer afterwards.
+    max_new_tokens = _max_new_tokens(request)
+    key = _cache_key(context, request.query, adapter, max_new_tokens)
+    if _bypass_cache(http_request):
+        response.headers["X-Cache"] = "BYPASS"
+    else:
+        cached = await response_cache.get(key)
+        if cached is not None:
+            response.headers["X-Cache"] = "HIT"
+            return {"answer": cached, "citations": citations}
+        response.headers["X-Cache"] = "MISS"
+
     # Real Inference Logic
-    prompt = f"""<|begin_of_text|><|start_header_id|>system<|end_header_id|>
+    prompt = await asyncio.to_thread(build_prompt, context, request.query)
+    # Queued and batched with other in-flight requests; only new tokens come back
+    timeout = min(request.timeout_s or REQUEST_TIMEOUT_S, REQUEST_TIMEOUT_S)
+    try:
+        answer = await _unless_disconnected(
+            http_request, scheduler.submit(prompt, timeout, group=adapter, max_new_tokens=max_new_tokens)
+        )
+    except QueueFullError:
+        raise _busy_error()
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Request deadline exceeded")
+    
+    await response_cache.set(key, answer)
+    return {"answer": answer, "citations": citations}
 
-You are a financial risk analyst.<|eot_id|><|start_header_id|>user<|end_header_id|>
+def _score_batch(prompt_ids, adapter):
+    with adapters.use(adapter) if adapters is not None else nullcontext():
+        return scorer.score_ids(prompt_ids)
 
-Context:
-{request.text[:2000]}
+@app.post("/score", response_model=ScoreResponse)
+async def score_risk(request: ScoreRequest):
+    """
+    Risk scores for up to MAX_SCORE_TEXTS passages from one forward pass
+    per batch (no generation): a cheap pre-filter ahead of /analyze.
+    """
+    if scorer is None or scheduler is None:
+        raise HTTPException(status_code=503, detail="Model is loading, failed to load, or cannot score")
+    if not request.texts or len(request.texts) > MAX_SCORE_TEXTS:
+        raise HTTPException(status_code=422, detail=f"Send between 1 and {MAX_SCORE_TEXTS} texts")
 
-Question: {request.query}<|eot_id|><|start_header_id|>assistant<|end_header_id|>
-"""
-    inputs = tokenizer(prompt, return_tensors="pt").to(model.device)
-    
-    with torch.no_grad():
-        outputs = model.generate(**inputs, max_new_tokens=200)
-    
-    response_text = tokenizer.decode(outputs[0], skip_special_tokens=True)
-    # Parse out the assistant response
-    answer = response_text.split("assistant")[-1].strip()
-    
-    return {"answer": answer, "risk_score": 0.9}
+    adapter = _resolve_adapter(request)
+    deadline = time.monotonic() + min(request.timeout_s or REQUEST_TIMEOUT_S, REQUEST_TIMEOUT_S)
+    prompt_ids = await asyncio.to_thread(lambda: [scorer.prompt_ids(text) for text in request.texts])
+    scores = [None] * len(prompt_ids)
+    try:
+        for batch in scorer.batches(prompt_ids):
+            # One pass per inference slot, admitted like a generation batch, so
+            # generation batches queued meanwhile are not held up by a large request
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                raise asyncio.TimeoutError()
+            results = await scheduler.run(_score_batch, [prompt_ids[i] for i in batch], adapter, timeout=timeout)
+            for i, result in zip(batch, results):
+                scores[i] = result
+    except QueueFullError:
+        raise _busy_error()
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Request deadline exceeded")
+    return {"scores": scores, "calibrated": scorer.calibration is not None}
+
+def _load_document(request: AnalysisRequest):
+    """Full text of a stored section or of the request, and the prefix for its chunk IDs."""
+    if request.ticker and request.fiscal_year and request.section:
+        if section_store is None:
+            raise HTTPException(status_code=503, detail="Section store is not loaded")
+        try:
+            text = section_store.get(request.ticker, request.fiscal_year, request.section)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        if text is None:
+            raise HTTPException(status_code=404, detail="No stored section for ticker/fiscal_year/section")
+        item = request.section.lower().replace(" ", "")
+        return text, f"{request.ticker.upper()}:{request.fiscal_year}:{item}"
+    if not request.text:
+        raise HTTPException(status_code=422, detail="Send `text`, or `ticker`, `fiscal_year` and `section`")
+    return request.text, "doc"
+
+async def _generate_cached(context, query, adapter, deadline, max_new_tokens=MAX_NEW_TOKENS, store=None):
+    """
+    (answer, from_cache) for one prompt, through the response cache, then
+    `store` if given (a persistent SQLiteCache), then the scheduler.
+    """
+    key = _cache_key(context, query, adapter, max_new_tokens)
+    # Store rows outlive the process: the version and template prefix keeps
+    # those of an old model apart (and easy to purge)
+    store_key = f"{model_version}:{TEMPLATE_ID}:{key}"
+    cached = await response_cache.get(key)
+    if cached is None and store is not None:
+        cached = await asyncio.to_thread(store.get, store_key)
+        if cached is not None:
+            await response_cache.set(key, cached)
+    if cached is not None:
+        return cached, True
+    timeout = deadline - time.monotonic()
+    if timeout <= 0:
+        raise asyncio.TimeoutError()
+    prompt = await asyncio.to_thread(build_prompt, context, query)
+    answer = await scheduler.submit(prompt, timeout, group=adapter, max_new_tokens=max_new_tokens)
+    await response_cache.set(key, answer)
+    if store is not None:
+        await asyncio.to_thread(store.set, store_key, answer)
+    return answer, False
+
+async def _gather_all(coros):
+    """
+    Results of `coros`, run concurrently. When one fails (queue full,
+    deadline) the rest are cancelled, which drops their generations, before
+    the error is raised: nobody will read their answers.
+    """
+    tasks = [asyncio.ensure_future(coro) for coro in coros]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+def _citations(findings):
+    """Chunk IDs cited by `findings`, in document order."""
+    return sorted({c for f in findings for c in f["citations"]}, key=lambda c: int(c.rsplit("-", 1)[1]))
+
+async def _analyze_document(request: AnalysisRequest, adapter, deadline):
+    text, id_prefix = await asyncio.to_thread(_load_document, request)
+    chunks = [chunk for chunk, _ in await asyncio.to_thread(content_chunks, text, tokenizer, CONTEXT_TOKEN_BUDGET)]
+    if not chunks:
+        raise HTTPException(status_code=422, detail="The document is empty")
+
+    # Map: chunk answers are stored by chunk text, query and adapter (see
+    # MAP_STORE_PATH), so unchanged chunks of a new filing cost nothing
+    parallel = asyncio.Semaphore(DOCUMENT_PARALLEL)
+    map_query = f"{request.query}\n{MAP_INSTRUCTION}"
+
+    async def map_chunk(chunk):
+        async with parallel:
+            return await _generate_cached(chunk, map_query, adapter, deadline, store=map_store)
+
+    mapped = await _gather_all(map_chunk(chunk) for chunk in chunks)
+    cached = sum(from_cache for _, from_cache in mapped)
+    DOCUMENT_CHUNKS.labels(outcome="cached").inc(cached)
+    DOCUMENT_CHUNKS.labels(outcome="generated").inc(len(chunks) - cached)
+    findings = merge_findings(
+        (f"{id_prefix}-{i}", parse_findings(answer)) for i, (answer, _) in enumerate(mapped)
+    )
+    result = {"findings": findings, "citations": _citations(findings), "chunks": len(chunks), "chunks_cached": cached}
+    if not findings:
+        return {**result, "answer": "No relevant risks found in the document."}
+
+    # Reduce: summarize the findings, in several rounds if they exceed the budget
+    reduce_query = f"{request.query}\n{REDUCE_INSTRUCTION}"
+    partial = findings
+    for rounds in range(1, MAX_REDUCE_ROUNDS + 1):
+        groups = group_findings(partial, tokenizer, CONTEXT_TOKEN_BUDGET)
+        if len(groups) == 1 or rounds == MAX_REDUCE_ROUNDS:
+            # Out of rounds: every finding is shortened to fit one prompt
+            group, complete = fit_findings(partial, tokenizer, CONTEXT_TOKEN_BUDGET)
+            if not complete:
+                # Only chunks whose findings made it into the summary are cited
+                result["truncated"] = True
+                result["citations"] = _citations(group)
+            # The request's length limit applies to this final answer only
+            answer, _ = await _generate_cached(
+                format_findings(group), reduce_query, adapter, deadline, _max_new_tokens(request)
+            )
+            break
+        summaries = await _gather_all(
+            _generate_cached(format_findings(group), reduce_query, adapter, deadline) for group in groups
+        )
+        partial = [
+            {"finding": summary, "citations": sorted({c for f in group for c in f["citations"]})}
+            for (summary, _), group in zip(summaries, groups)
+        ]
+    DOCUMENT_REDUCE_ROUNDS.observe(rounds)
+    return {**result, "answer": answer}
+
+@app.post("/analyze/document", response_model=DocumentAnalysisResponse)
+async def analyze_document(request: AnalysisRequest, http_request: Request):
+    """
+    Analyzes a whole section or filing (map-reduce): every chunk is asked
+    for its risk findings, and the deduplicated findings are summarized
+    with the chunks that raised them as citations.
+    """
+    if model is None or scheduler is None:
+        raise HTTPException(status_code=503, detail="Model is loading or failed to load")
+
+    adapter = _resolve_adapter(request)
+    timeout = min(request.timeout_s or DOCUMENT_TIMEOUT_S, DOCUMENT_TIMEOUT_S)
+    try:
+        return await _unless_disconnected(
+            http_request, _analyze_document(request, adapter, time.monotonic() + timeout)
+        )
+    except QueueFullError:
+        raise _busy_error()
+    except asyncio.TimeoutError:
+        REQUESTS_EXPIRED.inc()
+        raise HTTPException(status_code=504, detail="Request deadline exceeded")
+
+def _sse(data, event=None):
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+async def _stream_cached(answer, citations):
+    yield _sse({"token": answer})
+    yield _sse({"answer": answer, "citations": citations}, event="done")
+
+async def _stream_tokens(future, tokens, started, deadline, key, citations):
+    """Yield SSE events for each text delta, then a final `done` event."""
+    decoder = IncrementalDecoder(tokenizer)
+    last_token_at = None
+    try:
+        while True:
+            next_token = asyncio.ensure_future(tokens.get())
+            done, _ = await asyncio.wait(
+                {next_token, future},
+                timeout=deadline - time.monotonic(),
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if next_token not in done:
+                next_token.cancel()
+                if not done:
+                    REQUESTS_EXPIRED.inc()
+                    yield _sse({"detail": "Request deadline exceeded"}, event="error")
+                    return
+                # Generation finished; every token was queued before the result was set
+                break
+            now = time.monotonic()
+            if last_token_at is None:
+                TIME_TO_FIRST_TOKEN.observe(now - started)
+            else:
+                INTER_TOKEN_LATENCY.observe(now - last_token_at)
+            last_token_at = now
+            delta = decoder.add(next_token.result())
+            if delta:
+                yield _sse({"token": delta})
+
+        while not tokens.empty():
+            delta = decoder.add(tokens.get_nowait())
+            if delta:
+                yield _sse({"token": delta})
+        if future.exception() is not None:
+            yield _sse({"detail": "Generation failed"}, event="error")
+            return
+        await response_cache.set(key, future.result())
+        yield _sse({"answer": future.result(), "citations": citations}, event="done")
+    finally:
+        # Client disconnected or deadline hit: drop the row from its batch
+        if not future.done():
+            future.cancel()
+
+@app.post("/analyze/stream")
+async def analyze_risk_stream(request: AnalysisRequest, http_request: Request):
+    """
+    Same as /analyze, but streams the answer as Server-Sent Events.
+
+    Emits `data: {"token": ...}` for each text delta and finishes with an
+    `event: done` carrying the full answer and citations. Cache hits arrive
+    as a single token event.
+    """
+    started = time.monotonic()
+    if model is None or scheduler is None:
+        raise HTTPException(status_code=503, detail="Model is loading or failed to load")
+
+    adapter = _resolve_adapter(request)
+    context, citations = await asyncio.to_thread(retrieve_context, request)
+    max_new_tokens = _max_new_tokens(request)
+    key = _cache_key(context, request.query, adapter, max_new_tokens)
+    bypass = _bypass_cache(http_request)
+    cached = None if bypass else await response_cache.get(key)
+    if cached is not None:
+        return StreamingResponse(
+            _stream_cached(cached, citations),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Cache": "HIT"},
+        )
+
+    prompt = await asyncio.to_thread(build_prompt, context, request.query)
+    loop = asyncio.get_running_loop()
+    tokens = asyncio.Queue()
+    timeout = min(request.timeout_s or REQUEST_TIMEOUT_S, REQUEST_TIMEOUT_S)
+    try:
+        future = scheduler.enqueue(
+            prompt,
+            timeout,
+            on_token=lambda token_id: loop.call_soon_threadsafe(tokens.put_nowait, token_id),
+            group=adapter,
+            max_new_tokens=max_new_tokens,
+        )
+    except QueueFullError:
+        raise _busy_error()
+
+    return StreamingResponse(
+        _stream_tokens(future, tokens, started, started + timeout, key, citations),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Cache": "BYPASS" if bypass else "MISS"},
+    )
+
+async def _run_job_item(item):
+    """Answer one job item like /analyze does, through the scheduler's bulk lane."""
+    request = AnalysisRequest(**item)
+    adapter = _resolve_adapter(request)
+    context, citations = await asyncio.to_thread(retrieve_context, request)
+    max_new_tokens = _max_new_tokens(request)
+    key = _cache_key(context, request.query, adapter, max_new_tokens)
+    answer = await response_cache.get(key)
+    if answer is None:
+        prompt = await asyncio.to_thread(build_prompt, context, request.query)
+        answer = await scheduler.submit(
+            prompt, JOB_ITEM_TIMEOUT_S, group=adapter, bulk=True, max_new_tokens=max_new_tokens
+        )
+        await response_cache.set(key, answer)
+    return {"answer": answer, "citations": citations}
+
+def _expand_job(job: JobRequest):
+    """Job items as request dicts: the explicit ones, then queries x matching stored sections."""
+    items = [item.model_dump(exclude_none=True) for item in job.items]
+    if job.queries:
+        if not job.section:
+            raise HTTPException(status_code=422, detail="`queries` needs a `section` to ask them of")
+        if section_store is None:
+            raise HTTPException(status_code=503, detail="Section store is not loaded")
+        try:
+            item = normalize_item(job.section)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        tickers = {t.upper() for t in job.tickers} if job.tickers else None
+        seen = set()
+        for ticker, fiscal_year, section, _ in section_store.keys():
+            if section != item or (tickers is not None and ticker not in tickers):
+                continue
+            # Amended filings share the fiscal year; lookups read the last one
+            if (ticker, fiscal_year) in seen:
+                continue
+            seen.add((ticker, fiscal_year))
+            for query in job.queries:
+                request = {"ticker": ticker, "fiscal_year": fiscal_year, "section": section, "query": query}
+                if job.adapter:
+                    request["adapter"] = job.adapter
+                items.append(request)
+    if not items:
+        raise HTTPException(status_code=422, detail="The job has no items")
+    return items
+
+def _submit_job(items):
+    job_id = job_store.create(items)
+    if job_runner is not None:
+        job_runner.notify()
+    return {"job_id": job_id, "status": "pending", "total": len(items)}
+
+@app.post("/jobs")
+async def submit_job(job: JobRequest):
+    """
+    Queue a bulk analysis job; answers arrive at /jobs/{job_id}/results.
+
+    Items are explicit requests (same fields as /analyze), plus every
+    query in `queries` asked of every stored `section` (optionally only for
+    `tickers`). They run at low priority, behind interactive requests.
+    """
+    items = _expand_job(job)
+    return await asyncio.to_thread(_submit_job, items)
+
+@app.post("/jobs/upload")
+async def upload_job(http_request: Request):
+    """Queue a job from a JSONL body: one /analyze request object per line."""
+    items = []
+    for n, line in enumerate((await http_request.body()).decode("utf-8").splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            items.append(AnalysisRequest.model_validate_json(line).model_dump(exclude_none=True))
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=f"Line {n}: {e}")
+    if not items:
+        raise HTTPException(status_code=422, detail="The job has no items")
+    return await asyncio.to_thread(_submit_job, items)
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="No such job")
+    return job
+
+async def _stream_results(job_id, follow):
+    after = 0
+    while True:
+        rows = await asyncio.to_thread(job_store.results, job_id, after)
+        for after, line in rows:
+            yield line + "\n"
+        if rows:
+            continue
+        if not follow or (await asyncio.to_thread(job_store.get, job_id))["status"] in ("done", "cancelled"):
+            return
+        await asyncio.sleep(JOB_RESULTS_POLL_S)
+
+@app.get("/jobs/{job_id}/results")
+def job_results(job_id: str, follow: bool = False):
+    """
+    Results so far as JSONL, in completion order: {"index", "request",
+    "answer", "citations"} per item, or {"index", "request", "error"}.
+    With `follow=true` the stream stays open until the job finishes.
+    """
+    if job_store.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="No such job")
+    return StreamingResponse(_stream_results(job_id, follow), media_type="application/x-ndjson")
+
+@app.delete("/jobs/{job_id}")
+def cancel_job(job_id: str):
+    """Cancel a job's remaining items; results already produced stay readable."""
+    if not job_store.cancel(job_id):
+        raise HTTPException(status_code=404, detail="No such job")
+    if job_runner is not None:
+        job_runner.cancel(job_id)
+    return job_store.get(job_id)
 
 if __name__ == "__main__":
     import uvicorn
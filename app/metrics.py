@@ -0,0 +1,198 @@
+"""
+Custom Prometheus metrics for the inference service.
+
+Everything here registers on the default prometheus_client registry, so it is
+served on /metrics next to the HTTP metrics from the Instrumentator.
+"""
+from prometheus_client import Counter, Gauge, Histogram
+
+# Micro-batching scheduler (app/batching.py)
+BATCH_QUEUE_DEPTH = Gauge(
+    "risk_api_batch_queue_depth",
+    "Requests waiting in the batch scheduler queue",
+)
+BULK_QUEUE_DEPTH = Gauge(
+    "risk_api_bulk_queue_depth",
+    "Bulk job requests waiting for idle capacity in the batch scheduler",
+)
+BATCH_SIZE = Histogram(
+    "risk_api_batch_size",
+    "Number of requests served by one batched generation",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+
+# Admission control
+REQUESTS_SHED = Counter(
+    "risk_api_requests_shed_total",
+    "Requests rejected because the inference queue was full",
+)
+REQUESTS_EXPIRED = Counter(
+    "risk_api_requests_expired_total",
+    "Requests abandoned after their deadline or a client disconnect",
+)
+
+# Streaming (/analyze/stream) perceived latency
+TIME_TO_FIRST_TOKEN = Histogram(
+    "risk_api_time_to_first_token_seconds",
+    "Time from request arrival to the first streamed token",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60),
+)
+INTER_TOKEN_LATENCY = Histogram(
+    "risk_api_inter_token_latency_seconds",
+    "Time between consecutive streamed tokens",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+
+# Response cache (app/cache.py)
+CACHE_HITS = Counter(
+    "risk_api_cache_hits_total",
+    "Answers served from the response cache",
+    ["tier"],
+)
+CACHE_MISSES = Counter(
+    "risk_api_cache_misses_total",
+    "Cache lookups that fell through to generation",
+)
+CACHE_EVICTIONS = Counter(
+    "risk_api_cache_evictions_total",
+    "Entries dropped from the response cache",
+    ["reason"],
+)
+
+# Inference stages, per batched generation (app/generation.py). "queue" is
+# per request: time from arrival until its batch starts running.
+STAGE_SECONDS = Histogram(
+    "risk_api_stage_seconds",
+    "Wall time of one inference stage",
+    ["stage"],  # queue, tokenize, prefill, decode, detokenize; score (one /score forward pass)
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+PROMPT_TOKENS = Histogram(
+    "risk_api_prompt_tokens",
+    "Prompt length in tokens, per request",
+    buckets=(64, 128, 256, 512, 768, 1024, 1536, 2048, 4096),
+)
+GENERATED_TOKENS = Histogram(
+    "risk_api_generated_tokens",
+    "Generated tokens per request",
+    buckets=(1, 8, 16, 32, 64, 128, 200, 256, 512),
+)
+DECODE_TOKENS_PER_SECOND = Histogram(
+    "risk_api_decode_tokens_per_second",
+    "Generated tokens per second of decode time, per batch (all rows together)",
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500),
+)
+DEVICE_MEMORY_BYTES = Gauge(
+    "risk_api_device_memory_bytes",
+    "Accelerator memory (allocated/reserved/peak) or process RSS on CPU",
+    ["kind"],
+)
+MODEL_LOAD_SECONDS = Gauge(
+    "risk_api_model_load_seconds",
+    "Time taken to load the model at startup",
+)
+STARTUP_SECONDS = Gauge(
+    "risk_api_startup_seconds",
+    "Duration of each startup phase, and of the whole startup (phase=total)",
+    ["phase"],
+)
+PROFILES_CAPTURED = Counter(
+    "risk_api_profiles_captured_total",
+    "Slow batches for which a stack dump or profiler trace was written",
+    ["kind"],
+)
+
+# Prefix KV reuse (app/prefix_cache.py)
+PREFILL_TOKENS = Counter(
+    "risk_api_prefill_tokens_total",
+    "Prompt tokens, by whether their KV came from the prefix cache or was computed",
+    ["source"],
+)
+PREFIX_CACHE_HITS = Counter(
+    "risk_api_prefix_cache_hits_total",
+    "Prompts that reused a cached prefix KV state",
+)
+PREFIX_CACHE_MISSES = Counter(
+    "risk_api_prefix_cache_misses_total",
+    "Prompts with no cached prefix KV state",
+)
+
+# Multi-adapter serving (app/adapters.py)
+ADAPTER_REQUESTS = Counter(
+    "risk_api_adapter_requests_total",
+    "Generation requests, by the LoRA adapter that served them",
+    ["adapter"],
+)
+ADAPTER_SWAP_SECONDS = Histogram(
+    "risk_api_adapter_swap_seconds",
+    "Time to make an adapter active: load from disk, or switch to one already in memory",
+    ["kind"],  # load, switch
+    buckets=(0.0001, 0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+ADAPTER_EVICTIONS = Counter(
+    "risk_api_adapter_evictions_total",
+    "Adapters unloaded to stay within the adapter memory budget",
+)
+ADAPTER_MEMORY_BYTES = Gauge(
+    "risk_api_adapter_memory_bytes",
+    "Memory held by loaded LoRA adapters",
+)
+
+# Speculative decoding (app/speculative.py)
+SPEC_DRAFT_TOKENS = Counter(
+    "risk_api_spec_draft_tokens_total",
+    "Draft model tokens checked by the target model, by outcome",
+    ["outcome"],  # accepted, rejected
+)
+SPEC_ACCEPTANCE = Histogram(
+    "risk_api_spec_acceptance_rate",
+    "Share of draft tokens the target model accepted, per request",
+    buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0),
+)
+SPEC_TOKENS_PER_SECOND = Histogram(
+    "risk_api_spec_decode_tokens_per_second",
+    "Generated tokens per second of decode time, for speculatively decoded requests",
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500),
+)
+SPEC_FALLBACKS = Counter(
+    "risk_api_spec_fallbacks_total",
+    "Times speculative decoding turned itself off because acceptance was low",
+)
+SPEC_ACTIVE = Gauge(
+    "risk_api_spec_active",
+    "1 while speculative decoding is used for single-request batches, 0 while it is off",
+)
+
+# Bulk analysis jobs (app/jobs.py)
+JOB_ITEMS = Counter(
+    "risk_api_job_items_total",
+    "Bulk job items finished, by outcome",
+    ["outcome"],  # done, failed
+)
+JOBS_RUNNING = Gauge(
+    "risk_api_jobs_running",
+    "Bulk jobs with items still to process",
+)
+
+# Whole-document map-reduce analysis (app/longdoc.py)
+DOCUMENT_CHUNKS = Counter(
+    "risk_api_document_chunks_total",
+    "Map-step chunks of /analyze/document, by whether the answer came from the cache",
+    ["outcome"],  # cached, generated
+)
+DOCUMENT_REDUCE_ROUNDS = Histogram(
+    "risk_api_document_reduce_rounds",
+    "Reduce rounds needed to fit a document's findings into one summary",
+    buckets=(1, 2, 3, 4, 6),
+)
+
+# Single-pass risk scoring (app/scoring.py)
+SCORED_TEXTS = Counter(
+    "risk_api_scored_texts_total",
+    "Passages scored by /score",
+)
+SCORE_BATCH_SIZE = Histogram(
+    "risk_api_score_batch_size",
+    "Passages scored by one forward pass",
+    buckets=(1, 4, 16, 32, 64, 128, 256, 512),
+)
@@ -0,0 +1,130 @@
+"""
+Reusable past-key-values for shared prompt prefixes.
+
+Every /analyze prompt starts with the same Llama 3 header and system turn,
+and analysts often ask several questions about the same filing excerpt. The
+keys/values for those leading tokens are identical across requests, so we
+keep them and only prefill the part of the prompt that differs.
+
+Prompts are passed around as a tuple of token-id segments (system, context,
+question; see app/prompts.py). Prefixes are only looked up at segment
+boundaries, and the segments are tokenized separately, so a cached prefix is
+always exactly the start of the prompt.
+
+KV states are stored per layer as a list of (key, value) tensors with batch
+size 1, which is independent of the transformers Cache class in use.
+"""
+import threading
+from collections import OrderedDict
+
+import torch
+from transformers import DynamicCache
+
+from app.metrics import PREFIX_CACHE_HITS, PREFIX_CACHE_MISSES
+
+
+def cache_to_pairs(past_key_values):
+    """Per-layer (key, value) tensors from any transformers cache object."""
+    if hasattr(past_key_values, "layers"):
+        return [(layer.keys, layer.values) for layer in past_key_values.layers]
+    if hasattr(past_key_values, "key_cache"):
+        return list(zip(past_key_values.key_cache, past_key_values.value_cache))
+    return [tuple(layer[:2]) for layer in past_key_values]
+
+
+def pairs_to_cache(pairs):
+    if hasattr(DynamicCache, "from_legacy_cache"):
+        return DynamicCache.from_legacy_cache(tuple(pairs))
+    return DynamicCache(pairs)
+
+
+def _nbytes(pairs):
+    return sum(k.numel() * k.element_size() + v.numel() * v.element_size() for k, v in pairs)
+
+
+class PrefixKVCache:
+    """
+    LRU of prefix KV states bounded by `max_bytes`, plus pinned entries
+    (the system prompt) that are never evicted.
+
+    A prefix is only admitted once it has been seen `admit_after` times, so
+    one-off contexts don't push out the ones that are actually repeated.
+    """
+
+    SEEN_LIMIT = 4096  # prefixes tracked for admission
+
+    def __init__(self, model, max_bytes, admit_after=2):
+        self.model = model
+        self.max_bytes = max_bytes
+        self.admit_after = admit_after
+        self.size = 0
+        self._entries = OrderedDict()  # token id tuple -> (pairs, nbytes)
+        self._pinned = {}
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, ids):
+        with self._lock:
+            pairs = self._pinned.get(ids)
+            if pairs is None:
+                entry = self._entries.get(ids)
+                if entry is not None:
+                    self._entries.move_to_end(ids)
+                    pairs = entry[0]
+        return pairs
+
+    def should_admit(self, ids):
+        """Count a sighting of `ids`; True once it has been seen often enough."""
+        with self._lock:
+            if ids in self._entries or ids in self._pinned:
+                return False
+            count = self._seen.pop(ids, 0) + 1
+            self._seen[ids] = count
+            if len(self._seen) > self.SEEN_LIMIT:
+                self._seen.popitem(last=False)
+            return count >= self.admit_after
+
+    def put(self, ids, pairs):
+        nbytes = _nbytes(pairs)
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            self._seen.pop(ids, None)
+            old = self._entries.pop(ids, None)
+            if old is not None:
+                self.size -= old[1]
+            self._entries[ids] = (pairs, nbytes)
+            self.size += nbytes
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size -= evicted
+
+    @torch.no_grad()
+    def pin(self, ids):
+        """Prefill `ids` once and keep their KV state for the life of the process."""
+        ids = tuple(ids)
+        input_ids = torch.tensor([ids], device=self.model.device)
+        outputs = self.model(input_ids=input_ids, use_cache=True)
+        pairs = [(k.clone(), v.clone()) for k, v in cache_to_pairs(outputs.past_key_values)]
+        with self._lock:
+            self._pinned[ids] = pairs
+        return len(ids)
+
+    def match(self, segments, full_ids):
+        """
+        Longest cached prefix of `full_ids` ending at a segment boundary.
+
+        Returns (prefix_len, pairs), with (0, None) when nothing matches. The
+        whole prompt is never used as a prefix, since at least one token has
+        to be fed through the model to get the next-token logits.
+        """
+        for end in range(len(segments) - 1, 0, -1):
+            ids = tuple(full_ids[:sum(len(segment) for segment in segments[:end])])
+            if len(ids) >= len(full_ids):
+                continue
+            pairs = self.get(ids)
+            if pairs is not None:
+                PREFIX_CACHE_HITS.inc()
+                return len(ids), pairs
+        PREFIX_CACHE_MISSES.inc()
+        return 0, None
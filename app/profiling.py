@@ -0,0 +1,113 @@
+"""
+Resource gauges and opt-in profiling of slow batches.
+
+The stage histograms in app/metrics.py say *which* stage got slow; when that
+is not enough, `SlowBatchProfiler` captures what the inference thread was
+doing:
+
+* stack dump: if a batch is still running after `slow_s`, the inference
+  thread's Python stack is written out (like a one-shot `py-spy dump`).
+  Costs one timer per batch.
+* torch profiler trace: a `sample_rate` share of batches run under
+  torch.profiler; the Chrome trace is kept only if that batch turned out
+  slow. Profiling has real overhead, so keep the rate low.
+
+Both are off unless PROFILE_SLOW_MS is set.
+"""
+import os
+import random
+import resource
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+
+import torch
+
+from app.metrics import DEVICE_MEMORY_BYTES, PROFILES_CAPTURED
+
+
+def _rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # Peak rather than current RSS; kilobytes on Linux, bytes on macOS
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == "darwin" else rss * 1024
+
+
+def record_memory(device):
+    """Update the device memory gauges (process RSS is always reported)."""
+    DEVICE_MEMORY_BYTES.labels(kind="rss").set(_rss_bytes())
+    if device == "cuda":
+        DEVICE_MEMORY_BYTES.labels(kind="allocated").set(torch.cuda.memory_allocated())
+        DEVICE_MEMORY_BYTES.labels(kind="reserved").set(torch.cuda.memory_reserved())
+        DEVICE_MEMORY_BYTES.labels(kind="peak").set(torch.cuda.max_memory_allocated())
+    elif device == "mps":
+        DEVICE_MEMORY_BYTES.labels(kind="allocated").set(torch.mps.current_allocated_memory())
+        DEVICE_MEMORY_BYTES.labels(kind="reserved").set(torch.mps.driver_allocated_memory())
+
+
+class SlowBatchProfiler:
+    def __init__(self, slow_s, sample_rate=0.0, out_dir="/tmp/risk-api-profiles"):
+        self.slow_s = slow_s
+        self.sample_rate = sample_rate
+        self.out_dir = out_dir
+        self._trace_lock = threading.Lock()  # torch.profiler is process-wide: one trace at a time
+
+    @property
+    def enabled(self):
+        return self.slow_s > 0
+
+    def _path(self, kind, ext):
+        os.makedirs(self.out_dir, exist_ok=True)
+        now = time.time()
+        stamp = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}.{int(now * 1000) % 1000:03d}"
+        return os.path.join(self.out_dir, f"{stamp}-{os.getpid()}-{kind}.{ext}")
+
+    def _dump_stack(self, thread_id, started):
+        frame = sys._current_frames().get(thread_id)
+        if frame is None:
+            return
+        path = self._path("stack", "txt")
+        with open(path, "w") as f:
+            f.write(f"Batch running for {(time.perf_counter() - started) * 1000:.0f}ms "
+                    f"(threshold {self.slow_s * 1000:.0f}ms), inference thread stack:\n\n")
+            f.write("".join(traceback.format_stack(frame)))
+        PROFILES_CAPTURED.labels(kind="stack").inc()
+        print(f"⚠️ Slow batch: stack dumped to {path}")
+
+    @contextmanager
+    def batch(self):
+        """Wrap one batched generation (runs on the inference thread)."""
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        timer = threading.Timer(self.slow_s, self._dump_stack, (threading.get_ident(), started))
+        timer.daemon = True
+        timer.start()
+
+        profiler = None
+        if random.random() < self.sample_rate and self._trace_lock.acquire(blocking=False):
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            profiler = torch.profiler.profile(activities=activities)
+            profiler.start()
+        try:
+            yield
+        finally:
+            timer.cancel()
+            if profiler is not None:
+                try:
+                    profiler.stop()
+                    if time.perf_counter() - started >= self.slow_s:
+                        path = self._path("trace", "json")
+                        profiler.export_chrome_trace(path)
+                        PROFILES_CAPTURED.labels(kind="torch").inc()
+                        print(f"⚠️ Slow batch: profiler trace written to {path}")
+                finally:
+                    self._trace_lock.release()
@@ -0,0 +1,80 @@
+"""
+The Llama 3 chat prompt, built as token ids.
+
+One template serves training (data/preprocess/create_sft.py,
+train/pretokenize.py), evaluation (eval/eval_qa.py) and the API, so the
+model is asked exactly what it was trained on. The fixed pieces around the
+context and the question are tokenized once per tokenizer; a prompt is
+those cached ids around the tokenized context and query, with the context
+cut to an exact token budget. Generation stops at <|eot_id|>, and only the
+generated ids are decoded: the prompt is never re-decoded or split out of
+the output text.
+
+A prompt is a tuple of token-id segments (system, context, question). The
+first two are the reusable prefixes the prefix KV cache looks up.
+"""
+import hashlib
+import json
+
+SYSTEM_MESSAGE = "You are a financial risk analyst. Analyze the provided SEC 10-K section and identify key risks."
+DEFAULT_QUERY = "Based on the following text, what are the primary risk factors?"
+EOT = "<|eot_id|>"
+
+TEMPLATE = {
+    "system": f"<|begin_of_text|><|start_header_id|>system<|end_header_id|>\n\n{{system}}{EOT}",
+    "context": "<|start_header_id|>user<|end_header_id|>\n\nContext:\n",
+    "question": "\n\nQuestion: ",
+    "assistant": f"{EOT}<|start_header_id|>assistant<|end_header_id|>\n\n",
+}
+# Changes with the template: part of response cache keys and of the
+# pretokenized dataset's directory name
+TEMPLATE_ID = hashlib.sha256(json.dumps([TEMPLATE, SYSTEM_MESSAGE]).encode("utf-8")).hexdigest()[:12]
+
+
+def flatten(prompt):
+    """All token ids of a prompt given as segments."""
+    return [token_id for segment in prompt for token_id in segment]
+
+
+def prompt_token_ids(prompt, tokenizer):
+    """Token ids of a prompt: id segments as they are, a plain string tokenized whole."""
+    if isinstance(prompt, str):
+        return tokenizer(prompt)["input_ids"]
+    return flatten(prompt)
+
+
+class PromptBuilder:
+    def __init__(self, tokenizer, system_message=SYSTEM_MESSAGE):
+        self.tokenizer = tokenizer
+        self.system = tuple(self.encode(TEMPLATE["system"].format(system=system_message)))
+        self.context_header = tuple(self.encode(TEMPLATE["context"]))
+        self.question_header = tuple(self.encode(TEMPLATE["question"]))
+        self.assistant_header = tuple(self.encode(TEMPLATE["assistant"]))
+        # Tokenizers without Llama 3's special tokens (e.g. a tiny test
+        # model) end examples with their own eos instead
+        eot_id = tokenizer.convert_tokens_to_ids(EOT)
+        if eot_id is None or eot_id == tokenizer.unk_token_id:
+            eot_id = tokenizer.eos_token_id
+        self.eot_id = eot_id
+
+    def encode(self, text):
+        return self.tokenizer(text, add_special_tokens=False)["input_ids"]
+
+    def build(self, context, query, context_tokens=None):
+        """
+        (system, context, question) id segments. With `context_tokens`, the
+        context keeps only its first `context_tokens` tokens.
+        """
+        context_ids = self.encode(context)
+        if context_tokens is not None:
+            context_ids = context_ids[:context_tokens]
+        return (
+            self.system,
+            self.context_header + tuple(context_ids),
+            self.question_header + tuple(self.encode(query)) + self.assistant_header,
+        )
+
+    def training_ids(self, context, query, target):
+        """(ids, n_prompt_tokens) of a training example: prompt, target, <|eot_id|> (or eos)."""
+        prompt_ids = flatten(self.build(context, query))
+        return prompt_ids + self.encode(target) + [self.eot_id], len(prompt_ids)
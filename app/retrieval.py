@@ -0,0 +1,344 @@
+"""
+Retrieval over parsed 10-K sections.
+
+Instead of cutting the request context at 2000 characters, the service picks
+the chunks most relevant to the question and packs them into a token budget.
+Chunks come either from the on-disk index built by
+`data/preprocess/build_index.py` (request names a ticker/section) or from the
+request's own long text, chunked on the fly.
+
+Index layout (one directory, every array loaded with mmap):
+
+    meta.json           chunking parameters, BM25 stats, optional embed model
+    chunks.jsonl        one line per chunk: chunk_id, ticker, section, accession, n_tokens
+    chunk_text.bin      UTF-8 text of all chunks, back to back
+    chunk_offsets.npy   int64 [n_chunks + 1] byte offsets into chunk_text.bin
+    vocab.json          term -> term id
+    term_offsets.npy    int64 [n_terms + 1] CSR offsets into the postings
+    postings_doc.npy    int32 chunk ids, grouped by term
+    postings_tf.npy     uint16 term frequencies, aligned with postings_doc
+    doc_len.npy         int32 [n_chunks] terms per chunk
+    vectors.npy         float32 [n_chunks, dim], L2-normalized (optional)
+"""
+import hashlib
+import json
+import math
+import os
+import re
+from collections import Counter
+
+import numpy as np
+
+from app.dedup import NearDuplicateFilter
+
+# Chunk size stays well under the prompt budget so several chunks (often
+# from different parts of a section) can be combined into one context.
+CHUNK_TOKENS = 256
+CHUNK_OVERLAP = 32
+BM25_K1 = 1.2
+BM25_B = 0.75
+DENSE_WEIGHT = 0.5  # share of the hybrid score given to cosine similarity
+
+_TERM_RE = re.compile(r"[a-z0-9]+")
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+_SENTENCE_RE = re.compile(r"(?<=[.!?;])\s+(?=[A-Z(\"'])")
+# Typical tokens per paragraph/sentence: content-defined chunks aim for half
+# the budget on average, so the budget cap rarely decides a boundary.
+UNIT_TOKENS = {"paragraph": 100, "sentence": 30}
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were will with "
+    "we our us may can could would which what".split()
+)
+
+
+def terms(text):
+    """Lower-cased word terms used by the BM25 index."""
+    return [t for t in _TERM_RE.findall(text.lower()) if t not in _STOPWORDS]
+
+
+def chunk_text(text, tokenizer, chunk_tokens=CHUNK_TOKENS, overlap=CHUNK_OVERLAP):
+    """
+    Split `text` into windows of at most `chunk_tokens` tokens, overlapping
+    by `overlap` tokens. Returns (chunk_text, n_tokens) pairs; boundaries come
+    from the tokenizer's character offsets so no text is lost or duplicated
+    beyond the overlap.
+    """
+    enc = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)
+    offsets = enc["offset_mapping"]
+    if not offsets:
+        return []
+    chunks = []
+    step = max(1, chunk_tokens - overlap)
+    for start in range(0, len(offsets), step):
+        window = offsets[start:start + chunk_tokens]
+        chunks.append((text[window[0][0]:window[-1][1]].strip(), len(window)))
+        if start + chunk_tokens >= len(offsets):
+            break
+    return chunks
+
+
+def split_units(text):
+    """
+    (units, kind): the paragraphs of `text`, or its sentences when it has no
+    paragraph breaks (parse_10k.py collapses all whitespace).
+    """
+    paragraphs = [p.strip() for p in _PARAGRAPH_RE.split(text) if p.strip()]
+    if len(paragraphs) > 1:
+        return paragraphs, "paragraph"
+    return [s.strip() for s in _SENTENCE_RE.split(text) if s.strip()], "sentence"
+
+
+def content_chunks(text, tokenizer, chunk_tokens=CHUNK_TOKENS):
+    """
+    Split `text` into (chunk_text, n_tokens) chunks of up to `chunk_tokens`
+    tokens (counted per unit) along content-defined boundaries: a chunk ends
+    after a paragraph or sentence whose hash marks a boundary, or when the
+    budget is full. Unlike fixed windows, an edit or insertion only changes
+    the chunks around it, so unchanged text chunks the same way in next
+    year's filing. Units longer than the budget are cut into token windows.
+    """
+    units, kind = split_units(text)
+    if not units:
+        return []
+    joiner = "\n\n" if kind == "paragraph" else " "
+    every = max(2, chunk_tokens // (2 * UNIT_TOKENS[kind]))
+    unit_tokens = [len(ids) for ids in tokenizer(units, add_special_tokens=False)["input_ids"]]
+    chunks, current, used = [], [], 0
+
+    def flush():
+        nonlocal current, used
+        if current:
+            chunks.append((joiner.join(current), used))
+        current, used = [], 0
+
+    for unit, n_tokens in zip(units, unit_tokens):
+        if n_tokens > chunk_tokens:
+            flush()
+            chunks.extend(chunk_text(unit, tokenizer, chunk_tokens, overlap=0))
+            continue
+        if used + n_tokens + 1 > chunk_tokens:  # +1: the separator
+            flush()
+        current.append(unit)
+        used += n_tokens + 1
+        if int.from_bytes(hashlib.sha1(unit.encode("utf-8")).digest()[:4], "big") % every == 0:
+            flush()
+    flush()
+    return chunks
+
+
+def _bm25_scores(query_terms, postings, doc_len, n_docs, avg_len):
+    """postings(term) -> (doc ids, term freqs) or None."""
+    scores = np.zeros(n_docs, dtype=np.float32)
+    for term in set(query_terms):
+        hit = postings(term)
+        if hit is None:
+            continue
+        docs, tf = hit
+        idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+        tf = tf.astype(np.float32)
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_len[docs] / avg_len)
+        scores[docs] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+    return scores
+
+
+def pack_chunks(ranked, n_tokens, budget):
+    """Greedily take chunks in rank order while they fit in `budget` tokens."""
+    chosen, used = [], 0
+    for i in ranked:
+        if used + n_tokens[i] <= budget:
+            chosen.append(i)
+            used += n_tokens[i]
+    return chosen
+
+
+class SectionIndex:
+    """Read-only BM25 (+ optional dense) index over 10-K section chunks."""
+
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        with open(os.path.join(index_dir, "meta.json")) as f:
+            self.meta = json.load(f)
+        with open(os.path.join(index_dir, "vocab.json")) as f:
+            self.vocab = json.load(f)
+        self.chunks = []
+        with open(os.path.join(index_dir, "chunks.jsonl")) as f:
+            for line in f:
+                self.chunks.append(json.loads(line))
+
+        def load(name):
+            return np.load(os.path.join(index_dir, name), mmap_mode="r")
+
+        self.chunk_offsets = load("chunk_offsets.npy")
+        self.term_offsets = load("term_offsets.npy")
+        self.postings_doc = load("postings_doc.npy")
+        self.postings_tf = load("postings_tf.npy")
+        self.doc_len = load("doc_len.npy")
+        self._text = np.memmap(os.path.join(index_dir, "chunk_text.bin"), dtype=np.uint8, mode="r")
+
+        self.vectors = None
+        self.encoder = None
+        vectors_path = os.path.join(index_dir, "vectors.npy")
+        if self.meta.get("embed_model") and os.path.exists(vectors_path):
+            self.vectors = np.load(vectors_path, mmap_mode="r")
+            self.encoder = load_encoder(self.meta["embed_model"])
+
+        self.n_tokens = np.array([c["n_tokens"] for c in self.chunks], dtype=np.int32)
+        self._tickers = np.array([c["ticker"] for c in self.chunks])
+        self._sections = np.array([c["section"].lower() for c in self.chunks])
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def text(self, i):
+        start, end = self.chunk_offsets[i], self.chunk_offsets[i + 1]
+        return bytes(self._text[start:end]).decode("utf-8")
+
+    def _postings(self, term):
+        tid = self.vocab.get(term)
+        if tid is None:
+            return None
+        start, end = self.term_offsets[tid], self.term_offsets[tid + 1]
+        return self.postings_doc[start:end], self.postings_tf[start:end]
+
+    def search(self, query, budget, ticker=None, section=None):
+        """
+        Chunks relevant to `query` that fit in `budget` tokens, as a list of
+        (chunk_id, text) in document order. Optional ticker/section filters.
+        """
+        scores = _bm25_scores(terms(query), self._postings, self.doc_len, len(self), self.meta["avg_doc_len"])
+        if self.vectors is not None:
+            dense = self.vectors @ self.encoder([query])[0]
+            top = scores.max()
+            scores = (1 - DENSE_WEIGHT) * (scores / top if top > 0 else scores) + DENSE_WEIGHT * dense
+
+        allowed = np.ones(len(self), dtype=bool)
+        if ticker:
+            allowed &= self._tickers == ticker.upper()
+        if section:
+            allowed &= self._sections == section.lower()
+        candidates = np.flatnonzero(allowed)
+        if len(candidates) == 0:
+            return []
+        # Stable sort keeps document order among equal scores (e.g. no term matched)
+        ranked = candidates[np.argsort(-scores[candidates], kind="stable")]
+        chosen = sorted(pack_chunks(ranked, self.n_tokens, budget))
+        return [(self.chunks[i]["chunk_id"], self.text(i)) for i in chosen]
+
+
+def select_from_text(text, query, tokenizer, budget, id_prefix="ctx"):
+    """
+    Chunk a long request context on the fly and keep the chunks most
+    relevant to `query` within `budget` tokens, in their original order.
+    """
+    chunks = chunk_text(text, tokenizer)
+    if not chunks:
+        return []
+    chunk_terms = [Counter(terms(t)) for t, _ in chunks]
+    doc_len = np.array([sum(c.values()) for c in chunk_terms], dtype=np.float32)
+    postings = {}
+    for i, counts in enumerate(chunk_terms):
+        for term, tf in counts.items():
+            postings.setdefault(term, ([], []))
+            postings[term][0].append(i)
+            postings[term][1].append(tf)
+
+    def lookup(term):
+        hit = postings.get(term)
+        return None if hit is None else (np.array(hit[0]), np.array(hit[1]))
+
+    scores = _bm25_scores(terms(query), lookup, doc_len, len(chunks), max(doc_len.mean(), 1.0))
+    ranked = np.argsort(-scores, kind="stable")
+    n_tokens = [n for _, n in chunks]
+    chosen = sorted(pack_chunks(ranked, n_tokens, budget))
+    return [(f"{id_prefix}-{i}", chunks[i][0]) for i in chosen]
+
+
+def load_encoder(model_name):
+    """Sentence embedding function for the optional dense vectors."""
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError:
+        raise ImportError("Dense retrieval needs sentence-transformers: pip install sentence-transformers")
+    model = SentenceTransformer(model_name)
+    return lambda texts: model.encode(texts, normalize_embeddings=True, convert_to_numpy=True).astype(np.float32)
+
+
+def write_index(index_dir, records, tokenizer, embed_model=None, dedup_threshold=None):
+    """
+    Chunk section records (dicts with ticker/section/text/source_path, e.g.
+    from sections.jsonl) and write the index files described above. Chunks
+    are content-defined, so text repeated from last year's filing chunks the
+    same way; with `dedup_threshold`, chunks that near-duplicate an already
+    indexed chunk of the same ticker and section are left out, so records
+    should come newest filing first (app.dedup.keep_priority).
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    dups = NearDuplicateFilter(dedup_threshold) if dedup_threshold else None
+    n_duplicates = 0
+    vocab = {}
+    postings = []  # term id -> list of (chunk id, tf)
+    doc_len = []
+    offsets = [0]
+    texts_for_vectors = []
+
+    with open(os.path.join(index_dir, "chunks.jsonl"), "w") as meta_f, \
+            open(os.path.join(index_dir, "chunk_text.bin"), "wb") as text_f:
+        for record in records:
+            accession = os.path.basename(os.path.dirname(record.get("source_path", ""))) or "unknown"
+            section_slug = record["section"].lower().replace(" ", "")
+            for n, (text, n_tokens) in enumerate(content_chunks(record["text"], tokenizer)):
+                chunk_id = f"{record['ticker']}:{accession}:{section_slug}:{n}"
+                if dups is not None and dups.seen(text, chunk_id, scope=(record["ticker"], section_slug)):
+                    n_duplicates += 1
+                    continue
+                doc_id = len(doc_len)
+                meta_f.write(json.dumps({
+                    "chunk_id": chunk_id,
+                    "ticker": record["ticker"],
+                    "section": record["section"],
+                    "accession": accession,
+                    "n_tokens": n_tokens,
+                }) + "\n")
+                data = text.encode("utf-8")
+                text_f.write(data)
+                offsets.append(offsets[-1] + len(data))
+
+                counts = Counter(terms(text))
+                doc_len.append(sum(counts.values()))
+                for term, tf in counts.items():
+                    tid = vocab.setdefault(term, len(vocab))
+                    if tid == len(postings):
+                        postings.append([])
+                    postings[tid].append((doc_id, min(tf, 65535)))
+                if embed_model:
+                    texts_for_vectors.append(text)
+
+    term_offsets = np.zeros(len(postings) + 1, dtype=np.int64)
+    term_offsets[1:] = np.cumsum([len(p) for p in postings])
+    flat = [entry for plist in postings for entry in plist]
+    np.save(os.path.join(index_dir, "term_offsets.npy"), term_offsets)
+    np.save(os.path.join(index_dir, "postings_doc.npy"), np.array([d for d, _ in flat], dtype=np.int32))
+    np.save(os.path.join(index_dir, "postings_tf.npy"), np.array([t for _, t in flat], dtype=np.uint16))
+    np.save(os.path.join(index_dir, "doc_len.npy"), np.array(doc_len, dtype=np.int32))
+    np.save(os.path.join(index_dir, "chunk_offsets.npy"), np.array(offsets, dtype=np.int64))
+    with open(os.path.join(index_dir, "vocab.json"), "w") as f:
+        json.dump(vocab, f)
+
+    if embed_model and texts_for_vectors:
+        encode = load_encoder(embed_model)
+        vectors = np.concatenate([encode(texts_for_vectors[i:i + 256]) for i in range(0, len(texts_for_vectors), 256)])
+        np.save(os.path.join(index_dir, "vectors.npy"), vectors)
+
+    meta = {
+        "n_chunks": len(doc_len),
+        "avg_doc_len": float(np.mean(doc_len)) if doc_len else 1.0,
+        "chunk_tokens": CHUNK_TOKENS,
+        "chunking": "content-defined",
+        "tokenizer": getattr(tokenizer, "name_or_path", None),
+        "embed_model": embed_model,
+        "dedup_threshold": dedup_threshold,
+        "n_duplicates_skipped": n_duplicates,
+    }
+    with open(os.path.join(index_dir, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    return meta
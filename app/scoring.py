@@ -0,0 +1,145 @@
+"""
+Risk scores from a single forward pass, no decoding.
+
+The scoring prompt asks for a one-word rating (low / medium / high) and
+ends where the answer would begin. The next-token logits of the three label
+words give their probabilities, and the score is the expected rating: 0
+(low) to 1 (high). A batch costs one prefill with no KV cache kept, so
+passages are scored in large, length-sorted batches.
+
+Label probabilities of a chat model are over-confident; a calibration file
+written by eval/calibrate_score.py (fitted on labeled passages) holds a
+Platt scaling `sigmoid(a * score + b)` that maps the raw score to the
+probability that a passage discloses material risk.
+"""
+import json
+import math
+import os
+import time
+from collections import Counter
+
+import torch
+
+from app.generation import _last_logits_kwargs
+from app.metrics import PROMPT_TOKENS, SCORE_BATCH_SIZE, SCORED_TEXTS, STAGE_SECONDS
+from app.prompts import flatten
+
+LABELS = {"low": 0.0, "medium": 0.5, "high": 1.0}
+SCORE_QUESTION = (
+    "How much financial risk does this text disclose? Answer with one word: low, medium or high."
+)
+
+
+def label_token_ids(tokenizer):
+    """
+    {label: ids of the first token of each way the answer may start ("High",
+    "high", " high")}. A first token shared by several labels (e.g. a bare
+    space) says nothing about the rating and is left out.
+    """
+    ids = {}
+    for label in LABELS:
+        variants = {label, label.capitalize(), " " + label, " " + label.capitalize()}
+        ids[label] = {tokenizer(v, add_special_tokens=False)["input_ids"][0] for v in variants}
+    counts = Counter(i for label_ids in ids.values() for i in label_ids)
+    ids = {label: sorted(i for i in label_ids if counts[i] == 1) for label, label_ids in ids.items()}
+    if not all(ids.values()):
+        raise ValueError("Score labels cannot be told apart by their first token with this tokenizer")
+    return ids
+
+
+def load_calibration(path):
+    """Platt parameters {"a", "b"} from eval/calibrate_score.py, or None."""
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        params = json.load(f)
+    return {"a": float(params["a"]), "b": float(params["b"])}
+
+
+class RiskScorer:
+    def __init__(self, model, tokenizer, prompts, context_tokens=768, max_batch_tokens=16384,
+                 calibration=None):
+        """
+        `prompts` is the app.prompts.PromptBuilder. Texts are cut to
+        `context_tokens` tokens; a forward pass holds at most
+        `max_batch_tokens` (rows x longest row) prompt tokens.
+        """
+        self.model = model
+        self.tokenizer = tokenizer
+        self.prompts = prompts
+        self.context_tokens = context_tokens
+        self.max_batch_tokens = max_batch_tokens
+        self.calibration = calibration
+        self.label_ids = label_token_ids(tokenizer)
+
+    def prompt_ids(self, text):
+        return flatten(self.prompts.build(text, SCORE_QUESTION, self.context_tokens))
+
+    def batches(self, prompt_ids):
+        """Row indices grouped into forward passes: similar lengths together, within max_batch_tokens."""
+        order = sorted(range(len(prompt_ids)), key=lambda i: len(prompt_ids[i]))
+        batches, current = [], []
+        for i in order:
+            # Sorted ascending, so this row is the longest of the batch
+            if current and (len(current) + 1) * len(prompt_ids[i]) > self.max_batch_tokens:
+                batches.append(current)
+                current = []
+            current.append(i)
+        if current:
+            batches.append(current)
+        return batches
+
+    def _finish(self, label_logits):
+        probs = torch.softmax(label_logits, dim=-1).tolist()
+        results = []
+        for row in probs:
+            raw = sum(p * value for p, value in zip(row, LABELS.values()))
+            score = raw
+            if self.calibration is not None:
+                score = 1 / (1 + math.exp(-(self.calibration["a"] * raw + self.calibration["b"])))
+            results.append({
+                "score": round(score, 4),
+                "raw_score": round(raw, 4),
+                "probabilities": {label: round(p, 4) for label, p in zip(LABELS, row)},
+            })
+        return results
+
+    @torch.no_grad()
+    def score_ids(self, prompt_ids):
+        """Score one batch of prompts (token id lists) with a single forward pass."""
+        started = time.perf_counter()
+        width = max(len(ids) for ids in prompt_ids)
+        input_ids = torch.full((len(prompt_ids), width), self.tokenizer.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(prompt_ids), width), dtype=torch.long)
+        for row, ids in enumerate(prompt_ids):
+            # Left-padded: every row's last prompt token is in the last column
+            input_ids[row, width - len(ids):] = torch.tensor(ids)
+            attention_mask[row, width - len(ids):] = 1
+            PROMPT_TOKENS.observe(len(ids))
+        position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)
+        device = self.model.device
+        logits = self.model(
+            input_ids=input_ids.to(device),
+            attention_mask=attention_mask.to(device),
+            position_ids=position_ids.to(device),
+            use_cache=False,
+            **_last_logits_kwargs(self.model),
+        ).logits[:, -1, :].float()
+        # Each label's probability mass is spread over its spelling variants
+        label_logits = torch.stack(
+            [torch.logsumexp(logits[:, ids], dim=-1) for ids in self.label_ids.values()], dim=-1
+        )
+        results = self._finish(label_logits.cpu())
+        STAGE_SECONDS.labels(stage="score").observe(time.perf_counter() - started)
+        SCORE_BATCH_SIZE.observe(len(prompt_ids))
+        SCORED_TEXTS.inc(len(prompt_ids))
+        return results
+
+    def score(self, texts):
+        """Scores for `texts`, in order (all batches run here, one after another)."""
+        prompt_ids = [self.prompt_ids(t) for t in texts]
+        results = [None] * len(texts)
+        for batch in self.batches(prompt_ids):
+            for i, result in zip(batch, self.score_ids([prompt_ids[i] for i in batch])):
+                results[i] = result
+        return results
@@ -0,0 +1,139 @@
+"""
+Random-access store of parsed 10-K sections.
+
+sections.jsonl has to be read end to end to find anything in it. The store
+written next to it by `data/preprocess/parse_10k.py` keeps the same text in
+one flat file plus a small index, so a single section can be looked up by
+(ticker, fiscal year, item[, accession]) and read straight out of an mmap:
+
+    sections.bin        UTF-8 text of every section, back to back
+    sections_index.npy  structured array, one row per section:
+                        ticker, fiscal_year, item, accession, offset, length
+
+Both files are opened with mmap; only the key -> row dict lives in memory.
+"""
+import mmap
+import os
+import re
+
+import numpy as np
+
+TEXT_FILE = "sections.bin"
+INDEX_FILE = "sections_index.npy"
+
+INDEX_DTYPE = np.dtype([
+    ("ticker", "S16"),
+    ("fiscal_year", "<i2"),  # 0 when the filing has no period of report
+    ("item", "S4"),
+    ("accession", "S32"),
+    ("offset", "<i8"),
+    ("length", "<i8"),
+])
+
+_ITEM_RE = re.compile(r"^(?:item)?\s*([0-9]+[a-z]?)\.?$", re.IGNORECASE)
+
+
+def normalize_item(item):
+    """'Item 1A', 'item1a', '1a' -> '1A'."""
+    m = _ITEM_RE.match(item.strip())
+    if not m:
+        raise ValueError(f"Not a 10-K item: {item!r}")
+    return m.group(1).upper()
+
+
+def write_store(store_dir, records):
+    """
+    Write records (dicts with ticker, fiscal_year, section, accession, text)
+    to the store in `store_dir`. Records are streamed; only the index rows
+    are kept in memory. Returns the number of sections written.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    rows = []
+    offset = 0
+    tmp_text = os.path.join(store_dir, TEXT_FILE + ".tmp")
+    with open(tmp_text, "wb") as f:
+        for record in records:
+            data = record["text"].encode("utf-8")
+            f.write(data)
+            rows.append((
+                record["ticker"].upper().encode("ascii", "replace"),
+                record.get("fiscal_year") or 0,
+                normalize_item(record["section"]).encode("ascii"),
+                (record.get("accession") or "").encode("ascii", "replace"),
+                offset,
+                len(data),
+            ))
+            offset += len(data)
+    index = np.array(rows, dtype=INDEX_DTYPE)
+    tmp_index = os.path.join(store_dir, "sections_index.tmp.npy")
+    np.save(tmp_index, index)
+    os.replace(tmp_text, os.path.join(store_dir, TEXT_FILE))
+    os.replace(tmp_index, os.path.join(store_dir, INDEX_FILE))
+    return len(rows)
+
+
+class SectionStore:
+    """
+    Read-only view over a section store.
+
+        store = SectionStore("data/processed")
+        store.get("AAPL", 2023, "Item 1A")        # str
+        store.raw("AAPL", 2023, "1A")             # memoryview into the mmap
+
+    When a ticker has several filings for the same fiscal year (e.g. a
+    10-K/A), lookups without an accession return the last one written.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.index = np.load(os.path.join(store_dir, INDEX_FILE), mmap_mode="r")
+        self._file = open(os.path.join(store_dir, TEXT_FILE), "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        # mmap refuses empty files
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self._view = memoryview(self._mm)
+
+        self._rows = {}
+        for i, (ticker, year, item, accession) in enumerate(
+            zip(self.index["ticker"], self.index["fiscal_year"], self.index["item"], self.index["accession"])
+        ):
+            ticker, item, accession = ticker.decode(), item.decode(), accession.decode()
+            self._rows[(ticker, int(year), item, accession)] = i
+            self._rows[(ticker, int(year), item, None)] = i
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return self._row(*key) is not None
+
+    def _row(self, ticker, fiscal_year, item, accession=None):
+        return self._rows.get((ticker.upper(), int(fiscal_year), normalize_item(item), accession))
+
+    def raw(self, ticker, fiscal_year, item, accession=None):
+        """UTF-8 bytes of a section as a zero-copy memoryview, or None."""
+        i = self._row(ticker, fiscal_year, item, accession)
+        if i is None:
+            return None
+        start = int(self.index["offset"][i])
+        return self._view[start:start + int(self.index["length"][i])]
+
+    def get(self, ticker, fiscal_year, item, accession=None):
+        """Section text, or None if the filing/item is not in the store."""
+        data = self.raw(ticker, fiscal_year, item, accession)
+        return None if data is None else str(data, "utf-8")
+
+    def keys(self):
+        """(ticker, fiscal_year, item, accession) for every section, in store order."""
+        return [
+            (ticker.decode(), int(year), item.decode(), accession.decode())
+            for ticker, year, item, accession in zip(
+                self.index["ticker"], self.index["fiscal_year"], self.index["item"], self.index["accession"]
+            )
+        ]
+
+    def close(self):
+        self._view.release()
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+        self._file.close()
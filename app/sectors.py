@@ -0,0 +1,21 @@
+"""
+Sector groups of the tickers we ingest.
+
+data/ingest/download_edgar.py downloads every ticker listed here, and the
+API uses the same groups to route a request about a ticker to that sector's
+LoRA adapter (app/adapters.py).
+"""
+SECTOR_TICKERS = {
+    "tech": ["AAPL", "MSFT", "GOOGL", "AMZN", "NVDA", "META", "TSLA", "AVGO", "CSCO", "CRM"],
+    "finance": ["JPM", "BAC", "WFC", "GS", "MS", "BLK", "C", "AXP", "V", "MA"],
+    "healthcare": ["UNH", "JNJ", "LLY", "MRK", "ABBV", "PFE", "TMO", "DHR", "BMY", "AMGN"],
+    "consumer": ["WMT", "PG", "COST", "HD", "KO", "PEP", "MCD", "NKE", "SBUX", "TGT"],
+    "energy": ["XOM", "CVX", "GE", "CAT", "DE", "HON", "UNP", "UPS", "LMT", "RTX"],
+}
+
+_SECTOR_OF = {ticker: sector for sector, tickers in SECTOR_TICKERS.items() for ticker in tickers}
+
+
+def sector_of(ticker):
+    """Sector name for `ticker`, or None if it is not one of ours."""
+    return _SECTOR_OF.get(ticker.upper()) if ticker else None
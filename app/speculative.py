@@ -0,0 +1,184 @@
+"""
+Speculative (assisted) greedy decoding with a small draft model.
+
+The draft model (same tokenizer, e.g. a 1B Llama) proposes `lookahead`
+tokens one at a time; the target model then scores all of them in a single
+forward pass and keeps the longest prefix that matches its own greedy
+choice, plus the token it would have produced next. Output is identical to
+plain greedy decoding with the target; decode just needs fewer target
+passes when the draft guesses well.
+
+It only pays off when acceptance is high, so the decoder keeps a running
+acceptance rate and turns itself off when it drops below `min_acceptance`,
+trying again after `retry_after` requests. It runs one sequence at a time:
+the service uses it for batches of a single request, where decode latency
+rather than throughput is what matters.
+"""
+import threading
+import time
+
+import torch
+from transformers import DynamicCache
+
+from app.metrics import (
+    DECODE_TOKENS_PER_SECOND,
+    GENERATED_TOKENS,
+    PROMPT_TOKENS,
+    SPEC_ACCEPTANCE,
+    SPEC_ACTIVE,
+    SPEC_DRAFT_TOKENS,
+    SPEC_FALLBACKS,
+    SPEC_TOKENS_PER_SECOND,
+    STAGE_SECONDS,
+)
+from app.generation import eos_token_ids
+from app.prompts import prompt_token_ids
+
+
+def _crop(cache, length):
+    """Keep the first `length` positions of a KV cache."""
+    remove = cache.get_seq_length() - length
+    if remove > 0:
+        # A negative argument removes that many tokens, in transformers 4 and 5 alike
+        cache.crop(-remove)
+
+
+def check_compatible(tokenizer, draft_tokenizer):
+    """Raise ValueError unless both tokenizers produce the same ids."""
+    sample = "Item 1A. Risk Factors: interest-rate exposure, credit losses and liquidity."
+    if len(tokenizer) != len(draft_tokenizer) or tokenizer(sample)["input_ids"] != draft_tokenizer(sample)["input_ids"]:
+        raise ValueError("Draft model tokenizer does not match the target model's")
+
+
+class SpeculativeDecoder:
+    def __init__(self, model, draft_model, tokenizer, lookahead=4, min_acceptance=0.5, retry_after=100):
+        self.model = model
+        self.draft_model = draft_model
+        self.tokenizer = tokenizer
+        self.lookahead = lookahead
+        self.min_acceptance = min_acceptance
+        self.retry_after = retry_after
+        self.eos_ids = eos_token_ids(model, tokenizer)
+        self._lock = threading.Lock()
+        self._acceptance = None  # running average over recent requests
+        self._skipped = 0  # requests decoded normally since turning off
+        SPEC_ACTIVE.set(1)
+
+    def enabled(self):
+        """Whether the next request should use speculative decoding."""
+        with self._lock:
+            if self._acceptance is None or self._acceptance >= self.min_acceptance:
+                return True
+            self._skipped += 1
+            if self._skipped < self.retry_after:
+                return False
+            # Probe again: the traffic mix may have changed
+            self._acceptance = None
+            self._skipped = 0
+            SPEC_ACTIVE.set(1)
+            return True
+
+    def _record(self, accepted, proposed):
+        if not proposed:
+            return
+        rate = accepted / proposed
+        SPEC_ACCEPTANCE.observe(rate)
+        with self._lock:
+            was_on = self._acceptance is None or self._acceptance >= self.min_acceptance
+            self._acceptance = rate if self._acceptance is None else 0.8 * self._acceptance + 0.2 * rate
+            if was_on and self._acceptance < self.min_acceptance:
+                SPEC_FALLBACKS.inc()
+                SPEC_ACTIVE.set(0)
+                print(f"⚠️ Speculative decoding off: acceptance {self._acceptance:.0%} < {self.min_acceptance:.0%}; "
+                      f"retrying after {self.retry_after} requests.")
+
+    @torch.no_grad()
+    def generate(self, prompt, max_new_tokens=200, should_stop=None, on_token=None):
+        """Greedy-decode one prompt (string or token-id segments); returns the completion."""
+        tokenize_started = time.perf_counter()
+        prompt_ids = prompt_token_ids(prompt, self.tokenizer)
+        STAGE_SECONDS.labels(stage="tokenize").observe(time.perf_counter() - tokenize_started)
+        PROMPT_TOKENS.observe(len(prompt_ids))
+
+        prefill_started = time.perf_counter()
+        device = self.model.device
+        ids = torch.tensor([prompt_ids], device=device)
+        target_cache, draft_cache = DynamicCache(), DynamicCache()
+        out = self.model(input_ids=ids, past_key_values=target_cache, use_cache=True)
+        self.draft_model(input_ids=ids[:, :-1], past_key_values=draft_cache, use_cache=True)
+        next_token = int(out.logits[0, -1].argmax())
+        decode_started = time.perf_counter()
+        STAGE_SECONDS.labels(stage="prefill").observe(decode_started - prefill_started)
+
+        tokens = list(prompt_ids)  # everything so far; the target cache covers all but next_token
+        generated = []
+        accepted_total = proposed_total = 0
+        while True:
+            if next_token in self.eos_ids or (should_stop is not None and should_stop(0)):
+                break
+            generated.append(next_token)
+            tokens.append(next_token)
+            if on_token is not None:
+                on_token(0, next_token)
+            if len(generated) >= max_new_tokens:
+                break
+
+            # Draft: catch up on the tokens it has not seen, then guess ahead
+            k = min(self.lookahead, max_new_tokens - len(generated))
+            pending = tokens[draft_cache.get_seq_length():]
+            draft = []
+            for _ in range(k):
+                logits = self.draft_model(
+                    input_ids=torch.tensor([pending], device=device), past_key_values=draft_cache, use_cache=True
+                ).logits
+                pending = [int(logits[0, -1].argmax())]
+                draft.append(pending[0])
+
+            # Target: score next_token and the k guesses in one pass
+            target_len = len(tokens) - 1
+            logits = self.model(
+                input_ids=torch.tensor([[next_token] + draft], device=device),
+                past_key_values=target_cache,
+                use_cache=True,
+            ).logits[0]
+            choices = logits.argmax(-1).tolist()
+            n = 0
+            while n < k and draft[n] == choices[n]:
+                n += 1
+            accepted_total += n
+            proposed_total += k
+
+            # Keep the accepted guesses; the target's own choice comes next
+            stop = False
+            for token in draft[:n]:
+                if token in self.eos_ids or (should_stop is not None and should_stop(0)):
+                    stop = True
+                    break
+                generated.append(token)
+                tokens.append(token)
+                if on_token is not None:
+                    on_token(0, token)
+                if len(generated) >= max_new_tokens:
+                    stop = True
+                    break
+            if stop:
+                break
+            _crop(target_cache, target_len + 1 + n)
+            if draft_cache.get_seq_length() > len(tokens):
+                _crop(draft_cache, len(tokens))
+            next_token = choices[n]
+
+        decode_seconds = time.perf_counter() - decode_started
+        STAGE_SECONDS.labels(stage="decode").observe(decode_seconds)
+        GENERATED_TOKENS.observe(len(generated))
+        if decode_seconds > 0 and len(generated) > 1:
+            DECODE_TOKENS_PER_SECOND.observe((len(generated) - 1) / decode_seconds)
+            SPEC_TOKENS_PER_SECOND.observe((len(generated) - 1) / decode_seconds)
+        SPEC_DRAFT_TOKENS.labels(outcome="accepted").inc(accepted_total)
+        SPEC_DRAFT_TOKENS.labels(outcome="rejected").inc(proposed_total - accepted_total)
+        self._record(accepted_total, proposed_total)
+
+        detokenize_started = time.perf_counter()
+        answer = self.tokenizer.decode(generated, skip_special_tokens=True).strip()
+        STAGE_SECONDS.labels(stage="detokenize").observe(time.perf_counter() - detokenize_started)
+        return answer
@@ -1,48 +1,250 @@
 import os
-from sec_edgar_downloader import Downloader
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from app.sectors import SECTOR_TICKERS
+
 # Configuration
 # Ideally these should be in env vars, but for a resume project script hardcoding placeholders is fine or better yet, asking user.
 # The user needs to provide a valid User-Agent string as per SEC requirements: "Name email@address.com"
 USER_AGENT_NAME = "Shivam Mishra"
 USER_AGENT_EMAIL = "shivam.mishra.1@stonybrook.edu"
 
-# List of 50 diverse S&P 500 companies (Tech, Finance, Health, Retail, Energy)
-TICKERS = [
-    # Tech
-    "AAPL", "MSFT", "GOOGL", "AMZN", "NVDA", "META", "TSLA", "AVGO", "CSCO", "CRM",
-    # Finance
-    "JPM", "BAC", "WFC", "GS", "MS", "BLK", "C", "AXP", "V", "MA",
-    # Healthcare
-    "UNH", "JNJ", "LLY", "MRK", "ABBV", "PFE", "TMO", "DHR", "BMY", "AMGN",
-    # Retail/Consumer
-    "WMT", "PG", "COST", "HD", "KO", "PEP", "MCD", "NKE", "SBUX", "TGT",
-    # Energy/Industrial
-    "XOM", "CVX", "GE", "CAT", "DE", "HON", "UNP", "UPS", "LMT", "RTX"
-]
+# List of 50 diverse S&P 500 companies (Tech, Finance, Health, Retail, Energy).
+# The sector groups live in app/sectors.py, where the API also uses them to
+# pick a sector's LoRA adapter.
+TICKERS = [ticker for tickers in SECTOR_TICKERS.values() for ticker in tickers]
+FORMS = ["10-K"]
+LIMIT = 2 # Latest N filings per ticker and form (covers last ~2-3 years of 10-Ks)
 
+# Same layout as sec-edgar-downloader, which parse_10k.py walks:
+# data/raw/sec-edgar-filings/{Ticker}/{Form}/{Accession}/full-submission.txt
 DATA_DIR = os.path.abspath("data/raw")
+STATE_FILE = os.path.join(DATA_DIR, "ingest_state.jsonl") # One line per completed accession
+
+# EDGAR endpoints. Override to point the ingester at a local fake server
+# (see fake_edgar.py), e.g. EDGAR_WWW_URL=EDGAR_DATA_URL=http://127.0.0.1:8765
+EDGAR_WWW_URL = os.getenv("EDGAR_WWW_URL", "https://www.sec.gov")
+EDGAR_DATA_URL = os.getenv("EDGAR_DATA_URL", "https://data.sec.gov")
+
+# SEC fair access policy: at most 10 requests/second per client. The bucket
+# is shared by every worker thread; any 1s window can see up to
+# BURST + REQUESTS_PER_SECOND requests, so together they stay under 10.
+REQUESTS_PER_SECOND = 8.0
+BURST = 1
+SEC_MAX_REQUESTS_PER_SECOND = 10
+WORKERS = 8
+MAX_RETRIES = 5
+TIMEOUT_S = 60
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `acquire()` blocks until a request may be sent."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class EdgarClient:
+    """Rate-limited EDGAR client over one pooled `requests.Session`."""
+
+    def __init__(self, limiter, workers=WORKERS, www_url=EDGAR_WWW_URL, data_url=EDGAR_DATA_URL):
+        self.limiter = limiter
+        self.www_url = www_url.rstrip("/")
+        self.data_url = data_url.rstrip("/")
+        self.session = requests.Session()
+        self.session.headers.update({
+            "User-Agent": f"{USER_AGENT_NAME} {USER_AGENT_EMAIL}",
+            "Accept-Encoding": "gzip, deflate",
+        })
+        # One keep-alive connection per worker thread per host
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def get(self, url, stream=False):
+        """GET through the limiter, backing off on 429/5xx, connection errors and timeouts."""
+        for attempt in range(MAX_RETRIES):
+            self.limiter.acquire()
+            try:
+                resp = self.session.get(url, timeout=TIMEOUT_S, stream=stream)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == MAX_RETRIES - 1:
+                    raise
+                time.sleep(2 ** attempt)
+                continue
+            if resp.status_code == 429 or resp.status_code >= 500:
+                resp.close()
+                if attempt == MAX_RETRIES - 1:
+                    resp.raise_for_status()
+                retry_after = resp.headers.get("Retry-After")
+                time.sleep(float(retry_after) if retry_after and retry_after.isdigit() else 2 ** attempt)
+                continue
+            resp.raise_for_status()
+            return resp
+
+    def ticker_ciks(self):
+        """Ticker -> zero-padded 10 digit CIK."""
+        data = self.get(f"{self.www_url}/files/company_tickers.json").json()
+        return {row["ticker"].upper(): f"{int(row['cik_str']):010d}" for row in data.values()}
+
+    def recent_filings(self, cik):
+        """Recent filings of a company as dicts with accession, form, filing_date, report_date."""
+        recent = self.get(f"{self.data_url}/submissions/CIK{cik}.json").json()["filings"]["recent"]
+        return [
+            {"accession": acc, "form": form, "filing_date": filed, "report_date": period}
+            for acc, form, filed, period in zip(
+                recent["accessionNumber"], recent["form"], recent["filingDate"], recent["reportDate"]
+            )
+        ]
+
+    def download_submission(self, cik, accession, dest):
+        """Stream the full submission text file to `dest` (written atomically)."""
+        url = f"{self.www_url}/Archives/edgar/data/{int(cik)}/{accession.replace('-', '')}/{accession}.txt"
+        resp = self.get(url, stream=True)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        tmp = dest + ".part"
+        size = 0
+        with resp, open(tmp, "wb") as f:
+            for block in resp.iter_content(chunk_size=1 << 16):
+                f.write(block)
+                size += len(block)
+        os.replace(tmp, dest)
+        return size
 
-def download_filings():
+
+def load_state(path=STATE_FILE):
+    """
+    Accessions already downloaded by a previous (possibly interrupted) run.
+    A torn last line from a crash is cut off, so the next record appended
+    starts on a line of its own.
+    """
+    done = set()
+    if os.path.exists(path):
+        with open(path, "rb+") as f:
+            good = 0
+            for line in f:
+                if not line.endswith(b"\n"):
+                    f.truncate(good)
+                    break
+                good += len(line)
+                try:
+                    done.add(json.loads(line)["accession"])
+                except (ValueError, KeyError):
+                    continue
+    return done
+
+
+def download_filings(tickers=TICKERS, forms=FORMS, limit=LIMIT, workers=WORKERS,
+                     rate=REQUESTS_PER_SECOND, data_dir=DATA_DIR, state_file=None,
+                     www_url=EDGAR_WWW_URL, data_url=EDGAR_DATA_URL):
     if not USER_AGENT_EMAIL or "email" in USER_AGENT_EMAIL:
         print("WARNING: Please set a valid User-Agent email in the script before running.")
-        
-    dl = Downloader(USER_AGENT_NAME, USER_AGENT_EMAIL, DATA_DIR)
-    
-    print(f"Downloading 10-K filings for {len(TICKERS)} companies to {DATA_DIR}...")
-    
-    success_count = 0
-    
-    for ticker in tqdm(TICKERS):
-        try:
-            # Download the latest 2 10-K filings (covers last ~2-3 years)
-            dl.get("10-K", ticker, limit=2)
-            success_count += 1
-        except Exception as e:
-            print(f"Failed to download {ticker}: {e}")
-            
-    print(f"Finished. Successfully downloaded {success_count}/{len(TICKERS)} companies.")
+
+    if rate + BURST > SEC_MAX_REQUESTS_PER_SECOND:
+        rate = float(SEC_MAX_REQUESTS_PER_SECOND - BURST)
+        print(f"WARNING: Requested rate is over the SEC limit; using {rate:g} req/s.")
+    # The state lives with the filings it describes
+    state_file = state_file or os.path.join(data_dir, "ingest_state.jsonl")
+    tickers = [t.upper() for t in tickers]
+    client = EdgarClient(TokenBucket(rate, BURST), workers=workers, www_url=www_url, data_url=data_url)
+    done = load_state(state_file)
+    os.makedirs(data_dir, exist_ok=True)
+    state_lock = threading.Lock()
+
+    print(f"Downloading {', '.join(forms)} filings for {len(tickers)} companies to {data_dir} "
+          f"({workers} workers, {rate:g} req/s, {len(done)} accessions already done)...")
+
+    ciks = client.ticker_ciks()
+    missing = [t for t in tickers if t not in ciks]
+    for ticker in missing:
+        print(f"Failed to download {ticker}: unknown ticker")
+
+    def list_jobs(ticker):
+        cik = ciks[ticker]
+        filings = client.recent_filings(cik)
+        jobs = []
+        for form in forms:
+            jobs.extend((ticker, cik, f) for f in [f for f in filings if f["form"] == form][:limit])
+        return jobs
+
+    def fetch(job):
+        ticker, cik, filing = job
+        dest = os.path.join(data_dir, "sec-edgar-filings", ticker, filing["form"].replace("/", "-"),
+                            filing["accession"], "full-submission.txt")
+        size = client.download_submission(cik, filing["accession"], dest)
+        with state_lock, open(state_file, "a", encoding="utf-8") as f:
+            f.write(json.dumps(dict(filing, ticker=ticker, bytes=size)) + "\n")
+        return size
+
+    jobs, failed = [], set(missing)
+    total_bytes = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        listings = {pool.submit(list_jobs, t): t for t in tickers if t in ciks}
+        for fut in as_completed(listings):
+            try:
+                jobs.extend(fut.result())
+            except Exception as e:
+                failed.add(listings[fut])
+                print(f"Failed to list filings for {listings[fut]}: {e}")
+
+        todo = [j for j in jobs if j[2]["accession"] not in done]
+        print(f"{len(jobs)} filings found, {len(jobs) - len(todo)} already downloaded, {len(todo)} to fetch.")
+
+        downloads = {pool.submit(fetch, j): j for j in todo}
+        for fut in tqdm(as_completed(downloads), total=len(downloads)):
+            ticker, _, filing = downloads[fut]
+            try:
+                total_bytes += fut.result()
+            except Exception as e:
+                failed.add(ticker)
+                print(f"Failed to download {ticker} {filing['accession']}: {e}")
+
+    ok = len([t for t in tickers if t not in failed])
+    print(f"Finished. Successfully downloaded {ok}/{len(tickers)} companies "
+          f"({total_bytes / 1e6:.1f} MB this run).")
+    return failed
+
 
 if __name__ == "__main__":
-    download_filings()
+    parser = argparse.ArgumentParser(description="Download SEC filings for a list of tickers.")
+    parser.add_argument("--tickers", default=",".join(TICKERS), help="Comma-separated tickers")
+    parser.add_argument("--tickers-file", default=None, help="File with one ticker per line (overrides --tickers)")
+    parser.add_argument("--forms", default=",".join(FORMS), help="Comma-separated form types, e.g. 10-K,10-Q")
+    parser.add_argument("--limit", type=int, default=LIMIT, help="Latest N filings per ticker and form")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--rate", type=float, default=REQUESTS_PER_SECOND, help="Requests per second (SEC limit is 10)")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    args = parser.parse_args()
+
+    if args.tickers_file:
+        with open(args.tickers_file) as f:
+            tickers = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    else:
+        tickers = [t.strip() for t in args.tickers.split(",") if t.strip()]
+    forms = [f.strip() for f in args.forms.split(",") if f.strip()]
+    download_filings(tickers, forms, args.limit, args.workers, args.rate, args.data_dir)
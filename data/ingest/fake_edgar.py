@@ -0,0 +1,136 @@
+import json
+import time
+import random
+import argparse
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for the three EDGAR endpoints download_edgar.py uses, so the
+# ingester can be exercised (concurrency, rate limit, retries, resume)
+# without hitting sec.gov:
+#
+#   python data/ingest/fake_edgar.py --port 8765 &
+#   EDGAR_WWW_URL=http://127.0.0.1:8765 EDGAR_DATA_URL=http://127.0.0.1:8765 \
+#       python data/ingest/download_edgar.py --tickers AAPL,MSFT --data-dir /tmp/edgar
+#   curl http://127.0.0.1:8765/_stats
+#
+# /_stats reports request counts and the highest number of requests seen in
+# any 1 second window, which must stay <= 10. tests/test_download_edgar.py
+# runs the ingester against it and checks the rate limit and resume.
+
+FORMS = ["10-K", "10-Q", "8-K"]
+
+class FakeEdgar:
+    def __init__(self, tickers, filings_per_form, error_rate, latency_s, doc_kb):
+        self.ciks = {t: 1000 + i for i, t in enumerate(tickers)}
+        self.filings_per_form = filings_per_form
+        self.error_rate = error_rate
+        self.latency_s = latency_s
+        self.doc_kb = doc_kb
+        self.lock = threading.Lock()
+        self.window = deque()
+        self.stats = {"requests": 0, "errors_injected": 0, "max_requests_per_second": 0, "by_path": {}}
+
+    def record(self, path):
+        now = time.monotonic()
+        with self.lock:
+            self.window.append(now)
+            while self.window and self.window[0] <= now - 1.0:
+                self.window.popleft()
+            self.stats["requests"] += 1
+            self.stats["max_requests_per_second"] = max(self.stats["max_requests_per_second"], len(self.window))
+            kind = path.split("/")[1] if "/" in path else path
+            self.stats["by_path"][kind] = self.stats["by_path"].get(kind, 0) + 1
+
+    def company_tickers(self):
+        return {str(i): {"cik_str": cik, "ticker": t, "title": f"{t} Inc."} for i, (t, cik) in enumerate(self.ciks.items())}
+
+    def accessions(self, cik):
+        rows = []
+        for year in range(2024, 2024 - self.filings_per_form, -1):
+            for n, form in enumerate(FORMS):
+                rows.append((f"{cik:010d}-{year % 100:02d}-{n:06d}", form, f"{year}-02-01", f"{year - 1}-12-31"))
+        return rows
+
+    def submissions(self, cik):
+        rows = self.accessions(cik)
+        return {"cik": str(cik), "filings": {"recent": {
+            "accessionNumber": [r[0] for r in rows],
+            "form": [r[1] for r in rows],
+            "filingDate": [r[2] for r in rows],
+            "reportDate": [r[3] for r in rows],
+        }}}
+
+    def submission_text(self, cik, accession):
+        row = next((r for r in self.accessions(cik) if r[0] == accession), None)
+        if row is None:
+            return None
+        filler = "<p>Liquidity and interest rate risk.</p>\n" * (self.doc_kb * 1024 // 42)
+        return (f"<SEC-DOCUMENT>{accession}.txt\n<SEC-HEADER>ACCESSION NUMBER: {accession}\n"
+                f"CONFORMED PERIOD OF REPORT: {row[3].replace('-', '')}\n</SEC-HEADER>\n"
+                f"<DOCUMENT>\n<TYPE>{row[1]}\n<TEXT>\n<html><body>\n"
+                f"<p>Item 1A. Risk Factors</p>\n{filler}<p>Item 1B. Unresolved Staff Comments</p>\n"
+                f"<p>Item 7. Management's Discussion</p>\n{filler}<p>Item 7A. Quantitative</p>\n"
+                f"</body></html>\n</TEXT>\n</DOCUMENT>\n</SEC-DOCUMENT>\n")
+
+def make_handler(edgar):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1" # keep-alive, so connection pooling is visible
+
+        def send(self, status, body, content_type="application/json", headers=None):
+            data = body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            path = self.path.split("?")[0]
+            if path == "/_stats":
+                return self.send(200, json.dumps(edgar.stats))
+            edgar.record(path)
+            if edgar.latency_s:
+                time.sleep(edgar.latency_s)
+            if edgar.error_rate and random.random() < edgar.error_rate:
+                with edgar.lock:
+                    edgar.stats["errors_injected"] += 1
+                return self.send(429, "{}", headers={"Retry-After": "1"})
+
+            if path == "/files/company_tickers.json":
+                return self.send(200, json.dumps(edgar.company_tickers()))
+            if path.startswith("/submissions/CIK") and path.endswith(".json"):
+                cik = int(path[len("/submissions/CIK"):-len(".json")])
+                if cik not in edgar.ciks.values():
+                    return self.send(404, "{}")
+                return self.send(200, json.dumps(edgar.submissions(cik)))
+            parts = path.strip("/").split("/")
+            if len(parts) == 6 and parts[:3] == ["Archives", "edgar", "data"]:
+                text = edgar.submission_text(int(parts[3]), parts[5][:-len(".txt")])
+                if text is not None:
+                    return self.send(200, text, content_type="text/plain")
+            self.send(404, "{}")
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve fake EDGAR responses for testing download_edgar.py.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--tickers", default="AAPL,MSFT,GOOGL,AMZN,JPM,BAC,XOM,CVX")
+    parser.add_argument("--filings", type=int, default=3, help="Filings per form type per ticker")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 429")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds added to every response")
+    parser.add_argument("--doc-kb", type=int, default=64, help="Approximate size of each submission")
+    args = parser.parse_args()
+
+    edgar = FakeEdgar([t.strip().upper() for t in args.tickers.split(",")], args.filings,
+                      args.error_rate, args.latency, args.doc_kb)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(edgar))
+    print(f"Fake EDGAR on http://127.0.0.1:{args.port} ({len(edgar.ciks)} tickers)")
+    server.serve_forever()
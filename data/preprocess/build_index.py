@@ -0,0 +1,58 @@
+import os
+import sys
+import json
+import argparse
+from transformers import AutoTokenizer
+
+# Chunking/indexing code lives with the API so the service can load the index
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from app.dedup import keep_priority
+from app.retrieval import write_index
+
+INPUT_FILE = "data/processed/sections.jsonl"
+INDEX_DIR = "data/index"
+TOKENIZER = "meta-llama/Meta-Llama-3-8B-Instruct" # Must match the served model for exact token budgets
+# Chunks this similar (MinHash Jaccard) to an indexed chunk of the same
+# ticker/section are skipped, e.g. paragraphs unchanged since last year's 10-K.
+# Sections are indexed newest filing first, so the copy kept is the newest
+# one, as in dedup_sections.py.
+DEDUP_THRESHOLD = 0.8
+
+def read_sections(path):
+    """
+    Records of `path`, newest filing first (app.dedup.keep_priority). Only
+    offsets and sort keys are held in memory; records are re-read by offset.
+    """
+    entries = []
+    with open(path, "rb") as f:
+        while True:
+            offset = f.tell()
+            line = f.readline()
+            if not line:
+                break
+            entries.append((keep_priority(json.loads(line)), offset))
+        entries.sort(key=lambda e: e[0], reverse=True)
+        for _, offset in entries:
+            f.seek(offset)
+            yield json.loads(f.readline())
+
+def build_index(input_file=INPUT_FILE, index_dir=INDEX_DIR, embed_model=None, dedup_threshold=DEDUP_THRESHOLD):
+    if not os.path.exists(input_file):
+        print(f"Error: {input_file} not found. Run parse_10k.py first.")
+        return
+
+    tokenizer = AutoTokenizer.from_pretrained(TOKENIZER, token=os.getenv("HF_TOKEN"))
+    print(f"Chunking {input_file} and writing index to {index_dir}...")
+    meta = write_index(index_dir, read_sections(input_file), tokenizer, embed_model=embed_model,
+                       dedup_threshold=dedup_threshold or None)
+    print(f"Done. Indexed {meta['n_chunks']} chunks (avg {meta['avg_doc_len']:.0f} terms each), "
+          f"skipped {meta['n_duplicates_skipped']} near-duplicates.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the BM25 retrieval index over parsed 10-K sections.")
+    parser.add_argument("--input", default=INPUT_FILE)
+    parser.add_argument("--index-dir", default=INDEX_DIR)
+    parser.add_argument("--embed-model", default=None, help="Optional sentence-transformers model for dense vectors")
+    parser.add_argument("--dedup-threshold", type=float, default=DEDUP_THRESHOLD, help="0 = index duplicate chunks")
+    args = parser.parse_args()
+    build_index(args.input, args.index_dir, args.embed_model, args.dedup_threshold)
@@ -1,95 +1,219 @@
-import json
-import random
 import os
+import sys
+import json
+import glob
+import hashlib
+import argparse
+import pyarrow as pa
+import pyarrow.parquet as pq
+from transformers import AutoTokenizer
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from app.dedup import NearDuplicateFilter, keep_priority
+from app.prompts import DEFAULT_QUERY
 
 INPUT_FILE = "data/processed/sections.jsonl"
-OUTPUT_TRAIN = "data/processed/train.jsonl"
-OUTPUT_VAL = "data/processed/val.jsonl"
+OUTPUT_DIR = "data/processed/sft" # {train,val}/part-00000.parquet, ...
+TOKENIZER = "meta-llama/Meta-Llama-3-8B-Instruct" # Must match the model being fine-tuned
+
+# Train/val split: a section goes to val when the hash of its split key
+# falls under VAL_FRACTION. Keying on the ticker keeps every filing of a
+# company on one side, so nothing about a company in val was seen in
+# training; "filing" splits per accession instead. Change SPLIT_SALT to
+# draw a different (but equally reproducible) split.
+VAL_FRACTION = 0.1
+SPLIT_KEY = "ticker"
+SPLIT_SALT = "sft-v1"
+
+# Token windows: each section yields up to MAX_WINDOWS_PER_SECTION examples,
+# each with a CONTEXT_TOKENS context, so prompt + completion fits in the
+# trainer's max_seq_length (1024) without truncation. Rows hold the parts of
+# the example; train/pretokenize.py and eval/eval_qa.py put them into the
+# prompt with app/prompts.py, the same builder the API uses.
+CONTEXT_TOKENS = 768
+WINDOW_OVERLAP = 64
+TARGET_TOKENS = 128
+MAX_WINDOWS_PER_SECTION = 4
+MIN_SECTION_CHARS = 200 # Skip tiny sections
+# Near-duplicate filings are best dropped whole with dedup_sections.py (pass
+# its output with --input). On top of that, windows this similar (MinHash
+# Jaccard) to a window of the same ticker and section can be skipped, newest
+# filing first (app.dedup.keep_priority, as in dedup_sections.py). Fixed
+# offset windows only line up across years where the text before them is
+# unchanged, so this catches far less. Off by default, since it changes the
+# dataset: 0 = keep all windows.
+DEDUP_THRESHOLD = 0.0
+
+SHARD_ROWS = 4096 # Examples per Parquet file
+ROW_GROUP_ROWS = 512
+
+SCHEMA = pa.schema([
+    ("context", pa.string()),
+    ("query", pa.string()),
+    ("target", pa.string()),
+    ("ticker", pa.string()),
+    ("section", pa.string()),
+    ("fiscal_year", pa.int32()),
+    ("accession", pa.string()),
+    ("window", pa.int32()),
+    ("n_context_tokens", pa.int32()),
+])
+
+def read_sections(path):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+def newest_first(path):
+    """
+    Records of `path` by keep_priority, newest filing first (file order
+    among equals). Only offsets are held: records are re-read one by one.
+    """
+    index = []
+    with open(path, "rb") as f:
+        while True:
+            offset = f.tell()
+            line = f.readline()
+            if not line:
+                break
+            index.append((keep_priority(json.loads(line)), offset))
+    index.sort(key=lambda entry: entry[0], reverse=True)
+    with open(path, "rb") as f:
+        for _, offset in index:
+            f.seek(offset)
+            yield json.loads(f.readline())
+
+def split_of(record, split_key=SPLIT_KEY, val_fraction=VAL_FRACTION):
+    """'train' or 'val', from a hash of the record's ticker (or accession)."""
+    if split_key == "filing":
+        key = record.get("accession") or os.path.basename(os.path.dirname(record.get("source_path", "")))
+    else:
+        key = record.get("ticker") or ""
+    digest = hashlib.sha256(f"{SPLIT_SALT}:{key}".encode("utf-8")).digest()
+    bucket = int.from_bytes(digest[:8], "big") / 2 ** 64
+    return "val" if bucket < val_fraction else "train"
+
+def token_windows(text, tokenizer):
+    """
+    Yield (context, target, n_context_tokens) windows over `text`, cut at
+    token boundaries using the tokenizer's character offsets.
 
-# Llama 3 Prompt Template (Standard)
-PROMPT_TEMPLATE = """<|begin_of_text|><|start_header_id|>system<|end_header_id|>
+    Until a teacher model writes real answers, the completion is the start
+    of the window itself (the same mock target as before, now token-sized).
+    """
+    offsets = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+    step = max(1, CONTEXT_TOKENS - WINDOW_OVERLAP)
+    for n, start in enumerate(range(0, len(offsets), step)):
+        if n >= MAX_WINDOWS_PER_SECTION:
+            break
+        window = offsets[start:start + CONTEXT_TOKENS]
+        begin = window[0][0]
+        context = text[begin:window[-1][1]]
+        target = text[begin:window[:TARGET_TOKENS][-1][1]]
+        yield context.strip(), target.strip(), len(window)
+        if start + CONTEXT_TOKENS >= len(offsets):
+            break
 
-You are a financial risk analyst. Analyze the provided SEC 10-K section and identify key risks.<|eot_id|><|start_header_id|>user<|end_header_id|>
+class ShardWriter:
+    """Streams rows into numbered Parquet files of at most SHARD_ROWS rows."""
 
-Based on the following text, what are the primary risk factors?
+    def __init__(self, out_dir, shard_rows=SHARD_ROWS, row_group_rows=ROW_GROUP_ROWS):
+        self.out_dir = out_dir
+        self.shard_rows = shard_rows
+        self.row_group_rows = row_group_rows
+        self.rows = []
+        self.writer = None
+        self.shard = 0
+        self.in_shard = 0
+        self.total = 0
+        os.makedirs(out_dir, exist_ok=True)
+        # Stale shards from a bigger previous run would otherwise be loaded too
+        for path in glob.glob(os.path.join(out_dir, "part-*.parquet")):
+            os.remove(path)
 
-Context:
-{context}<|eot_id|><|start_header_id|>assistant<|end_header_id|>
+    def write(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.row_group_rows or self.in_shard + len(self.rows) >= self.shard_rows:
+            self._flush()
 
-"""
+    def _flush(self):
+        if not self.rows:
+            return
+        if self.writer is None:
+            path = os.path.join(self.out_dir, f"part-{self.shard:05d}.parquet")
+            self.writer = pq.ParquetWriter(path, SCHEMA)
+        self.writer.write_table(pa.Table.from_pylist(self.rows, schema=SCHEMA))
+        self.in_shard += len(self.rows)
+        self.total += len(self.rows)
+        self.rows = []
+        if self.in_shard >= self.shard_rows:
+            self.writer.close()
+            self.writer = None
+            self.shard += 1
+            self.in_shard = 0
 
-def create_dataset():
-    if not os.path.exists(INPUT_FILE):
-        print(f"Error: {INPUT_FILE} not found. Run parse_10k.py first.")
+    def close(self):
+        self._flush()
+        if self.writer is not None:
+            self.writer.close()
+            self.shard += 1
+        return self.total
+
+def create_dataset(input_file=INPUT_FILE, output_dir=OUTPUT_DIR, split_key=SPLIT_KEY, val_fraction=VAL_FRACTION,
+                   dedup_threshold=DEDUP_THRESHOLD):
+    if not os.path.exists(input_file):
+        print(f"Error: {input_file} not found. Run parse_10k.py first.")
         return
 
-    print("Loading extracted sections...")
-    data = []
-    with open(INPUT_FILE, "r") as f:
-        for line in f:
-            data.append(json.loads(line))
-    
-    print(f"Loaded {len(data)} sections. Generating SFT samples...")
-    
-    # In a real scenario, we would use a Teacher Model (GPT-4) to generate 
-    # high-quality QA pairs from this text.
-    # For this resume project setup, we will create a "Self-Supervised" style task 
-    # or a structured summary task to ensure we have data to train on immediately.
-    # We will format it as: "Analyze this text..." -> "Here is the key info..." (using the text itself as target for now, or simple extraction)
-    
-    # IMPROVEMENT: To make this robust without an API key, we'll format it as detailed summarization:
-    # Input: Text
-    # Target: The Text (Identity) - effectively "Continued Pretraining" formatted as Instruct
-    # OR better: Split text into chunks, Input=First Half, Output=Second Half (Next Token Prediction style via Instruct)
-    
-    # Let's stick to the Plan: "Grounding". 
-    # Since we don't have the Teacher Model running here, I will structure the data 
-    # for the *format* of Fine-Tuning, even if the "Answer" is naive (the text itself) for the demo.
-    # User can swap this logic with real QA generation later.
-    
-    formatted_data = []
-    
-    for item in data:
-        text = item.get("text", "")
-        if len(text) < 200: continue # Skip tiny sections
-        
-        # Naive "Risk Summary" simulation: 
-        # For the sake of having a runnable pipeline, we'll use the section headline + first 200 chars as Input
-        # And the rest as Output. 
-        # (Ideally, you'd run a separate script with an OpenAI Key to generate real QA)
-        
-        sft_example = {
-            "instruction": "Analyze the following SEC filing section and extract risk factors.",
-            "input": text[:1000], # Trucate for input
-            "output": "Risk factors identified in this section include: " + text[:500] + "..." # Mock output
-        }
-        
-        # Better: Llama 3 Format
-        # We need a 'text' field that contains the full prompt + completion
-        full_text = PROMPT_TEMPLATE.format(context=text[:1500]) + "Analysis: " + text[:500] # Mock completion
-        
-        formatted_data.append({
-            "text": full_text,
-            "metadata": {"ticker": item.get("ticker"), "section": item.get("section")}
-        })
-
-    # Split Train/Val
-    random.shuffle(formatted_data)
-    split_idx = int(len(formatted_data) * 0.9)
-    train_data = formatted_data[:split_idx]
-    val_data = formatted_data[split_idx:]
-    
-    # Save
-    with open(OUTPUT_TRAIN, "w") as f:
-        for entry in train_data:
-            f.write(json.dumps(entry) + "\n")
-            
-    with open(OUTPUT_VAL, "w") as f:
-        for entry in val_data:
-            f.write(json.dumps(entry) + "\n")
-            
-    print(f"Saved {len(train_data)} training examples to {OUTPUT_TRAIN}")
-    print(f"Saved {len(val_data)} validation examples to {OUTPUT_VAL}")
+    tokenizer = AutoTokenizer.from_pretrained(TOKENIZER, token=os.getenv("HF_TOKEN"))
+    writers = {split: ShardWriter(os.path.join(output_dir, split)) for split in ("train", "val")}
+    dups = NearDuplicateFilter(dedup_threshold) if dedup_threshold > 0 else None
+
+    # In a real scenario, we would use a Teacher Model (GPT-4) to generate
+    # high-quality QA pairs from this text. Until then the completion is the
+    # start of the context, so the pipeline has something to train on.
+    print(f"Streaming {input_file} into {output_dir} (split by {split_key}, {val_fraction:.0%} val)...")
+    sections = skipped = 0
+    dup_windows = dup_tokens = 0
+    for record in (newest_first(input_file) if dups is not None else read_sections(input_file)):
+        text = record.get("text", "")
+        if len(text) < MIN_SECTION_CHARS:
+            skipped += 1
+            continue
+        sections += 1
+        writer = writers[split_of(record, split_key, val_fraction)]
+        for n, (context, target, n_tokens) in enumerate(token_windows(text, tokenizer)):
+            scope = (record.get("ticker"), (record.get("section") or "").lower())
+            if dups is not None and dups.seen(context, (record.get("accession"), n), scope):
+                dup_windows += 1
+                dup_tokens += n_tokens
+                continue
+            writer.write({
+                "context": context,
+                "query": DEFAULT_QUERY,
+                "target": target,
+                "ticker": record.get("ticker"),
+                "section": record.get("section"),
+                "fiscal_year": record.get("fiscal_year"),
+                "accession": record.get("accession"),
+                "window": n,
+                "n_context_tokens": n_tokens,
+            })
+
+    counts = {split: w.close() for split, w in writers.items()}
+    print(f"Used {sections} sections ({skipped} too short).")
+    if dups is not None:
+        print(f"Skipped {dup_windows} near-duplicate windows ({dup_tokens:,} context tokens).")
+    for split, n in counts.items():
+        print(f"Saved {n} {split} examples to {os.path.join(output_dir, split)} ({writers[split].shard} shards)")
 
 if __name__ == "__main__":
-    create_dataset()
+    parser = argparse.ArgumentParser(description="Build the SFT dataset from parsed 10-K sections.")
+    parser.add_argument("--input", default=INPUT_FILE)
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--split-key", choices=["ticker", "filing"], default=SPLIT_KEY)
+    parser.add_argument("--val-fraction", type=float, default=VAL_FRACTION)
+    parser.add_argument("--dedup-threshold", type=float, default=DEDUP_THRESHOLD,
+                        help="Skip windows this similar to one of a newer filing (e.g. 0.8); 0 = keep all")
+    args = parser.parse_args()
+    create_dataset(args.input, args.output_dir, args.split_key, args.val_fraction, args.dedup_threshold)
@@ -0,0 +1,175 @@
+import os
+import sys
+import json
+import argparse
+from collections import defaultdict
+from transformers import AutoTokenizer
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from app.dedup import DEFAULT_THRESHOLD, LSHIndex, MinHasher, changed_passages, keep_priority, similarity
+from app.retrieval import split_units
+
+INPUT_FILE = "data/processed/sections.jsonl"
+OUTPUT_FILE = "data/processed/sections_dedup.jsonl" # Feed to create_sft.py / build_index.py with --input
+CHANGES_FILE = "data/processed/section_changes.jsonl"
+REPORT_FILE = "results/dedup_report.json"
+TOKENIZER = "meta-llama/Meta-Llama-3-8B-Instruct" # Only used to count the tokens removed
+
+# A section is compared with the same ticker's filings of the same item (the
+# year-over-year copies download_edgar.py fetches). Of a near-duplicate group
+# the newest filing is kept (app.dedup.keep_priority, which build_index.py's
+# chunk dedup also uses), so training and the index see current wording.
+# Memory is one MinHash signature per section: texts are re-read by offset.
+
+def scan(input_file, hasher):
+    """Byte offset, ticker, section, fiscal year and signature of every record."""
+    entries = []
+    with open(input_file, "rb") as f:
+        while True:
+            offset = f.tell()
+            line = f.readline()
+            if not line:
+                break
+            record = json.loads(line)
+            entries.append({
+                "offset": offset,
+                "ticker": record.get("ticker"),
+                "section": record.get("section"),
+                "fiscal_year": record.get("fiscal_year") or 0,
+                "accession": record.get("accession") or "",
+                "sig": hasher.signature(record.get("text", "")),
+            })
+    return entries
+
+def read_at(f, offset):
+    f.seek(offset)
+    return json.loads(f.readline())
+
+def label(entry):
+    return f"{entry['ticker']} {entry['fiscal_year']} {entry['section']}"
+
+def find_duplicates(entries, threshold):
+    """{entry index: (index of the kept near-duplicate, similarity)}, newest filing kept."""
+    groups = defaultdict(list)
+    for i, entry in enumerate(entries):
+        groups[(entry["ticker"], (entry["section"] or "").lower())].append(i)
+    duplicates = {}
+    for members in groups.values():
+        index = LSHIndex(threshold)
+        for i in sorted(members, key=lambda i: keep_priority(entries[i]), reverse=True):
+            matches = index.query(entries[i]["sig"])
+            if matches:
+                duplicates[i] = matches[0]
+            else:
+                index.insert(i, entries[i]["sig"])
+    return duplicates, groups
+
+def write_changes(f, entries, groups, threshold, hasher, changes_file):
+    """
+    Year-over-year diff of every ticker/section filed in several years, by
+    paragraph (or sentence, for sections whose paragraph breaks were lost).
+    """
+    n = 0
+    with open(changes_file, "w", encoding="utf-8") as out_f:
+        for members in groups.values():
+            by_year = {}
+            for i in sorted(members, key=lambda i: entries[i]["accession"]):
+                by_year[entries[i]["fiscal_year"]] = i # Last filing of the year (e.g. a 10-K/A)
+            years = sorted(by_year)
+            for old_year, new_year in zip(years, years[1:]):
+                old, new = entries[by_year[old_year]], entries[by_year[new_year]]
+                old_units, _ = split_units(read_at(f, old["offset"])["text"])
+                new_units, _ = split_units(read_at(f, new["offset"])["text"])
+                added, removed = changed_passages(old_units, new_units, threshold, hasher)
+                out_f.write(json.dumps({
+                    "ticker": new["ticker"],
+                    "section": new["section"],
+                    "from_year": old_year,
+                    "to_year": new_year,
+                    "similarity": round(similarity(old["sig"], new["sig"]), 3),
+                    "added": added,
+                    "removed": removed,
+                }) + "\n")
+                n += 1
+    return n
+
+def show_changes(changes_file, ticker, width=160):
+    """Print the year-over-year changes of one ticker as a +/- diff."""
+    with open(changes_file, "r", encoding="utf-8") as f:
+        for line in f:
+            change = json.loads(line)
+            if change["ticker"] != ticker.upper():
+                continue
+            print(f"\n=== {change['ticker']} {change['section']}: {change['from_year']} -> {change['to_year']} "
+                  f"(similarity {change['similarity']:.0%}) ===")
+            for passage in change["removed"]:
+                print(f"- {passage[:width]}")
+            for passage in change["added"]:
+                print(f"+ {passage[:width]}")
+
+def dedup_sections(input_file=INPUT_FILE, output_file=OUTPUT_FILE, threshold=DEFAULT_THRESHOLD,
+                   changes_file=CHANGES_FILE, report_file=REPORT_FILE):
+    if not os.path.exists(input_file):
+        print(f"Error: {input_file} not found. Run parse_10k.py first.")
+        return
+
+    tokenizer = AutoTokenizer.from_pretrained(TOKENIZER, token=os.getenv("HF_TOKEN"))
+    hasher = MinHasher()
+    print(f"Hashing sections in {input_file}...")
+    entries = scan(input_file, hasher)
+    duplicates, groups = find_duplicates(entries, threshold)
+
+    tokens_total = tokens_removed = 0
+    removed_by_ticker = defaultdict(int)
+    with open(input_file, "rb") as f, open(output_file, "wb") as out_f:
+        for i, entry in enumerate(entries):
+            f.seek(entry["offset"])
+            line = f.readline()
+            n_tokens = len(tokenizer(json.loads(line).get("text", ""), add_special_tokens=False)["input_ids"])
+            tokens_total += n_tokens
+            if i in duplicates:
+                tokens_removed += n_tokens
+                removed_by_ticker[entry["ticker"]] += n_tokens
+            else:
+                out_f.write(line)
+        n_changes = write_changes(f, entries, groups, threshold, hasher, changes_file) if changes_file else 0
+
+    report = {
+        "input": input_file,
+        "threshold": threshold,
+        "sections": len(entries),
+        "sections_kept": len(entries) - len(duplicates),
+        "tokens": tokens_total,
+        "tokens_removed": tokens_removed,
+        "tokens_removed_pct": round(100 * tokens_removed / max(tokens_total, 1), 1),
+        "tokens_removed_by_ticker": dict(sorted(removed_by_ticker.items())),
+        "duplicates": [
+            {"removed": label(entries[i]), "kept": label(entries[kept]), "similarity": round(sim, 3)}
+            for i, (kept, sim) in sorted(duplicates.items())
+        ],
+    }
+    os.makedirs(os.path.dirname(report_file) or ".", exist_ok=True)
+    with open(report_file, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"Kept {report['sections_kept']}/{len(entries)} sections in {output_file}; removed "
+          f"{tokens_removed:,} of {tokens_total:,} tokens ({report['tokens_removed_pct']}%).")
+    if changes_file:
+        print(f"Wrote {n_changes} year-over-year diffs to {changes_file}")
+    print(f"✅ Report saved to {report_file}")
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drop near-duplicate 10-K sections (MinHash/LSH) and diff years.")
+    parser.add_argument("--input", default=INPUT_FILE)
+    parser.add_argument("--output", default=OUTPUT_FILE)
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Estimated Jaccard similarity (word 5-grams) above which sections are duplicates")
+    parser.add_argument("--changes", default=CHANGES_FILE, help="Year-over-year diff output ('' to skip)")
+    parser.add_argument("--report", default=REPORT_FILE)
+    parser.add_argument("--show", metavar="TICKER", help="Only print the year-over-year changes of TICKER")
+    args = parser.parse_args()
+    if args.show:
+        show_changes(args.changes, args.show)
+    else:
+        dedup_sections(args.input, args.output, args.threshold, args.changes, args.report)
@@ -1,34 +1,273 @@
 import os
 import re
+import sys
 import json
+import time
+import hashlib
+import argparse
+from html.parser import HTMLParser
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 from bs4 import BeautifulSoup
 from tqdm import tqdm
 
+# The section store reader is used by the API, so it lives with the app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from app.section_store import write_store
+
 RAW_DIR = "data/raw"
 OUTPUT_FILE = "data/processed/sections.jsonl"
+MANIFEST_FILE = "data/processed/manifest.json" # (size, mtime, sha256, parser, output offset) per filing
+REPORT_FILE = "data/processed/parse_report.json" # Per-file timings of the last run
+STORE_DIR = "data/processed" # sections.bin + sections_index.npy (see app/section_store.py)
+
+# 10-K item headers in filing order. Each header is "Item <n>" followed by
+# the first word(s) of its title, which skips most cross-references in the body.
+ITEM_TITLES = [
+    ("1", r"Business"),
+    ("1A", r"Risk\s+Factors"),
+    ("1B", r"Unresolved"),
+    ("1C", r"Cybersecurity"),
+    ("2", r"Properties"),
+    ("3", r"Legal\s+Proceedings"),
+    ("4", r"Mine\s+Safety"),
+    ("5", r"Market"),
+    ("6", r"(?:\[\s*Reserved\s*\]|Reserved|Selected)"),
+    ("7", r"Management"),
+    ("7A", r"Quantitative"),
+    ("8", r"Financial\s+Statements"),
+    ("9", r"Changes\s+in"),
+    ("9A", r"Controls"),
+    ("9B", r"Other\s+Information"),
+    ("9C", r"Disclosure"),
+    ("10", r"Directors"),
+    ("11", r"Executive\s+Compensation"),
+    ("12", r"Security\s+Ownership"),
+    ("13", r"Certain\s+Relationships"),
+    ("14", r"Principal\s+Account"),
+    ("15", r"Exhibits"),
+    ("16", r"Form\s+10-K\s+Summary"),
+]
+ITEM_ORDER = [item for item, _ in ITEM_TITLES]
+# One alternation so a single scan finds every header. Lettered items come
+# before their bare number so "Item 7A" is never read as "Item 7".
+ITEM_HEADER_PATTERN = re.compile(
+    r"Item\s+(?:"
+    + "|".join(
+        f"(?P<item_{item}>{item}\\.?\\s+{title})"
+        for item, title in sorted(ITEM_TITLES, key=lambda t: (-len(t[0]), t[0]))
+    )
+    + ")",
+    re.IGNORECASE,
+)
+
+# Sections written to sections.jsonl (everything else is still located, so
+# adding e.g. "Item 1" or "Item 1C" here needs no parser changes)
+SECTIONS_TO_EXTRACT = ["Item 1A", "Item 7"]
+
+# Bump when a change to the extraction code changes its output: manifest
+# entries written by another parser version (or for other sections) are
+# reparsed instead of reused.
+PARSER_VERSION = 2
 
-# Regex for finding items
+# Main document types in the SGML envelope of full-submission.txt
+MAIN_DOCUMENT_TYPES = ("10-K", "10-K405", "10-KT", "10-K/A")
+READ_BLOCK = 1 << 20
+
+# Regex for finding items (used by the BeautifulSoup reference parser)
 ITEM_1A_PATTERN = re.compile(r"Item\s+1A\.?\s+Risk\s+Factors", re.IGNORECASE)
 ITEM_1B_PATTERN = re.compile(r"Item\s+1B\.?\s+Unresolved", re.IGNORECASE)
 ITEM_7_PATTERN = re.compile(r"Item\s+7\.?\s+Management", re.IGNORECASE)
 ITEM_7A_PATTERN = re.compile(r"Item\s+7A\.?\s+Quantitative", re.IGNORECASE)
 
+PERIOD_PATTERN = re.compile(r"CONFORMED PERIOD OF REPORT:\s*(\d{8})")
+
 def clean_text(text):
     """Normalize whitespace and remove junk."""
     text = re.sub(r'\s+', ' ', text).strip()
     return text
 
-def parse_filing(file_path):
+def iter_main_document(file_path, doc_types=MAIN_DOCUMENT_TYPES):
+    """
+    Yield the body of the main 10-K document of a filing in blocks.
+
+    full-submission.txt wraps every document (10-K, exhibits, XBRL,
+    uuencoded images) in <DOCUMENT><TYPE>...<TEXT>...</TEXT></DOCUMENT>.
+    Only the <TEXT> of the first document whose TYPE is a 10-K is yielded;
+    everything else is scanned past without being kept. Files without an
+    SGML envelope (a bare .html primary document) are yielded whole.
+    """
+    def blocks():
+        with open(file_path, "r", encoding="utf-8", errors="replace") as f:
+            for block in iter(lambda: f.read(READ_BLOCK), ""):
+                yield block
+
+    buf = ""
+    state = "seek_document"
+    seen_envelope = False
+    for block in blocks():
+        buf += block
+        while True:
+            if state == "seek_document":
+                i = buf.find("<DOCUMENT>")
+                if i < 0:
+                    buf = buf[-len("<DOCUMENT>"):]
+                    break
+                seen_envelope = True
+                buf = buf[i + len("<DOCUMENT>"):]
+                state = "read_type"
+            elif state == "read_type":
+                i = buf.find("<TYPE>")
+                j = buf.find("\n", i) if i >= 0 else -1
+                if j < 0:
+                    break
+                doc_type = buf[i + len("<TYPE>"):j].strip().upper()
+                buf = buf[j:]
+                state = "seek_text" if doc_type in doc_types else "skip_document"
+            elif state == "skip_document":
+                i = buf.find("</DOCUMENT>")
+                if i < 0:
+                    buf = buf[-len("</DOCUMENT>"):]
+                    break
+                buf = buf[i + len("</DOCUMENT>"):]
+                state = "seek_document"
+            elif state == "seek_text":
+                i = buf.find("<TEXT>")
+                if i < 0:
+                    buf = buf[-len("<TEXT>"):]
+                    break
+                buf = buf[i + len("<TEXT>"):]
+                state = "emit"
+            elif state == "emit":
+                i = buf.find("</TEXT>")
+                if i >= 0:
+                    yield buf[:i]
+                    return
+                # Hold back enough to recognise a closing tag split across blocks
+                keep = len("</TEXT>") - 1
+                if len(buf) > keep:
+                    yield buf[:-keep]
+                    buf = buf[-keep:]
+                break
+    if state == "emit":
+        yield buf
+    elif not seen_envelope:
+        yield from blocks()
+
+class _TextExtractor(HTMLParser):
+    """
+    Collects visible text the way BeautifulSoup's get_text(" ", strip=True)
+    does: every text node stripped, empty ones dropped, script/style skipped.
+
+    The parser is fed block by block and hands over pending text at the end
+    of every feed(), so one text node can arrive as several handle_data
+    calls. They are joined as-is and the node is only stripped and kept at
+    the next tag (or comment, declaration, close()), where it really ends.
+    """
+
+    SKIP_TAGS = {"script", "style"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.pieces = []
+        self._node = []
+        self._skip_depth = 0
+
+    def _end_node(self):
+        data = "".join(self._node).strip()
+        self._node = []
+        if data:
+            self.pieces.append(data)
+
+    def handle_starttag(self, tag, attrs):
+        self._end_node()
+        if tag in self.SKIP_TAGS:
+            self._skip_depth += 1
+
+    def handle_endtag(self, tag):
+        self._end_node()
+        if tag in self.SKIP_TAGS and self._skip_depth:
+            self._skip_depth -= 1
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self._node.append(data)
+
+    def handle_comment(self, data):
+        self._end_node()
+
+    def handle_decl(self, decl):
+        self._end_node()
+
+    def handle_pi(self, data):
+        self._end_node()
+
+    def unknown_decl(self, data):
+        self._end_node()
+
+    def close(self):
+        super().close()
+        self._end_node()
+
+def extract_text(file_path):
+    """Flattened text of the main 10-K document, fed to the parser block by block."""
+    parser = _TextExtractor()
+    for block in iter_main_document(file_path):
+        parser.feed(block)
+    parser.close()
+    return " ".join(parser.pieces)
+
+def find_item_headers(text):
+    """Last (start, end) of every item header, found in one scan of the text."""
+    last = {}
+    for m in ITEM_HEADER_PATTERN.finditer(text):
+        # The Table of Contents comes first, so the last match is the real header
+        last[m.lastgroup[len("item_"):].upper()] = (m.start(), m.end())
+    return last
+
+def parse_filing(file_path, sections_to_extract=None):
+    """
+    Extract item sections from a filing without building a DOM.
+
+    A section runs from the end of its (last) header to the start of the
+    header of the next item in ITEM_ORDER that the filing has, wherever
+    that header is. Missing items are skipped: a filing without Item 1B
+    ends Item 1A at Item 1C (or Item 2), where parse_filing_soup drops it.
+    A section whose next header comes before it is dropped.
+    """
+    wanted = sections_to_extract or SECTIONS_TO_EXTRACT
+    text = extract_text(file_path)
+    headers = find_item_headers(text)
+
+    sections = []
+    for name in wanted:
+        item = name.split()[-1].upper()
+        if item not in headers:
+            continue
+        start = headers[item][1]
+        end = None
+        for next_item in ITEM_ORDER[ITEM_ORDER.index(item) + 1:]:
+            if next_item in headers:
+                end = headers[next_item][0]
+                break
+        if end is not None and start < end:
+            sections.append({
+                "section": name,
+                "text": clean_text(text[start:end])
+            })
+    return sections
+
+def parse_filing_soup(file_path):
+    """
+    Original BeautifulSoup extractor (whole file, full DOM), kept as the
+    reference that `--verify` checks the streaming parser against.
+    """
     with open(file_path, "r", encoding="utf-8") as f:
         content = f.read()
 
     soup = BeautifulSoup(content, "lxml")
     text = soup.get_text(" ", strip=True) # Simple text extraction first
     
-    # Ideally, we loop through text to find indices of headers.
-    # This is a naive extraction for the resume project (production needs robust HTML parsing)
-    
     # Find start/end based on regex strings in the extracted text
     matches_1a = list(ITEM_1A_PATTERN.finditer(text))
     matches_1b = list(ITEM_1B_PATTERN.finditer(text))
@@ -60,51 +299,237 @@ def parse_filing(file_path):
             
     return sections
 
-def process_all():
-    os.makedirs(os.path.dirname(OUTPUT_FILE), exist_ok=True)
-    all_records = []
-    
-    # Walk through the sec-edgar-downloader structure: /data/raw/sec-edgar-filings/{Ticker}/10-K/{Accession}/full-submission.txt
-    
-    total_files = 0
-    for root, _, files in os.walk(RAW_DIR):
+def verify_against_soup(paths):
+    """Compare streaming and BeautifulSoup extraction of 1A/7 on each filing."""
+    mismatches = 0
+    for path in tqdm(paths):
+        old = {s["section"]: s["text"] for s in parse_filing_soup(path)}
+        new = {s["section"]: s["text"] for s in parse_filing(path, ["Item 1A", "Item 7"])}
+        for section in sorted(set(old) | set(new)):
+            if old.get(section) != new.get(section):
+                mismatches += 1
+                print(f"MISMATCH {section} in {path}: soup={len(old.get(section) or '')} chars, "
+                      f"stream={len(new.get(section) or '')} chars")
+    print(f"Verified {len(paths)} filings: {mismatches} section mismatches.")
+    return mismatches
+
+def read_period_of_report(file_path):
+    """
+    "CONFORMED PERIOD OF REPORT" (YYYYMMDD) from the SEC header at the top
+    of full-submission.txt, or None. Stops at the first document.
+    """
+    with open(file_path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            m = PERIOD_PATTERN.search(line)
+            if m:
+                return m.group(1)
+            if line.startswith("</SEC-HEADER>") or line.startswith("<DOCUMENT>"):
+                break
+    return None
+
+def filing_fiscal_year(file_path):
+    """Fiscal year of a filing = calendar year its reporting period ends in."""
+    period = read_period_of_report(file_path)
+    return int(period[:4]) if period else None
+
+def accession_from_path(path):
+    # .../{Ticker}/10-K/{Accession}/full-submission.txt
+    return os.path.basename(os.path.dirname(path))
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def find_filings(raw_dir=RAW_DIR):
+    """All filing paths under raw_dir, sorted so output order is deterministic."""
+    paths = []
+    for root, _, files in os.walk(raw_dir):
         for file in files:
             if file.endswith(".txt") or file.endswith(".html"):
-                total_files += 1
-                
-    print(f"Found {total_files} filings to process.")
-    
-    processed_count = 0
-    with open(OUTPUT_FILE, "w", encoding="utf-8") as out_f:
-        for root, _, files in os.walk(RAW_DIR):
-            for file in files:
-                if file.endswith(".txt") or file.endswith(".html"):
-                    path = os.path.join(root, file)
-                    
-                    # Ticker matches directory structure
-                    parts = path.split(os.sep)
-                    try:
-                        ticker = parts[-4] # Adjust based on actual structure
-                    except:
-                        ticker = "UNKNOWN"
-                        
-                    try:
-                        sections = parse_filing(path)
-                        for sec in sections:
-                            record = {
-                                "ticker": ticker,
-                                "section": sec["section"],
-                                "text": sec["text"],
-                                "source_path": path
-                            }
-                            out_f.write(json.dumps(record) + "\n")
-                        processed_count += 1
-                        if processed_count % 10 == 0:
-                            print(f"Processed {processed_count} files...")
-                    except Exception as e:
-                        print(f"Error parsing {path}: {e}")
-
-    print(f"Done. Saved to {OUTPUT_FILE}")
+                paths.append(os.path.join(root, file))
+    return sorted(paths)
+
+def parser_fingerprint():
+    """Identifies what a manifest entry's output was produced with."""
+    key = json.dumps([PARSER_VERSION, SECTIONS_TO_EXTRACT])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:12]
+
+def load_manifest(path=MANIFEST_FILE):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def is_unchanged(path, entry, output_exists):
+    """
+    Compare a filing against its manifest entry. Output from another parser
+    version is stale. Size+mtime match is trusted; otherwise the content
+    hash decides (e.g. a re-download of the same file).
+    """
+    if entry is None or not output_exists:
+        return False
+    if entry.get("parser") != parser_fingerprint():
+        return False
+    st = os.stat(path)
+    if st.st_size == entry["size"] and st.st_mtime == entry["mtime"]:
+        return True
+    if st.st_size != entry["size"]:
+        return False
+    return file_sha256(path) == entry["sha256"]
+
+def _parse_job(path):
+    """Worker: parse one filing. Returns (sections, fiscal_year, error, seconds)."""
+    start = time.perf_counter()
+    try:
+        sections = parse_filing(path)
+        fiscal_year = filing_fiscal_year(path)
+        error = None
+    except Exception as e:
+        sections, fiscal_year, error = [], None, str(e)
+    return sections, fiscal_year, error, time.perf_counter() - start
+
+def process_all(workers=None, full=False):
+    """
+    Parse all filings into OUTPUT_FILE, reusing the output of unchanged ones.
+
+    The manifest records each filing's (size, mtime, sha256), the parser
+    fingerprint and where its records sit in OUTPUT_FILE, so on the next
+    run unchanged filings are copied byte-for-byte from the previous output
+    and only new or changed filings (or all of them, after a parser change)
+    go through the process pool. Output order is the sorted filing
+    path order regardless of which worker finishes first.
+    """
+    os.makedirs(os.path.dirname(OUTPUT_FILE), exist_ok=True)
+    wall_start = time.perf_counter()
+
+    # Walk through the sec-edgar-downloader structure: /data/raw/sec-edgar-filings/{Ticker}/10-K/{Accession}/full-submission.txt
+    paths = find_filings()
+    print(f"Found {len(paths)} filings to process.")
+
+    old_manifest = {} if full else load_manifest()
+    output_exists = os.path.exists(OUTPUT_FILE)
+    unchanged = {p for p in paths if is_unchanged(p, old_manifest.get(p), output_exists)}
+    to_parse = [p for p in paths if p not in unchanged]
+    print(f"{len(unchanged)} unchanged (skipped), {len(to_parse)} new or changed.")
+
+    manifest = {}
+    report = []
+    tmp_output = OUTPUT_FILE + ".tmp"
+    old_out = open(OUTPUT_FILE, "rb") if unchanged else None
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool, open(tmp_output, "wb") as out_f:
+            parsed = pool.map(_parse_job, to_parse, chunksize=1)
+            for path in tqdm(paths):
+                offset = out_f.tell()
+                if path in unchanged:
+                    entry = old_manifest[path]
+                    old_out.seek(entry["offset"])
+                    out_f.write(old_out.read(entry["length"]))
+                    manifest[path] = dict(entry, offset=offset, mtime=os.stat(path).st_mtime)
+                    report.append({"path": path, "status": "skipped", "seconds": 0.0, "sections": entry["sections"]})
+                    continue
+
+                sections, fiscal_year, error, seconds = next(parsed)
+                if error:
+                    print(f"Error parsing {path}: {error}")
+
+                # Ticker matches directory structure
+                parts = path.split(os.sep)
+                try:
+                    ticker = parts[-4] # Adjust based on actual structure
+                except IndexError:
+                    ticker = "UNKNOWN"
+
+                for sec in sections:
+                    record = {
+                        "ticker": ticker,
+                        "fiscal_year": fiscal_year,
+                        "accession": accession_from_path(path),
+                        "section": sec["section"],
+                        "text": sec["text"],
+                        "source_path": path
+                    }
+                    out_f.write((json.dumps(record) + "\n").encode("utf-8"))
+
+                report.append({"path": path, "status": "error" if error else "parsed", "seconds": round(seconds, 3), "sections": len(sections)})
+                if error:
+                    continue # Not recorded, so it is retried next run
+                st = os.stat(path)
+                manifest[path] = {
+                    "size": st.st_size,
+                    "mtime": st.st_mtime,
+                    "sha256": file_sha256(path),
+                    "parser": parser_fingerprint(),
+                    "offset": offset,
+                    "length": out_f.tell() - offset,
+                    "sections": len(sections),
+                    "parse_seconds": round(seconds, 3),
+                }
+    finally:
+        if old_out is not None:
+            old_out.close()
+
+    os.replace(tmp_output, OUTPUT_FILE)
+    with open(MANIFEST_FILE, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    n_store = write_section_store()
+    write_timing_report(report, time.perf_counter() - wall_start)
+    print(f"Done. Saved to {OUTPUT_FILE} ({n_store} sections in the store under {STORE_DIR})")
+
+def write_section_store(input_file=OUTPUT_FILE, store_dir=STORE_DIR):
+    """
+    Rebuild the mmap-able section store from sections.jsonl in one streaming
+    pass. Records written before fiscal_year/accession were added to the
+    output (copied over for unchanged filings) get them filled in here.
+    """
+    fiscal_years = {}
+
+    def records():
+        with open(input_file, "r", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                path = record.get("source_path", "")
+                if "accession" not in record:
+                    record["accession"] = accession_from_path(path)
+                if "fiscal_year" not in record:
+                    if path not in fiscal_years:
+                        fiscal_years[path] = filing_fiscal_year(path) if os.path.exists(path) else None
+                    record["fiscal_year"] = fiscal_years[path]
+                yield record
+
+    return write_store(store_dir, records())
+
+def write_timing_report(report, wall_seconds):
+    parsed = [r for r in report if r["status"] != "skipped"]
+    cpu_seconds = sum(r["seconds"] for r in parsed)
+    summary = {
+        "filings": len(report),
+        "parsed": sum(r["status"] == "parsed" for r in report),
+        "skipped": sum(r["status"] == "skipped" for r in report),
+        "errors": sum(r["status"] == "error" for r in report),
+        "wall_seconds": round(wall_seconds, 2),
+        "parse_seconds_total": round(cpu_seconds, 2),
+        "files": report,
+    }
+    with open(REPORT_FILE, "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=1)
+
+    print(f"Parsed {summary['parsed']}, skipped {summary['skipped']}, errors {summary['errors']} "
+          f"in {wall_seconds:.1f}s wall ({cpu_seconds:.1f}s of parsing).")
+    for r in sorted(parsed, key=lambda r: r["seconds"], reverse=True)[:5]:
+        print(f"  {r['seconds']:7.2f}s  {r['path']}")
+    print(f"Per-file timings written to {REPORT_FILE}")
 
 if __name__ == "__main__":
-    process_all()
+    parser = argparse.ArgumentParser(description="Extract 10-K sections into sections.jsonl.")
+    parser.add_argument("--workers", type=int, default=None, help="Parser processes (default: all cores)")
+    parser.add_argument("--full", action="store_true", help="Ignore the manifest and reparse every filing")
+    parser.add_argument("--verify", action="store_true", help="Check the streaming parser against the BeautifulSoup one instead of writing output")
+    args = parser.parse_args()
+    if args.verify:
+        verify_against_soup(find_filings())
+    else:
+        process_all(workers=args.workers, full=args.full)
@@ -0,0 +1,132 @@
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+import torch
+from transformers import AutoTokenizer, AutoModelForCausalLM
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from app.cpu_inference import SKIP_MODULES, configure_threads, load_cpu_model
+from app.generation import generate_batch
+from app.prompts import PromptBuilder
+
+# Latency and memory of the CPU serving modes (app/cpu_inference.py) against
+# the old CPU path: the fp16 model as loaded for GPUs. Each mode runs in its
+# own process so peak RSS is not shared between them. The int8 and dynamic
+# modes keep lm_head in 16/32 bits (cpu_inference.SKIP_MODULES), so their
+# memory and speed figures include a full-precision output projection.
+MODEL_PATH = "./llama-3-8b-financial-risk-merged" # Export from train/export_merged.py
+RESULTS_FILE = "results/bench_cpu.json"
+MODES = ["fp16", "fp32", "bf16", "int8-bf16", "int8-fp32", "dynamic"]
+REQUESTS = 8
+MAX_NEW_TOKENS = 32
+CONTEXT_WORDS = 300
+
+# mode -> (quantization, compute dtype); "fp16" is the baseline
+MODE_SETTINGS = {
+    "fp32": ("none", torch.float32),
+    "bf16": ("none", torch.bfloat16),
+    "int8-bf16": ("int8", torch.bfloat16),
+    "int8-fp32": ("int8", torch.float32),
+    "dynamic": ("dynamic", torch.float32),
+}
+
+SAMPLE_TEXT = ("The Company is exposed to interest rate risk, credit risk and liquidity risk. "
+               "A prolonged economic downturn could reduce demand for our products, increase loan "
+               "losses and adversely affect our results of operations and financial condition. ")
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return (rss if sys.platform == "darwin" else rss * 1024) / 2**20
+
+def run_mode(mode, model_path, requests, max_new_tokens, context_words, threads):
+    """Load the model in `mode` and time `requests` single-request generations."""
+    threads = configure_threads(threads)
+    started = time.perf_counter()
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    tokenizer.pad_token = tokenizer.pad_token or tokenizer.eos_token
+    tokenizer.padding_side = "left"
+    if mode == "fp16":
+        # What app/main.py did on CPU before the CPU mode existed
+        model = AutoModelForCausalLM.from_pretrained(model_path, torch_dtype=torch.float16).to("cpu")
+        model.eval()
+    else:
+        quantization, dtype = MODE_SETTINGS[mode]
+        model = load_cpu_model(model_path, quantization, dtype)
+    load_seconds = time.perf_counter() - started
+
+    words = SAMPLE_TEXT.split()
+    context = " ".join(words[i % len(words)] for i in range(context_words))
+    prompt = PromptBuilder(tokenizer).build(context, "What are the primary risk factors?")
+    generate_batch(model, tokenizer, [prompt], max_new_tokens=4) # Warmup
+
+    latencies, tokens = [], 0
+    for _ in range(requests):
+        t0 = time.perf_counter()
+        counted = []
+        generate_batch(model, tokenizer, [prompt], max_new_tokens=max_new_tokens,
+                       on_token=lambda i, t: counted.append(t))
+        latencies.append(time.perf_counter() - t0)
+        tokens += len(counted)
+    latencies.sort()
+    return {
+        "mode": mode,
+        "threads": threads,
+        "load_s": round(load_seconds, 2),
+        "latency_p50_s": round(latencies[len(latencies) // 2], 3),
+        "latency_max_s": round(latencies[-1], 3),
+        "tokens_per_s": round(tokens / sum(latencies), 2),
+        "peak_rss_mb": round(peak_rss_mb()),
+    }
+
+def benchmark(modes, model_path=MODEL_PATH, requests=REQUESTS, max_new_tokens=MAX_NEW_TOKENS,
+              context_words=CONTEXT_WORDS, threads=0, results_file=RESULTS_FILE):
+    results = []
+    for mode in modes:
+        print(f"Benchmarking {mode}...")
+        cmd = [sys.executable, os.path.abspath(__file__), "--worker", mode, "--model", model_path,
+               "--requests", str(requests), "--max-new-tokens", str(max_new_tokens),
+               "--context-words", str(context_words), "--threads", str(threads)]
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(f"❌ {mode} failed:\n{proc.stderr[-2000:]}")
+            continue
+        results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    baseline = next((r for r in results if r["mode"] == "fp16"), None)
+    print(f"\n{'mode':<10} {'load s':>7} {'p50 s':>7} {'tok/s':>7} {'RSS MB':>8}")
+    for r in results:
+        if baseline:
+            r["speedup_vs_fp16"] = round(baseline["latency_p50_s"] / r["latency_p50_s"], 2)
+            r["rss_vs_fp16"] = round(r["peak_rss_mb"] / baseline["peak_rss_mb"], 2)
+        print(f"{r['mode']:<10} {r['load_s']:>7} {r['latency_p50_s']:>7} {r['tokens_per_s']:>7} {r['peak_rss_mb']:>8}"
+              + (f"   {r['speedup_vs_fp16']}x faster, {r['rss_vs_fp16']}x memory" if baseline else ""))
+
+    os.makedirs(os.path.dirname(results_file) or ".", exist_ok=True)
+    with open(results_file, "w") as f:
+        json.dump({"model": model_path, "requests": requests, "max_new_tokens": max_new_tokens,
+                   "context_words": context_words, "unquantized_modules": list(SKIP_MODULES),
+                   "results": results}, f, indent=2)
+    print(f"✅ Results saved to {results_file}")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the CPU serving modes against the fp16 CPU path.")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--modes", default=",".join(MODES), help=f"Comma-separated subset of {MODES}")
+    parser.add_argument("--requests", type=int, default=REQUESTS)
+    parser.add_argument("--max-new-tokens", type=int, default=MAX_NEW_TOKENS)
+    parser.add_argument("--context-words", type=int, default=CONTEXT_WORDS)
+    parser.add_argument("--threads", type=int, default=0, help="0 = the container CPU limit")
+    parser.add_argument("--output", default=RESULTS_FILE)
+    parser.add_argument("--worker", help=argparse.SUPPRESS) # Runs one mode and prints its JSON
+    args = parser.parse_args()
+    if args.worker:
+        print(json.dumps(run_mode(args.worker, args.model, args.requests, args.max_new_tokens,
+                                  args.context_words, args.threads)))
+    else:
+        benchmark(args.modes.split(","), args.model, args.requests, args.max_new_tokens,
+                  args.context_words, args.threads, args.output)
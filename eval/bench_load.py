@@ -0,0 +1,405 @@
+import os
+import sys
+import json
+import time
+import zlib
+import bisect
+import random
+import argparse
+import itertools
+import threading
+import subprocess
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import requests
+import torch
+from transformers import AutoTokenizer, LlamaConfig, LlamaForCausalLM
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Latency benchmark of the API under load, reproducible between releases.
+# Payloads are cut from real 10-K sections, with a controlled mix of context
+# lengths and a Zipf popularity over distinct payloads (so a known share are
+# repeats, as when analysts ask about the same filings). Closed-loop
+# scenarios keep N requests in flight; open-loop scenarios send at a fixed
+# Poisson rate whatever the server does, with latency counted from the
+# scheduled send time so queueing is not hidden. Without --url the app is
+# started on a tiny random-weight stand-in model (real tokenizer), which
+# exercises batching, caching and streaming at a fraction of the cost.
+# Compare against a stored baseline with --baseline; regressions exit 1.
+SECTIONS_FILE = "data/processed/sections.jsonl"
+RESULTS_FILE = "results/bench_load.json"
+BASELINE_FILE = "results/bench_load_baseline.json"
+TOKENIZER = "meta-llama/Meta-Llama-3-8B-Instruct"
+TINY_MODEL_DIR = "/tmp/risk-api-tiny-model"
+PORT = 8765
+SEED = 0
+
+# Distinct payloads per scenario, their context lengths (words -> share),
+# and the Zipf exponent of their popularity (0: all equally likely)
+UNIQUE_PAYLOADS = 200
+LENGTH_MIX = {64: 0.3, 256: 0.4, 768: 0.2, 2048: 0.1}
+ZIPF_S = 1.0
+SECTION_POOL = 2000 # Sections kept in memory to cut payloads from
+QUERIES = [
+    "What are the primary risk factors?",
+    "What are the primary liquidity risks?",
+    "Summarize the regulatory and compliance risks.",
+    "What risks relate to competition and market conditions?",
+    "Are there any cybersecurity or data privacy risks?",
+    "What supply chain risks are disclosed?",
+]
+
+CLOSED_CONCURRENCY = [1, 4, 16]
+CLOSED_REQUESTS = 100
+OPEN_RATES = [1.0, 4.0] # requests/s
+OPEN_DURATION_S = 60
+OPEN_MAX_INFLIGHT = 256
+MAX_NEW_TOKENS = 64 # Of the stand-in server
+REQUEST_TIMEOUT_S = 300
+
+# Regression: a latency metric up, or a throughput metric down, by more
+# than the tolerance; or the error rate up by more than MAX_ERROR_RATE_INCREASE
+TOLERANCE = 0.15
+MAX_ERROR_RATE_INCREASE = 0.01
+HIGHER_IS_WORSE = {
+    "latency_p50_s": True,
+    "latency_p95_s": True,
+    "latency_p99_s": True,
+    "ttft_p50_s": True,
+    "ttft_p95_s": True,
+    "tokens_per_s": False,
+    "throughput_rps": False,
+}
+
+def load_sections(path=SECTIONS_FILE, pool=SECTION_POOL, seed=SEED):
+    """Reservoir sample of `pool` section texts (the file can be large)."""
+    rng = random.Random(seed)
+    sections = []
+    with open(path, "r", encoding="utf-8") as f:
+        for n, line in enumerate(f):
+            text = json.loads(line).get("text", "")
+            if not text:
+                continue
+            if len(sections) < pool:
+                sections.append(text)
+            else:
+                j = rng.randrange(n + 1)
+                if j < pool:
+                    sections[j] = text
+    return sections
+
+class PayloadSampler:
+    """
+    /analyze payloads: `unique` distinct (text, query) pairs, each a window
+    of a random section with a length drawn from `length_mix`, requested
+    with Zipf(`zipf_s`) popularity. The same seed gives the same payloads
+    in the same order.
+    """
+
+    def __init__(self, sections, length_mix=LENGTH_MIX, unique=UNIQUE_PAYLOADS, zipf_s=ZIPF_S, seed=SEED):
+        if not sections:
+            raise ValueError("No sections to sample payloads from")
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        lengths = self._rng.choices(list(length_mix), weights=list(length_mix.values()), k=unique)
+        self.payloads = []
+        for n_words in lengths:
+            words = self._rng.choice(sections).split()
+            start = self._rng.randrange(max(1, len(words) - n_words + 1))
+            self.payloads.append({"text": " ".join(words[start:start + n_words]), "query": self._rng.choice(QUERIES)})
+        weights = [1 / (rank + 1) ** zipf_s for rank in range(unique)]
+        total = sum(weights)
+        self._cdf = list(itertools.accumulate(w / total for w in weights))
+
+    def sample(self):
+        with self._lock:
+            x = self._rng.random()
+        return self.payloads[min(bisect.bisect_left(self._cdf, x), len(self.payloads) - 1)]
+
+    def draw(self, n):
+        return [self.sample() for _ in range(n)]
+
+def make_tiny_model(output_dir=TINY_MODEL_DIR, tokenizer_name=TOKENIZER):
+    """A 2-layer random-weight Llama with the real tokenizer, saved like a merged export."""
+    if os.path.exists(os.path.join(output_dir, "config.json")):
+        return output_dir
+    tokenizer = AutoTokenizer.from_pretrained(tokenizer_name, token=os.getenv("HF_TOKEN"))
+    torch.manual_seed(SEED)
+    config = LlamaConfig(
+        vocab_size=len(tokenizer),
+        hidden_size=64,
+        intermediate_size=128,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=8192,
+        bos_token_id=tokenizer.bos_token_id,
+        eos_token_id=tokenizer.eos_token_id,
+    )
+    LlamaForCausalLM(config).save_pretrained(output_dir)
+    tokenizer.save_pretrained(output_dir)
+    print(f"✨ Tiny stand-in model saved to {output_dir}")
+    return output_dir
+
+def start_server(model_dir, port=PORT, max_new_tokens=MAX_NEW_TOKENS, timeout_s=300):
+    """
+    The app on `model_dir`, in fp32 on CPU with no adapters, indexes or
+    shared cache, and its job and map stores in a scratch directory.
+    """
+    scratch = os.path.join(TINY_MODEL_DIR + "-run", str(port))
+    os.makedirs(scratch, exist_ok=True)
+    env = dict(
+        os.environ,
+        MERGED_MODEL_PATH=os.path.abspath(model_dir),
+        ADAPTER_DIR=os.path.join(scratch, "adapters"),
+        RETRIEVAL_INDEX_DIR=os.path.join(scratch, "index"),
+        SECTION_STORE_DIR=os.path.join(scratch, "sections"),
+        JOB_STORE_PATH=os.path.join(scratch, "jobs.db"),
+        MAP_STORE_PATH=os.path.join(scratch, "map.db"),
+        SCORE_CALIBRATION="",
+        SPEC_DRAFT_MODEL="",
+        CACHE_SHARED_URL="",
+        INFERENCE_DEVICE="cpu",
+        CPU_QUANTIZATION="none",
+        CPU_DTYPE="float32",
+        MAX_NEW_TOKENS=str(max_new_tokens),
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=REPO_ROOT, env=env,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited with code {server.returncode}")
+        try:
+            if requests.get(f"{url}/ready", timeout=1).status_code == 200:
+                return server, url
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    server.terminate()
+    raise RuntimeError("Server did not become ready in time")
+
+_sessions = threading.local()
+
+def send(url, payload, scheduled):
+    """
+    One /analyze/stream request, timed from `scheduled` (perf_counter):
+    {"ok", "status", "latency_s", "ttft_s", "answer", "cache"}.
+    """
+    session = getattr(_sessions, "session", None)
+    if session is None:
+        session = _sessions.session = requests.Session()
+    result = {"ok": False, "status": None, "ttft_s": None, "answer": "", "cache": None}
+    try:
+        with session.post(f"{url}/analyze/stream", json=payload, stream=True, timeout=REQUEST_TIMEOUT_S) as r:
+            result["status"] = r.status_code
+            result["cache"] = r.headers.get("X-Cache")
+            event = None
+            for line in r.iter_lines(decode_unicode=True) if r.status_code == 200 else ():
+                if line.startswith("event: "):
+                    event = line[len("event: "):]
+                elif line.startswith("data: "):
+                    if event is None and result["ttft_s"] is None:
+                        result["ttft_s"] = time.perf_counter() - scheduled
+                    if event == "done":
+                        result["answer"] = json.loads(line[len("data: "):])["answer"]
+                        result["ok"] = True
+                    event = None
+    except requests.RequestException as e:
+        result["status"] = type(e).__name__
+    result["latency_s"] = time.perf_counter() - scheduled
+    return result
+
+def run_closed(url, payloads, concurrency):
+    """`concurrency` users, each sending its next request as soon as the last one finishes."""
+    results = [None] * len(payloads)
+    queue = iter(enumerate(payloads))
+    lock = threading.Lock()
+
+    def user():
+        while True:
+            with lock:
+                item = next(queue, None)
+            if item is None:
+                return
+            i, payload = item
+            results[i] = send(url, payload, time.perf_counter())
+
+    started = time.perf_counter()
+    users = [threading.Thread(target=user) for _ in range(concurrency)]
+    for t in users:
+        t.start()
+    for t in users:
+        t.join()
+    return results, time.perf_counter() - started
+
+def run_open(url, payloads, rate, seed=SEED):
+    """Requests at Poisson arrivals of `rate`/s, sent whether or not earlier ones have finished."""
+    rng = random.Random(seed)
+    arrivals = list(itertools.accumulate(rng.expovariate(rate) for _ in payloads))
+    results = [None] * len(payloads)
+
+    def fire(i, payload, scheduled):
+        results[i] = send(url, payload, scheduled)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(OPEN_MAX_INFLIGHT) as pool:
+        for i, (payload, at) in enumerate(zip(payloads, arrivals)):
+            delay = started + at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(fire, i, payload, started + at)
+    return results, time.perf_counter() - started
+
+def percentile(values, q):
+    return round(float(np.percentile(values, q)), 4) if values else None
+
+def summarize(results, wall_s, tokenizer):
+    ok = [r for r in results if r["ok"]]
+    latencies = [r["latency_s"] for r in ok]
+    ttfts = [r["ttft_s"] for r in ok if r["ttft_s"] is not None]
+    tokens = sum(len(tokenizer(r["answer"], add_special_tokens=False)["input_ids"]) for r in ok)
+    return {
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "error_rate": round((len(results) - len(ok)) / max(len(results), 1), 4),
+        "wall_s": round(wall_s, 2),
+        "throughput_rps": round(len(ok) / wall_s, 3),
+        "tokens_per_s": round(tokens / wall_s, 1),
+        "latency_p50_s": percentile(latencies, 50),
+        "latency_p95_s": percentile(latencies, 95),
+        "latency_p99_s": percentile(latencies, 99),
+        "ttft_p50_s": percentile(ttfts, 50),
+        "ttft_p95_s": percentile(ttfts, 95),
+        "ttft_p99_s": percentile(ttfts, 99),
+        "cache_hit_rate": round(sum(r["cache"] == "HIT" for r in ok) / max(len(ok), 1), 3),
+        "statuses": dict(Counter(str(r["status"]) for r in results)),
+    }
+
+def compare(report, baseline, tolerance=TOLERANCE):
+    """Metrics of scenarios in both reports that got worse by more than the tolerance."""
+    regressions = []
+    for name, stats in report["scenarios"].items():
+        base = baseline["scenarios"].get(name)
+        if base is None:
+            continue
+        for metric, higher_is_worse in HIGHER_IS_WORSE.items():
+            new, old = stats.get(metric), base.get(metric)
+            if not new or not old:
+                continue
+            change = (new - old) / old
+            if (change if higher_is_worse else -change) > tolerance:
+                regressions.append({"scenario": name, "metric": metric, "baseline": old, "current": new,
+                                    "change_pct": round(100 * change, 1)})
+        if stats["error_rate"] > base["error_rate"] + MAX_ERROR_RATE_INCREASE:
+            regressions.append({"scenario": name, "metric": "error_rate", "baseline": base["error_rate"],
+                                "current": stats["error_rate"]})
+    return regressions
+
+def scenarios(closed_concurrency=CLOSED_CONCURRENCY, open_rates=OPEN_RATES):
+    return ([{"name": f"closed-c{c}", "mode": "closed", "concurrency": c} for c in closed_concurrency]
+            + [{"name": f"open-{r:g}rps", "mode": "open", "rate": r} for r in open_rates])
+
+def benchmark(url=None, model_dir=None, sections_file=SECTIONS_FILE, closed_concurrency=CLOSED_CONCURRENCY,
+              closed_requests=CLOSED_REQUESTS, open_rates=OPEN_RATES, open_duration_s=OPEN_DURATION_S,
+              unique=UNIQUE_PAYLOADS, zipf_s=ZIPF_S, max_new_tokens=MAX_NEW_TOKENS, tokenizer_name=None,
+              results_file=RESULTS_FILE, baseline_file=BASELINE_FILE, tolerance=TOLERANCE, save_baseline=False):
+    if not os.path.exists(sections_file):
+        print(f"Error: {sections_file} not found. Run parse_10k.py first.")
+        return
+    sections = load_sections(sections_file)
+
+    server = None
+    if url is None:
+        model_dir = model_dir or make_tiny_model()
+        print(f"Starting the API on {model_dir}...")
+        server, url = start_server(model_dir, max_new_tokens=max_new_tokens)
+    tokenizer = AutoTokenizer.from_pretrained(tokenizer_name or model_dir or TOKENIZER, token=os.getenv("HF_TOKEN"))
+
+    report = {
+        "config": {
+            "target": "stand-in" if server else url,
+            "model": model_dir,
+            "sections": len(sections),
+            "unique_payloads": unique,
+            "length_mix_words": LENGTH_MIX,
+            "zipf_s": zipf_s,
+            "max_new_tokens": max_new_tokens if server else None,
+            "seed": SEED,
+        },
+        "scenarios": {},
+    }
+    try:
+        for scenario in scenarios(closed_concurrency, open_rates):
+            name = scenario["name"]
+            # Each scenario draws its own payloads, so none start on a cache warmed by the last
+            sampler = PayloadSampler(sections, LENGTH_MIX, unique, zipf_s, seed=zlib.crc32(name.encode()))
+            if scenario["mode"] == "closed":
+                payloads = sampler.draw(closed_requests)
+                results, wall_s = run_closed(url, payloads, scenario["concurrency"])
+            else:
+                payloads = sampler.draw(max(1, int(scenario["rate"] * open_duration_s)))
+                results, wall_s = run_open(url, payloads, scenario["rate"])
+            stats = summarize(results, wall_s, tokenizer)
+            stats["repeat_share"] = round(1 - len({id(p) for p in payloads}) / len(payloads), 3)
+            report["scenarios"][name] = {**scenario, **stats}
+            print(f"{name}: p50 {stats['latency_p50_s']}s p99 {stats['latency_p99_s']}s "
+                  f"TTFT p50 {stats['ttft_p50_s']}s {stats['tokens_per_s']} tok/s "
+                  f"errors {stats['error_rate']:.1%}")
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    if baseline_file and not save_baseline and os.path.exists(baseline_file):
+        with open(baseline_file) as f:
+            baseline = json.load(f)
+        if baseline.get("config") != json.loads(json.dumps(report["config"])):
+            print("⚠️ Baseline was recorded with a different configuration; comparing anyway.")
+        report["baseline"] = baseline_file
+        report["regressions"] = compare(report, baseline, tolerance)
+        for r in report["regressions"]:
+            print(f"❌ {r['scenario']} {r['metric']}: {r['baseline']} -> {r['current']}")
+        if not report["regressions"]:
+            print(f"✅ No regressions against {baseline_file} (tolerance {tolerance:.0%})")
+
+    for path in [results_file] + ([baseline_file] if save_baseline else []):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+    print(f"✅ Results saved to {results_file}")
+    return report
+
+def parse_list(value, cast):
+    return [cast(v) for v in value.split(",") if v]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test the API with realistic payloads and track latency.")
+    parser.add_argument("--url", help="Benchmark a running server instead of starting one on a stand-in model")
+    parser.add_argument("--model", help=f"Model for the started server (default: a tiny stand-in in {TINY_MODEL_DIR})")
+    parser.add_argument("--tokenizer", help="Tokenizer to count answer tokens with (default: the model's)")
+    parser.add_argument("--sections", default=SECTIONS_FILE)
+    parser.add_argument("--closed", default=",".join(map(str, CLOSED_CONCURRENCY)), help="Closed-loop concurrencies")
+    parser.add_argument("--closed-requests", type=int, default=CLOSED_REQUESTS)
+    parser.add_argument("--open", default=",".join(map(str, OPEN_RATES)), help="Open-loop arrival rates (requests/s)")
+    parser.add_argument("--duration", type=float, default=OPEN_DURATION_S, help="Seconds per open-loop scenario")
+    parser.add_argument("--unique", type=int, default=UNIQUE_PAYLOADS, help="Distinct payloads per scenario")
+    parser.add_argument("--zipf", type=float, default=ZIPF_S, help="Payload popularity skew (0: no preference)")
+    parser.add_argument("--max-new-tokens", type=int, default=MAX_NEW_TOKENS)
+    parser.add_argument("--output", default=RESULTS_FILE)
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    parser.add_argument("--save-baseline", action="store_true", help="Also store this run as the baseline")
+    args = parser.parse_args()
+    report = benchmark(
+        args.url, args.model, args.sections, parse_list(args.closed, int), args.closed_requests,
+        parse_list(args.open, float), args.duration, args.unique, args.zipf, args.max_new_tokens,
+        args.tokenizer, args.output, args.baseline, args.tolerance, args.save_baseline,
+    )
+    if report and report.get("regressions"):
+        sys.exit(1)
@@ -0,0 +1,101 @@
+import os
+import sys
+import json
+import time
+import argparse
+import torch
+from transformers import AutoTokenizer
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from app.cpu_inference import load_cpu_model
+from app.generation import generate_batch
+from app.prompts import PromptBuilder
+from app.speculative import SpeculativeDecoder, check_compatible
+
+# Plain greedy vs. speculative decoding (app/speculative.py) on the same
+# prompts, one request at a time. Checks that both produce identical text
+# and reports draft acceptance and decode speed. Runs on CPU, so it can be
+# tried with two tiny models sharing a tokenizer, e.g.
+#   --target TinyLlama/TinyLlama-1.1B-Chat-v1.0 --draft <smaller llama-2-tokenizer model>
+TARGET_MODEL = "./llama-3-8b-financial-risk-merged"
+DRAFT_MODEL = "meta-llama/Llama-3.2-1B-Instruct"
+RESULTS_FILE = "results/bench_speculative.json"
+LOOKAHEADS = [2, 4, 6]
+MAX_NEW_TOKENS = 64
+
+CONTEXTS = [
+    "The Company is exposed to interest rate risk. Rising rates could reduce net interest margin and loan demand.",
+    "Our operations depend on third-party suppliers; disruptions could delay shipments and increase costs.",
+    "We are subject to extensive regulation, and changes in law could require us to change our business practices.",
+    "Cybersecurity incidents could compromise customer data, damage our reputation and result in litigation.",
+]
+QUERY = "What are the primary risk factors?"
+
+def timed(fn):
+    t0 = time.perf_counter()
+    out = fn()
+    return out, time.perf_counter() - t0
+
+def benchmark(target_path=TARGET_MODEL, draft_path=DRAFT_MODEL, lookaheads=LOOKAHEADS,
+              max_new_tokens=MAX_NEW_TOKENS, dtype="float32", results_file=RESULTS_FILE):
+    tokenizer = AutoTokenizer.from_pretrained(target_path)
+    tokenizer.pad_token = tokenizer.pad_token or tokenizer.eos_token
+    tokenizer.padding_side = "left"
+    check_compatible(tokenizer, AutoTokenizer.from_pretrained(draft_path))
+    target = load_cpu_model(target_path, "none", getattr(torch, dtype))
+    draft = load_cpu_model(draft_path, "none", getattr(torch, dtype))
+    builder = PromptBuilder(tokenizer)
+    prompts = [builder.build(context, QUERY) for context in CONTEXTS]
+
+    generate_batch(target, tokenizer, prompts[:1], max_new_tokens=4) # Warmup
+    plain, plain_s = [], 0.0
+    for prompt in prompts:
+        answer, seconds = timed(lambda: generate_batch(target, tokenizer, [prompt], max_new_tokens=max_new_tokens)[0])
+        plain.append(answer)
+        plain_s += seconds
+    n_tokens = sum(len(tokenizer(a, add_special_tokens=False)["input_ids"]) for a in plain)
+    results = [{"mode": "plain", "seconds": round(plain_s, 3), "tokens_per_s": round(n_tokens / plain_s, 1)}]
+
+    for lookahead in lookaheads:
+        # min_acceptance=0: measure every request, never fall back
+        decoder = SpeculativeDecoder(target, draft, tokenizer, lookahead, min_acceptance=0.0)
+        answers, spec_s = [], 0.0
+        for prompt in prompts:
+            answer, seconds = timed(lambda: decoder.generate(prompt, max_new_tokens))
+            answers.append(answer)
+            spec_s += seconds
+        results.append({
+            "mode": f"speculative-{lookahead}",
+            "seconds": round(spec_s, 3),
+            "tokens_per_s": round(n_tokens / spec_s, 1),
+            "speedup": round(plain_s / spec_s, 2),
+            "acceptance": round(decoder._acceptance or 0.0, 3),
+            "identical": answers == plain,
+        })
+
+    print(f"\n{'mode':<16} {'seconds':>8} {'tok/s':>8} {'speedup':>8} {'accept':>7} identical")
+    for r in results:
+        print(f"{r['mode']:<16} {r['seconds']:>8} {r['tokens_per_s']:>8} {r.get('speedup', 1.0):>8} "
+              f"{r.get('acceptance', ''):>7} {r.get('identical', '')}")
+    os.makedirs(os.path.dirname(results_file) or ".", exist_ok=True)
+    with open(results_file, "w") as f:
+        json.dump({"target": target_path, "draft": draft_path, "max_new_tokens": max_new_tokens, "results": results}, f, indent=2)
+    print(f"✅ Results saved to {results_file}")
+    if not all(r.get("identical", True) for r in results):
+        print("❌ Speculative output differs from plain greedy decoding!")
+        return None
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare speculative and plain greedy decoding on CPU.")
+    parser.add_argument("--target", default=TARGET_MODEL)
+    parser.add_argument("--draft", default=DRAFT_MODEL)
+    parser.add_argument("--lookaheads", default=",".join(map(str, LOOKAHEADS)))
+    parser.add_argument("--max-new-tokens", type=int, default=MAX_NEW_TOKENS)
+    parser.add_argument("--dtype", default="float32", choices=["float32", "bfloat16"])
+    parser.add_argument("--output", default=RESULTS_FILE)
+    args = parser.parse_args()
+    results = benchmark(args.target, args.draft, [int(k) for k in args.lookaheads.split(",")],
+                        args.max_new_tokens, args.dtype, args.output)
+    if results is None:
+        raise SystemExit(1)
@@ -0,0 +1,112 @@
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import torch
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import train_test_split
+from transformers import AutoTokenizer, AutoModelForCausalLM
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from app.prompts import PromptBuilder
+from app.scoring import RiskScorer
+
+# Fits the Platt scaling that turns /score's raw expected rating into the
+# probability that a passage discloses material risk. Labeled passages are
+# JSONL lines {"text": ..., "label": 1 | 0} ("high"/"low" also accepted;
+# "medium" lines are skipped). The server reads the output via SCORE_CALIBRATION.
+MODEL_PATH = "./llama-3-8b-financial-risk-merged" # Export from train/export_merged.py
+DATA_FILE = "data/processed/score_labels.jsonl"
+OUTPUT_FILE = "results/score_calibration.json"
+CONTEXT_TOKENS = 768
+HOLDOUT_FRACTION = 0.2
+N_BINS = 10
+
+def read_labeled(path):
+    texts, labels = [], []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            label = record["label"]
+            if isinstance(label, str):
+                if label.lower() not in ("high", "low"):
+                    continue
+                label = int(label.lower() == "high")
+            texts.append(record["text"])
+            labels.append(int(label))
+    return texts, np.array(labels)
+
+def expected_calibration_error(probs, labels, n_bins=N_BINS):
+    bins = np.minimum((probs * n_bins).astype(int), n_bins - 1)
+    error = 0.0
+    for b in range(n_bins):
+        in_bin = bins == b
+        if in_bin.any():
+            error += in_bin.mean() * abs(probs[in_bin].mean() - labels[in_bin].mean())
+    return float(error)
+
+def evaluate(probs, labels):
+    return {
+        "brier": round(float(np.mean((probs - labels) ** 2)), 4),
+        "ece": round(expected_calibration_error(probs, labels), 4),
+    }
+
+def calibrate(model_path=MODEL_PATH, data_file=DATA_FILE, output_file=OUTPUT_FILE, context_tokens=CONTEXT_TOKENS):
+    if not os.path.exists(data_file):
+        print(f"Error: {data_file} not found.")
+        return
+
+    texts, labels = read_labeled(data_file)
+    if len(set(labels.tolist())) < 2:
+        print("Error: need both high-risk (1) and low-risk (0) examples.")
+        return
+
+    device = "cuda" if torch.cuda.is_available() else "mps" if torch.backends.mps.is_available() else "cpu"
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    tokenizer.pad_token = tokenizer.pad_token or tokenizer.eos_token
+    model = AutoModelForCausalLM.from_pretrained(
+        model_path, torch_dtype=torch.float32 if device == "cpu" else torch.float16
+    ).to(device)
+    model.eval()
+    scorer = RiskScorer(model, tokenizer, PromptBuilder(tokenizer), context_tokens)
+
+    print(f"Scoring {len(texts)} labeled passages on {device}...")
+    started = time.perf_counter()
+    raw = np.array([r["raw_score"] for r in scorer.score(texts)])
+    seconds = time.perf_counter() - started
+
+    train_x, test_x, train_y, test_y = train_test_split(
+        raw, labels, test_size=HOLDOUT_FRACTION, random_state=0, stratify=labels
+    )
+    platt = LogisticRegression(C=1e4).fit(train_x.reshape(-1, 1), train_y)
+    calibrated = platt.predict_proba(test_x.reshape(-1, 1))[:, 1]
+
+    result = {
+        "a": float(platt.coef_[0][0]),
+        "b": float(platt.intercept_[0]),
+        "model": model_path,
+        "n_train": int(len(train_y)),
+        "n_holdout": int(len(test_y)),
+        "holdout_raw": evaluate(test_x, test_y),
+        "holdout_calibrated": evaluate(calibrated, test_y),
+        "texts_per_second": round(len(texts) / seconds, 1),
+    }
+    os.makedirs(os.path.dirname(output_file) or ".", exist_ok=True)
+    with open(output_file, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"Holdout Brier {result['holdout_raw']['brier']} -> {result['holdout_calibrated']['brier']}, "
+          f"ECE {result['holdout_raw']['ece']} -> {result['holdout_calibrated']['ece']} "
+          f"({result['texts_per_second']} texts/s)")
+    print(f"✅ Calibration saved to {output_file}")
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fit the /score calibration on labeled passages.")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--data", default=DATA_FILE)
+    parser.add_argument("--output", default=OUTPUT_FILE)
+    parser.add_argument("--context-tokens", type=int, default=CONTEXT_TOKENS)
+    args = parser.parse_args()
+    calibrate(args.model, args.data, args.output, args.context_tokens)
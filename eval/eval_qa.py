@@ -1,12 +1,22 @@
+import sys
 import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import torch
+import requests
 from datasets import load_dataset
 from transformers import AutoTokenizer, AutoModelForCausalLM
+from rouge_score import rouge_scorer
 from tqdm import tqdm
-import evaluate # HuggingFace evaluate library
 import os
 from dotenv import load_dotenv
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from app.generation import generate_batch
+from app.prompts import PromptBuilder
+
 load_dotenv()
 
 # Configuration
@@ -15,96 +25,241 @@ MODEL_PATH = "./llama-3-8b-financial-risk" # Fine-tuned Adapter (Local)
 # In Colab after training, change this to:
 # MODEL_PATH = "llama-3-8b-financial-risk" (The adapter path)
 
-VAL_FILE = "data/processed/val.jsonl"
+VAL_FILES = "data/processed/sft/val/*.parquet" # Written by create_sft.py
+RESULTS_DIR = "results"
+# Predictions are appended here as they are produced; a rerun skips every id
+# already in the file, so an interrupted evaluation picks up where it stopped.
+PREDICTIONS_FILE = os.path.join(RESULTS_DIR, "eval_predictions_{mode}.jsonl")
+SUMMARY_FILE = os.path.join(RESULTS_DIR, "eval_summary_{mode}.json")
 
-def compute_metrics(predictions, references):
-    # Load metrics
-    rouge = evaluate.load("rouge")
-    
-    # ROUGE
-    rouge_output = rouge.compute(predictions=predictions, references=references)
-    
-    print("\nResults:")
-    print(f"ROUGE-1: {rouge_output['rouge1']:.4f}")
-    print(f"ROUGE-L: {rouge_output['rougeL']:.4f}")
-    
-    return rouge_output
-
-def evaluate_model():
-    print(f"Loading model: {MODEL_PATH}...")
-    print(f"Loading model: {MODEL_PATH}...")
-    
+BATCH_SIZE = 8
+MAX_NEW_TOKENS = 100
+
+# Served mode: the same samples sent to a running /analyze endpoint
+ENDPOINT = "http://localhost:8000/analyze"
+# Contexts are cut to the API's CONTEXT_TOKEN_BUDGET in both modes, and sent
+# `verbatim` (no retrieval), so the served prompt is the offline one
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "768"))
+CONCURRENCY = 8
+ROUGE_TYPES = ["rouge1", "rougeL"]
+
+def load_samples(limit=None):
+    """(id, context, query, target) for every validation example."""
+    samples = []
+    dataset = load_dataset("parquet", data_files={"validation": VAL_FILES}, split="validation")
+    for i, item in enumerate(dataset):
+        sample_id = f"{item.get('ticker')}:{item.get('accession')}:{item.get('section')}:{item.get('window')}:{i}"
+        samples.append((sample_id, item["context"], item["query"], item["target"]))
+        if limit and len(samples) >= limit:
+            break
+    return samples
+
+class RunningMetrics:
+    """ROUGE F1 means and throughput, updated one prediction at a time."""
+
+    def __init__(self):
+        self.scorer = rouge_scorer.RougeScorer(ROUGE_TYPES, use_stemmer=True)
+        self.n = 0
+        self.sums = {t: 0.0 for t in ROUGE_TYPES}
+        self.new_tokens = 0
+        self.latencies = []
+
+    def score(self, prediction, reference):
+        scores = self.scorer.score(reference, prediction)
+        return {t: round(scores[t].fmeasure, 4) for t in ROUGE_TYPES}
+
+    def add(self, record):
+        self.n += 1
+        for t in ROUGE_TYPES:
+            self.sums[t] += record["scores"][t]
+        self.new_tokens += record.get("new_tokens") or 0
+        if record.get("latency_s") is not None:
+            self.latencies.append(record["latency_s"])
+
+    def summary(self):
+        out = {t: round(self.sums[t] / self.n, 4) if self.n else 0.0 for t in ROUGE_TYPES}
+        out["samples"] = self.n
+        if self.latencies:
+            ordered = sorted(self.latencies)
+            out["latency_p50_s"] = round(ordered[len(ordered) // 2], 3)
+            out["latency_p95_s"] = round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3)
+        return out
+
+def load_checkpoint(path, metrics):
+    """Feed previously saved predictions into the metrics; returns their ids."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue # Torn last line from a crash
+            done.add(record["id"])
+            metrics.add(record)
+    return done
+
+def load_model(model_path):
     # Login via token if provided
     hf_token = os.getenv("HF_TOKEN")
     if hf_token:
         from huggingface_hub import login
         login(token=hf_token)
         print("✅ Logged in via .env token.")
-        
-    try:
-        # Mac M-series Optimization
-        if torch.backends.mps.is_available():
-            device = "mps"
-            print("✨ Detected Mac M-series chip. Using MPS (Metal Performance Shaders) acceleration.")
-        elif torch.cuda.is_available():
-            device = "cuda"
-            print("✨ Detected NVIDIA GPU. Using CUDA.")
-        else:
-            device = "cpu"
-            print("⚠️ No GPU detected. Using CPU (this will be slow).")
-
-        tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH)
-        
-        # Load model with optimizations
-        # Note: on Mac Air 16GB, Llama-3-8B (approx 16GB in fp16) is very tight.
-        # If it crashes, user should switch to "meta-llama/Llama-3.2-3B-Instruct"
-        model = AutoModelForCausalLM.from_pretrained(
-            MODEL_PATH, 
-            device_map=None, # explicit device handling for MPS stability in some versions
-            torch_dtype=torch.float16,
-        ).to(device)
-            
-    except Exception as e:
-        print(f"Error loading model: {e}")
-        print("\n❌ CRITICAL: If you ran out of memory (OOM), try changing MODEL_PATH to 'meta-llama/Llama-3.2-3B-Instruct' or 'TinyLlama/TinyLlama-1.1B-Chat-v1.0'")
-        return
+
+    # Mac M-series Optimization
+    if torch.backends.mps.is_available():
+        device = "mps"
+        print("✨ Detected Mac M-series chip. Using MPS (Metal Performance Shaders) acceleration.")
+    elif torch.cuda.is_available():
+        device = "cuda"
+        print("✨ Detected NVIDIA GPU. Using CUDA.")
+    else:
+        device = "cpu"
+        print("⚠️ No GPU detected. Using CPU (this will be slow).")
+
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    # Left padding so every prompt in a batch ends right where generation starts
+    tokenizer.pad_token = tokenizer.pad_token or tokenizer.eos_token
+    tokenizer.padding_side = "left"
+
+    # Load model with optimizations
+    # Note: on Mac Air 16GB, Llama-3-8B (approx 16GB in fp16) is very tight.
+    # If it crashes, user should switch to "meta-llama/Llama-3.2-3B-Instruct"
+    model = AutoModelForCausalLM.from_pretrained(
+        model_path,
+        device_map=None, # explicit device handling for MPS stability in some versions
+        torch_dtype=torch.float16 if device != "cpu" else torch.float32,
+    ).to(device)
+    model.eval()
+    return model, tokenizer
+
+def build_prompts(builder, samples):
+    """Prompt of every sample, as the API builds it for a `verbatim` request."""
+    return [builder.build(context, query, CONTEXT_TOKEN_BUDGET) for _, context, query, _ in samples]
+
+def generate_offline(model, tokenizer, samples, batch_size, max_new_tokens, on_result):
+    """
+    Greedy generation in batches of similar prompt length (shortest first),
+    with the API's prompt builder and decode loop: each row stops at
+    <|eot_id|> and only its generated tokens are decoded.
+    """
+    prompts = build_prompts(PromptBuilder(tokenizer), samples)
+    order = sorted(range(len(samples)), key=lambda i: sum(len(segment) for segment in prompts[i]))
+    for start in tqdm(range(0, len(order), batch_size)):
+        rows = order[start:start + batch_size]
+        new_tokens = [0] * len(rows)
+
+        def count(i, token_id):
+            new_tokens[i] += 1
+
+        t0 = time.perf_counter()
+        answers = generate_batch(model, tokenizer, [prompts[i] for i in rows], max_new_tokens=max_new_tokens,
+                                 on_token=count)
+        seconds = time.perf_counter() - t0
+        for i, answer, n_new in zip(rows, answers, new_tokens):
+            sample_id, _, _, target = samples[i]
+            on_result(sample_id, target, answer, new_tokens=n_new, batch_seconds=round(seconds, 3))
+
+def generate_served(samples, endpoint, concurrency, max_new_tokens, on_result):
+    """Send each sample's context and query to /analyze from `concurrency` threads."""
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+
+    def call(sample):
+        sample_id, context, query, target = sample
+        t0 = time.perf_counter()
+        # Bypass the response cache so latency reflects real generation
+        resp = session.post(endpoint, json={"text": context, "query": query, "max_new_tokens": max_new_tokens,
+                                            "verbatim": True},
+                            headers={"X-Cache-Bypass": "1"}, timeout=300)
+        resp.raise_for_status()
+        return sample, resp.json()["answer"], time.perf_counter() - t0
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(call, s) for s in samples]
+        for fut in tqdm(as_completed(futures), total=len(futures)):
+            try:
+                (sample_id, _, _, target), answer, latency = fut.result()
+            except Exception as e:
+                print(f"Request failed: {e}")
+                continue
+            on_result(sample_id, target, answer, latency_s=round(latency, 3))
+
+def evaluate_model(mode="offline", model_path=MODEL_PATH, endpoint=ENDPOINT, batch_size=BATCH_SIZE,
+                   concurrency=CONCURRENCY, max_new_tokens=MAX_NEW_TOKENS, limit=None):
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    predictions_file = PREDICTIONS_FILE.format(mode=mode)
+    metrics = RunningMetrics()
+    done = load_checkpoint(predictions_file, metrics)
 
     print("Loading data...")
-    val_data = []
-    with open(VAL_FILE, "r") as f:
-        for line in f:
-            item = json.loads(line)
-            # Parse text to get Input vs Output (Target)
-            # Our text format in create_sft.py was: PROMPT + "Analysis: " + TARGET
-            parts = item["text"].split("Analysis: ")
-            if len(parts) >= 2:
-                prompt = parts[0] + "Analysis: "
-                target = parts[1]
-                val_data.append((prompt, target))
-    
-    print(f"Evaluating on {len(val_data)} samples...")
-    
-    predictions = []
-    references = []
-    
-    for prompt, target in tqdm(val_data[:20]): # Evaluating subset for speed
-        inputs = tokenizer(prompt, return_tensors="pt").to(model.device)
-        
-        with torch.no_grad():
-            outputs = model.generate(
-                **inputs, 
-                max_new_tokens=100, 
-                do_sample=False  # Deterministic (greedy decoding)
-            )
-        
-        pred_text = tokenizer.decode(outputs[0], skip_special_tokens=True)
-        # Extract the new part
-        generated_answer = pred_text.replace(prompt, "").strip()
-        
-        predictions.append(generated_answer)
-        references.append(target)
-        
-    compute_metrics(predictions, references)
+    samples = load_samples(limit)
+    todo = [s for s in samples if s[0] not in done]
+    print(f"Evaluating {len(samples)} samples: {len(done)} already in {predictions_file}, {len(todo)} to go.")
+
+    lock = threading.Lock()
+    run = {"samples": 0, "new_tokens": 0}
+    out = open(predictions_file, "a")
+
+    def on_result(sample_id, target, prediction, **extra):
+        record = {"id": sample_id, "prediction": prediction, "reference": target,
+                  "scores": metrics.score(prediction, target), **extra}
+        with lock:
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+            metrics.add(record)
+            run["samples"] += 1
+            run["new_tokens"] += extra.get("new_tokens") or 0
+
+    start = time.perf_counter()
+    try:
+        if todo and mode == "offline":
+            print(f"Loading model: {model_path}...")
+            try:
+                model, tokenizer = load_model(model_path)
+            except Exception as e:
+                print(f"Error loading model: {e}")
+                print("\n❌ CRITICAL: If you ran out of memory (OOM), try changing MODEL_PATH to 'meta-llama/Llama-3.2-3B-Instruct' or 'TinyLlama/TinyLlama-1.1B-Chat-v1.0'")
+                return
+            generate_offline(model, tokenizer, todo, batch_size, max_new_tokens, on_result)
+        elif todo:
+            generate_served(todo, endpoint, concurrency, max_new_tokens, on_result)
+    finally:
+        out.close()
+    seconds = time.perf_counter() - start
+
+    summary = metrics.summary()
+    summary["mode"] = mode
+    summary["this_run"] = {
+        "samples": run["samples"],
+        "seconds": round(seconds, 2),
+        "samples_per_s": round(run["samples"] / seconds, 3) if seconds else 0.0,
+        "new_tokens_per_s": round(run["new_tokens"] / seconds, 1) if seconds and run["new_tokens"] else None,
+    }
+    with open(SUMMARY_FILE.format(mode=mode), "w") as f:
+        json.dump(summary, f, indent=2)
+
+    print("\nResults:")
+    print(f"ROUGE-1: {summary['rouge1']:.4f}")
+    print(f"ROUGE-L: {summary['rougeL']:.4f}")
+    print(f"Throughput: {summary['this_run']['samples_per_s']} samples/s"
+          + (f", {summary['this_run']['new_tokens_per_s']} tokens/s" if summary["this_run"]["new_tokens_per_s"] else ""))
+    if "latency_p50_s" in summary:
+        print(f"Latency: p50 {summary['latency_p50_s']}s, p95 {summary['latency_p95_s']}s")
+    return summary
 
 if __name__ == "__main__":
-    evaluate_model()
+    parser = argparse.ArgumentParser(description="Evaluate the fine-tuned model on the validation split.")
+    parser.add_argument("--mode", choices=["offline", "served"], default="offline",
+                        help="offline: local batched generation; served: call a running /analyze")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--endpoint", default=ENDPOINT)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--max-new-tokens", type=int, default=MAX_NEW_TOKENS)
+    parser.add_argument("--limit", type=int, default=None, help="Only the first N samples")
+    args = parser.parse_args()
+    evaluate_model(args.mode, args.model, args.endpoint, args.batch_size, args.concurrency,
+                   args.max_new_tokens, args.limit)
@@ -1,5 +1,18 @@
 from locust import HttpUser, task, between
-import random
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from eval.bench_load import SECTIONS_FILE, PayloadSampler, load_sections
+
+# Payloads are sampled from real sections like eval/bench_load.py does (which
+# also gives tracked p50/p95/p99 numbers); this fixed one is the fallback
+# when data/processed/sections.jsonl has not been built.
+FALLBACK_PAYLOAD = {
+    "text": "The company faces significant liquidity risks due to recent market downturns and increased regulatory scrutiny in the semiconductor sector.",
+    "query": "What are the primary liquidity risks?"
+}
+sampler = PayloadSampler(load_sections(SECTIONS_FILE)) if os.path.exists(SECTIONS_FILE) else None
 
 class RiskAnalystUser(HttpUser):
     # Simulate a user thinking for 1-5 seconds between requests
@@ -12,8 +25,5 @@ class RiskAnalystUser(HttpUser):
     @task(3)
     def analyze_risk(self):
         # Weighted higher (3x) because this is the core value action
-        payload = {
-            "text": "The company faces significant liquidity risks due to recent market downturns and increased regulatory scrutiny in the semiconductor sector.",
-            "query": "What are the primary liquidity risks?"
-        }
+        payload = sampler.sample() if sampler else FALLBACK_PAYLOAD
         self.client.post("/analyze", json=payload)
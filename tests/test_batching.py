@@ -0,0 +1,153 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from app.batching import BatchScheduler, QueueFullError
+
+
+class StubModel:
+    """
+    generate_fn that records every batch. The first batch waits for
+    `release()`, later ones take `step_s`.
+    """
+
+    def __init__(self, step_s=0.0):
+        self.batches = []
+        self.gate = threading.Event()
+        self.step_s = step_s
+        self.stopped = []
+
+    def __call__(self, prompts, should_stop, on_token, group, max_new_tokens):
+        if not self.batches:
+            self.gate.wait(5)
+        else:
+            time.sleep(self.step_s)
+        self.batches.append(list(prompts))
+        self.stopped.append([should_stop(i) for i in range(len(prompts))])
+        return [f"answer:{p}" for p in prompts]
+
+    def release(self):
+        self.gate.set()
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def _started(model, **kwargs):
+    scheduler = BatchScheduler(model, max_wait_ms=20, concurrency=1, **kwargs)
+    scheduler.start()
+    # A first request occupies the only inference slot until released
+    first = scheduler.enqueue("first", 5, group="A")
+    await asyncio.sleep(0.05)
+    return scheduler, first
+
+
+def test_batches_hold_one_group_and_held_requests_go_next():
+    async def main():
+        model = StubModel()
+        scheduler, first = await _started(model, max_batch_size=8)
+        futures = [scheduler.enqueue(p, 5, group=p[0]) for p in ("A1", "B1", "A2", "B2", "A3")]
+        model.release()
+        answers = await asyncio.gather(first, *futures)
+        await scheduler.stop()
+        return model.batches, answers
+
+    batches, answers = run(main())
+    assert batches == [["first"], ["A1", "A2", "A3"], ["B1", "B2"]]
+    assert answers == ["answer:first", "answer:A1", "answer:B1", "answer:A2", "answer:B2", "answer:A3"]
+
+
+def test_batch_size_is_capped_and_order_kept():
+    async def main():
+        model = StubModel()
+        scheduler, first = await _started(model, max_batch_size=2)
+        futures = [scheduler.enqueue(f"A{i}", 5, group="A") for i in range(5)]
+        model.release()
+        await asyncio.gather(first, *futures)
+        await scheduler.stop()
+        return model.batches
+
+    assert run(main()) == [["first"], ["A0", "A1"], ["A2", "A3"], ["A4"]]
+
+
+def test_bulk_lane_waits_for_interactive_queue_to_drain():
+    async def main():
+        model = StubModel()
+        scheduler, first = await _started(model, max_batch_size=8, bulk_batch_size=8)
+        bulk = [scheduler.enqueue(f"bulk{i}", 5, group="A", bulk=True) for i in range(3)]
+        interactive = [scheduler.enqueue(f"live{i}", 5, group="A") for i in range(2)]
+        model.release()
+        await asyncio.gather(first, *bulk, *interactive)
+        await scheduler.stop()
+        return model.batches
+
+    assert run(main()) == [["first"], ["live0", "live1"], ["bulk0", "bulk1", "bulk2"]]
+
+
+def test_queue_full_raises_and_bulk_lane_is_unbounded():
+    async def main():
+        model = StubModel()
+        scheduler, first = await _started(model, max_queue_size=2)
+        scheduler.enqueue("q1", 5)
+        scheduler.enqueue("q2", 5)
+        with pytest.raises(QueueFullError):
+            scheduler.enqueue("q3", 5)
+        with pytest.raises(QueueFullError):
+            await scheduler.run(lambda: None, timeout=5)
+        for i in range(5):
+            scheduler.enqueue(f"bulk{i}", 5, bulk=True)
+        depth = scheduler.depth()
+        model.release()
+        await first
+        await scheduler.stop()
+        return depth
+
+    assert run(main()) == 2
+
+
+def test_expired_requests_are_dropped():
+    async def main():
+        model = StubModel(step_s=0.3)
+        scheduler, first = await _started(model, max_batch_size=8)
+        # Expires while still queued: never reaches the model
+        with pytest.raises(asyncio.TimeoutError):
+            await scheduler.submit("queued", 0.05)
+        # Expires mid-generation: should_stop turns True for its row only
+        keep = scheduler.enqueue("keep", 5)
+        late = asyncio.ensure_future(scheduler.submit("late", 0.15))
+        await asyncio.sleep(0)
+        model.release()
+        await first
+        assert await keep == "answer:keep"
+        with pytest.raises(asyncio.TimeoutError):
+            await late
+        await scheduler.stop()
+        return model.batches, model.stopped
+
+    batches, stopped = run(main())
+    assert batches == [["first"], ["keep", "late"]]
+    assert stopped[1] == [False, True]
+
+
+def test_run_takes_a_batch_slot_and_is_never_batched():
+    async def main():
+        model = StubModel()
+        scheduler, first = await _started(model, max_batch_size=8)
+        a = scheduler.enqueue("A1", 5, group="A")
+        call = asyncio.ensure_future(scheduler.run(lambda x: x * 2, 21, timeout=5))
+        await asyncio.sleep(0)
+        b = scheduler.enqueue("A2", 5, group="A")
+        model.release()
+        results = await asyncio.gather(first, a, call, b)
+        await scheduler.stop()
+        return model.batches, results
+
+    batches, results = run(main())
+    assert results == ["answer:first", "answer:A1", 42, "answer:A2"]
+    assert batches == [["first"], ["A1", "A2"]]
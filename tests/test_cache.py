@@ -0,0 +1,80 @@
+import asyncio
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from app.cache import LRUCache, ResponseCache, SQLiteCache, cache_key
+
+
+def test_cache_key_ignores_whitespace_but_not_params_or_model():
+    key = cache_key("Risk  factors\n include", " What? ", {"max_new_tokens": 64}, "v1")
+    assert key == cache_key("Risk factors include", "What?", {"max_new_tokens": 64}, "v1")
+    assert key != cache_key("Risk factors include", "What?", {"max_new_tokens": 32}, "v1")
+    assert key != cache_key("Risk factors include", "What?", {"max_new_tokens": 64}, "v2")
+
+
+def test_lru_entries_expire_after_ttl():
+    cache = LRUCache(max_bytes=1000, ttl_s=0.05)
+    cache.set("k", "answer")
+    assert cache.get("k") == "answer"
+    time.sleep(0.1)
+    assert cache.get("k") is None
+    assert cache.size == 0
+
+
+def test_lru_evicts_least_recently_used_to_stay_under_max_bytes():
+    # Every entry is 1 + 9 = 10 bytes, so three fit
+    cache = LRUCache(max_bytes=30, ttl_s=60)
+    for key in "abc":
+        cache.set(key, key * 9)
+    assert cache.get("a") == "a" * 9  # "b" is now the least recently used
+    cache.set("d", "d" * 9)
+    assert cache.get("b") is None
+    assert [cache.get(k) is not None for k in "acd"] == [True, True, True]
+    assert cache.size == 30
+
+    # Overwriting a key replaces its size rather than adding to it
+    cache.set("a", "a")
+    assert cache.size == 22
+
+
+def test_lru_skips_values_larger_than_the_whole_cache():
+    cache = LRUCache(max_bytes=30, ttl_s=60)
+    cache.set("a", "a" * 9)
+    cache.set("big", "x" * 100)
+    assert cache.get("big") is None
+    assert cache.get("a") == "a" * 9
+
+
+def test_sqlite_ttl_and_persistent_mode(tmp_path):
+    expiring = SQLiteCache(str(tmp_path / "cache.db"), ttl_s=0.05)
+    expiring.set("k", "answer")
+    assert expiring.get("k") == "answer"
+    time.sleep(0.1)
+    assert expiring.get("k") is None
+    expiring.close()
+
+    path = str(tmp_path / "store.db")
+    store = SQLiteCache(path, ttl_s=None)
+    store.set("k", "answer")
+    store.close()
+    reopened = SQLiteCache(path, ttl_s=None)
+    assert reopened.get("k") == "answer"
+    reopened.close()
+
+
+def test_shared_hits_are_promoted_to_the_local_tier(tmp_path):
+    async def main():
+        shared = SQLiteCache(str(tmp_path / "shared.db"), ttl_s=60)
+        shared.set("k", "answer")
+        cache = ResponseCache(LRUCache(max_bytes=1000, ttl_s=60), shared)
+        assert cache.local.get("k") is None
+        assert await cache.get("k") == "answer"
+        assert cache.local.get("k") == "answer"
+        assert await cache.get("missing") is None
+        await cache.set("new", "value")
+        assert shared.get("new") == "value"
+        cache.close()
+
+    asyncio.run(main())
@@ -0,0 +1,50 @@
+import os
+import sys
+
+import pytest
+
+torch = pytest.importorskip("torch")
+peft = pytest.importorskip("peft")
+import torch.nn as nn
+from transformers import LlamaConfig, LlamaForCausalLM
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from app.cpu_inference import Int8Linear, load_cpu_model, quantize_linears
+
+
+@pytest.fixture
+def checkpoints(tmp_path):
+    """(base, adapter) directories: a random tiny Llama and a LoRA adapter trained on it."""
+    config = LlamaConfig(vocab_size=64, hidden_size=32, intermediate_size=64, num_hidden_layers=2,
+                         num_attention_heads=4, num_key_value_heads=2)
+    torch.manual_seed(0)
+    base_dir, adapter_dir = str(tmp_path / "base"), str(tmp_path / "adapter")
+    LlamaForCausalLM(config).save_pretrained(base_dir)
+    base = LlamaForCausalLM.from_pretrained(base_dir)
+    # Random lora_B, so the adapter changes the output
+    lora = peft.LoraConfig(r=4, target_modules=["q_proj", "v_proj"], init_lora_weights=False)
+    peft.get_peft_model(base, lora).save_pretrained(adapter_dir)
+    return base_dir, adapter_dir
+
+
+def test_lora_matrices_stay_unquantized(checkpoints):
+    base_dir, adapter_dir = checkpoints
+    model = peft.PeftModel.from_pretrained(LlamaForCausalLM.from_pretrained(base_dir), adapter_dir)
+    quantize_linears(model, "int8", torch.float32)
+    modules = dict(model.named_modules())
+    lora = [m for name, m in modules.items() if ".lora_" in name and isinstance(m, (nn.Linear, Int8Linear))]
+    assert lora and all(isinstance(m, nn.Linear) for m in lora)
+    assert any(isinstance(m, Int8Linear) for name, m in modules.items() if name.endswith("q_proj.base_layer"))
+    assert isinstance(modules["base_model.model.lm_head"], nn.Linear)
+
+
+def test_adapter_path_serves_with_int8_weights(checkpoints):
+    base_dir, adapter_dir = checkpoints
+    ids = torch.tensor([[1, 5, 9, 13, 17]])
+    with torch.no_grad():
+        reference = load_cpu_model(adapter_dir, "none", torch.float32)(ids).logits
+        quantized = load_cpu_model(adapter_dir, "int8", torch.float32)(ids).logits
+        base = load_cpu_model(base_dir, "int8", torch.float32)(ids).logits
+    assert torch.allclose(quantized, reference, atol=0.05)
+    # The adapter is still applied on top of the int8 base weights
+    assert (quantized - base).abs().max() > 0.05
@@ -0,0 +1,53 @@
+import json
+import os
+import sys
+
+import pytest
+
+pq = pytest.importorskip("pyarrow.parquet")
+from tokenizers import Tokenizer, models, pre_tokenizers
+from transformers import PreTrainedTokenizerFast
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from data.preprocess import create_sft
+
+WORDS = [f"w{i}" for i in range(400)]
+RISKS = " ".join(WORDS[:300])
+NEW_RISKS = RISKS + " " + " ".join(WORDS[300:310])  # Last year's section plus a little
+
+
+@pytest.fixture(autouse=True)
+def tokenizer(monkeypatch):
+    vocab = {"<unk>": 0, "</s>": 1, **{w: i + 2 for i, w in enumerate(WORDS)}}
+    backend = Tokenizer(models.WordLevel(vocab, unk_token="<unk>"))
+    backend.pre_tokenizer = pre_tokenizers.Whitespace()
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=backend, unk_token="<unk>", eos_token="</s>")
+    monkeypatch.setattr(create_sft.AutoTokenizer, "from_pretrained", lambda *args, **kwargs: tokenizer)
+    monkeypatch.setattr(create_sft, "CONTEXT_TOKENS", 512)
+
+
+def build(tmp_path, records, **kwargs):
+    sections = tmp_path / "sections.jsonl"
+    sections.write_text("".join(json.dumps(r) + "\n" for r in records), encoding="utf-8")
+    create_sft.create_dataset(str(sections), str(tmp_path / "sft"), val_fraction=0.0, **kwargs)
+    rows = []
+    for path in sorted((tmp_path / "sft" / "train").glob("*.parquet")):
+        rows.extend(pq.read_table(path).to_pylist())
+    return [(r["ticker"], r["fiscal_year"], r["section"]) for r in rows]
+
+
+RECORDS = [
+    {"ticker": "AAPL", "fiscal_year": 2022, "accession": "a-22", "section": "Item 1A", "text": RISKS},
+    {"ticker": "AAPL", "fiscal_year": 2023, "accession": "a-23", "section": "Item 1A", "text": NEW_RISKS},
+    {"ticker": "AAPL", "fiscal_year": 2023, "accession": "a-23", "section": "Item 7", "text": RISKS},
+    {"ticker": "MSFT", "fiscal_year": 2023, "accession": "m-23", "section": "Item 1A", "text": RISKS},
+]
+
+
+def test_windows_are_all_kept_by_default(tmp_path):
+    assert len(build(tmp_path, RECORDS)) == len(RECORDS)
+
+
+def test_dedup_keeps_the_newest_filing_within_ticker_and_section(tmp_path):
+    kept = build(tmp_path, RECORDS, dedup_threshold=0.8)
+    assert sorted(kept) == [("AAPL", 2023, "Item 1A"), ("AAPL", 2023, "Item 7"), ("MSFT", 2023, "Item 1A")]
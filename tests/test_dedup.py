@@ -0,0 +1,50 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from app.dedup import MinHasher, NearDuplicateFilter, changed_passages, keep_priority, similarity
+
+BOILERPLATE = (
+    "Our business is subject to risks from changes in interest rates, foreign exchange rates, "
+    "global economic conditions, cybersecurity incidents, supply chain disruptions and the "
+    "regulatory environment in the jurisdictions where we operate, any of which could harm "
+    "our results of operations, financial condition and the trading price of our stock."
+)
+EDITED = BOILERPLATE.replace("trading price of our stock.", "trading price of our common stock.")
+OTHER = (
+    "We depend on a small number of suppliers for critical components, and a prolonged outage "
+    "at any one of them would delay shipments to customers for several quarters at least."
+)
+
+
+def test_similarity_estimates_jaccard():
+    hasher = MinHasher()
+    assert similarity(hasher.signature(BOILERPLATE), hasher.signature(BOILERPLATE)) == 1.0
+    assert similarity(hasher.signature(BOILERPLATE), hasher.signature(EDITED)) > 0.8
+    assert similarity(hasher.signature(BOILERPLATE), hasher.signature(OTHER)) < 0.2
+
+
+def test_filter_returns_the_earlier_key_within_a_scope_only():
+    dups = NearDuplicateFilter(threshold=0.8)
+    assert dups.seen(BOILERPLATE, "AAPL:2023", scope="AAPL") is None
+    assert dups.seen(EDITED, "AAPL:2022", scope="AAPL") == "AAPL:2023"
+    assert dups.seen(OTHER, "AAPL:2021", scope="AAPL") is None
+    # Another ticker's copy of the same boilerplate is not suppressed
+    assert dups.seen(BOILERPLATE, "MSFT:2023", scope="MSFT") is None
+
+
+def test_keep_priority_prefers_newest_filing_then_later_accession():
+    records = [
+        {"fiscal_year": 2022, "accession": "0001-22-000001"},
+        {"fiscal_year": 2023, "accession": "0001-23-000001"},
+        {"fiscal_year": 2023, "accession": "0001-23-000009"},  # amendment
+        {"fiscal_year": None, "accession": None},
+    ]
+    ordered = sorted(records, key=keep_priority, reverse=True)
+    assert [r["accession"] for r in ordered] == ["0001-23-000009", "0001-23-000001", "0001-22-000001", None]
+
+
+def test_changed_passages_ignores_near_duplicate_edits():
+    added, removed = changed_passages([BOILERPLATE], [EDITED, OTHER])
+    assert added == [OTHER]
+    assert removed == []
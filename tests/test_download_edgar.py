@@ -0,0 +1,114 @@
+import os
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from data.ingest import download_edgar
+from data.ingest.fake_edgar import FakeEdgar, make_handler
+
+TICKERS = ["AAPL", "MSFT", "JPM"]
+FORMS = ["10-K", "10-Q"]
+LIMIT = 2
+
+
+@pytest.fixture
+def edgar():
+    fake = FakeEdgar(TICKERS, filings_per_form=LIMIT, error_rate=0.0, latency_s=0.0, doc_kb=4)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(fake))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    fake.url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield fake
+    server.shutdown()
+    server.server_close()
+
+
+def run(edgar, data_dir):
+    return download_edgar.download_filings(
+        TICKERS, FORMS, LIMIT, workers=8, data_dir=str(data_dir),
+        state_file=str(data_dir / "ingest_state.jsonl"), www_url=edgar.url, data_url=edgar.url,
+    )
+
+
+def archive_gets(edgar):
+    return edgar.stats["by_path"].get("Archives", 0)
+
+
+def test_token_bucket_stays_under_sec_limit():
+    bucket = download_edgar.TokenBucket(download_edgar.REQUESTS_PER_SECOND, download_edgar.BURST)
+    sent, lock = [], threading.Lock()
+
+    def worker():
+        for _ in range(5):
+            bucket.acquire()
+            with lock:
+                sent.append(time.monotonic())
+
+    threads = [threading.Thread(target=worker) for _ in range(download_edgar.WORKERS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    sent.sort()
+    busiest = max(sum(1 for t in sent if start <= t < start + 1.0) for start in sent)
+    assert busiest <= download_edgar.SEC_MAX_REQUESTS_PER_SECOND
+    # Not slower than needed either: 40 requests at 8/s with a burst of 1
+    elapsed = sent[-1] - sent[0]
+    expected = (len(sent) - download_edgar.BURST) / download_edgar.REQUESTS_PER_SECOND
+    assert expected * 0.9 <= elapsed <= expected * 1.5
+
+
+def test_download_respects_rate_limit(edgar, tmp_path):
+    assert run(edgar, tmp_path) == set()
+    assert archive_gets(edgar) == len(TICKERS) * len(FORMS) * LIMIT
+    assert edgar.stats["max_requests_per_second"] <= download_edgar.SEC_MAX_REQUESTS_PER_SECOND
+
+
+def test_interrupted_run_resumes_without_redownloading(edgar, tmp_path):
+    total = len(TICKERS) * len(FORMS) * LIMIT
+    run(edgar, tmp_path)
+    assert archive_gets(edgar) == total
+
+    # As if the first run had been killed after 5 downloads (plus a torn line)
+    state_file = tmp_path / "ingest_state.jsonl"
+    lines = state_file.read_text(encoding="utf-8").splitlines(keepends=True)
+    state_file.write_text("".join(lines[:5]) + lines[5][:20], encoding="utf-8")
+
+    before = archive_gets(edgar)
+    assert run(edgar, tmp_path) == set()
+    assert archive_gets(edgar) - before == total - 5
+
+    before = archive_gets(edgar)
+    run(edgar, tmp_path)
+    assert archive_gets(edgar) == before
+    assert len(download_edgar.load_state(str(state_file))) == total
+
+
+def test_state_file_defaults_to_data_dir(edgar, tmp_path):
+    download_edgar.download_filings(TICKERS, FORMS, LIMIT, data_dir=str(tmp_path),
+                                    www_url=edgar.url, data_url=edgar.url)
+    state = download_edgar.load_state(str(tmp_path / "ingest_state.jsonl"))
+    assert len(state) == len(TICKERS) * len(FORMS) * LIMIT
+
+
+def test_timeouts_are_retried(monkeypatch):
+    client = download_edgar.EdgarClient(download_edgar.TokenBucket(1000, 1))
+    calls = []
+
+    def get(url, timeout, stream):
+        calls.append(url)
+        if len(calls) < 3:
+            raise download_edgar.requests.Timeout("read timed out")
+        resp = download_edgar.requests.Response()
+        resp.status_code = 200
+        return resp
+
+    monkeypatch.setattr(client.session, "get", get)
+    monkeypatch.setattr(download_edgar.time, "sleep", lambda s: None)
+    assert client.get("http://edgar.test/x").status_code == 200
+    assert len(calls) == 3
@@ -0,0 +1,49 @@
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("datasets")
+from tokenizers import Tokenizer, models, pre_tokenizers
+from transformers import PreTrainedTokenizerFast
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import app.main as main
+from app.prompts import PromptBuilder
+from eval import eval_qa
+
+WORDS = "the company faces risk from rates credit cyber supply liquidity what are primary factors".split()
+
+
+@pytest.fixture
+def tokenizer(monkeypatch):
+    vocab = {"<unk>": 0, "</s>": 1, **{w: i + 2 for i, w in enumerate(WORDS)}}
+    backend = Tokenizer(models.WordLevel(vocab, unk_token="<unk>"))
+    backend.pre_tokenizer = pre_tokenizers.Whitespace()
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=backend, unk_token="<unk>", eos_token="</s>")
+    monkeypatch.setattr(main, "tokenizer", tokenizer)
+    monkeypatch.setattr(main, "prompts", PromptBuilder(tokenizer))
+    return tokenizer
+
+
+def served_prompt(context, query):
+    request = main.AnalysisRequest(text=context, query=query, verbatim=True)
+    context, citations = main.retrieve_context(request)
+    assert citations == []
+    return main.build_prompt(context, query)
+
+
+def test_served_prompt_is_the_offline_prompt(tokenizer):
+    query = "what are the primary risk factors"
+    samples = [
+        ("short", "the company faces credit risk", query, ""),
+        # A window a little over the budget: retrieval would re-chunk it
+        ("long", " ".join(WORDS[i % len(WORDS)] for i in range(eval_qa.CONTEXT_TOKEN_BUDGET + 40)), query, ""),
+    ]
+    offline = eval_qa.build_prompts(PromptBuilder(tokenizer), samples)
+    assert [served_prompt(context, query) for _, context, query, _ in samples] == offline
+
+    # Without `verbatim` the long window goes through retrieval instead
+    retrieved, citations = main.retrieve_context(main.AnalysisRequest(text=samples[1][1], query=query))
+    assert citations and main.build_prompt(retrieved, query) != offline[1]
@@ -0,0 +1,83 @@
+import asyncio
+import json
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from app.jobs import JobRunner, JobStore
+
+
+def test_items_running_at_shutdown_go_back_to_pending(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    store = JobStore(path)
+    job_id = store.create([{"text": "a"}, {"text": "b"}, {"text": "c"}])
+    assert [idx for _, idx, _ in store.claim(2)] == [0, 1]
+    store.finish(job_id, 0, {"answer": "A"})
+    store.close()
+
+    store = JobStore(path)
+    assert [idx for _, idx, _ in store.claim(10)] == [1, 2]
+    assert store.get(job_id)["done"] == 1
+    store.close()
+
+
+def test_job_finishes_with_results_in_completion_order(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    job_id = store.create([{"text": "a"}, {"text": "b"}])
+    store.claim(2)
+    store.finish(job_id, 1, {"index": 1, "answer": "B"})
+    assert store.get(job_id)["status"] == "running"
+    store.finish(job_id, 0, {"index": 0, "error": "boom"})
+    job = store.get(job_id)
+    assert (job["status"], job["done"], job["failed"]) == ("done", 1, 1)
+    lines = [json.loads(line) for _, line in store.results(job_id)]
+    assert [(r["index"], r.get("answer"), r.get("error")) for r in lines] == [(1, "B", None), (0, None, "boom")]
+    (first_id, _), _ = store.results(job_id)
+    assert len(store.results(job_id, after=first_id)) == 1
+    store.close()
+
+
+def test_cancel_drops_unfinished_items(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    job_id = store.create([{"text": "a"}, {"text": "b"}])
+    store.claim(1)
+    assert store.cancel(job_id)
+    store.finish(job_id, 0, {"answer": "late"})  # Ignored: cancelled meanwhile
+    assert store.get(job_id)["status"] == "cancelled"
+    assert store.results(job_id) == []
+    assert store.claim(10) == []
+    assert not store.cancel("no-such-job")
+    store.close()
+
+
+def test_runner_processes_every_item_within_max_inflight(tmp_path):
+    async def main():
+        store = JobStore(str(tmp_path / "jobs.db"))
+        inflight, peak = 0, 0
+
+        async def process(request):
+            nonlocal inflight, peak
+            inflight += 1
+            peak = max(peak, inflight)
+            await asyncio.sleep(0.01)
+            inflight -= 1
+            if request["text"] == "bad":
+                raise ValueError("bad item")
+            return {"answer": request["text"].upper()}
+
+        runner = JobRunner(store, process, max_inflight=3, poll_s=0.05)
+        runner.start()
+        job_id = store.create([{"text": t} for t in ("a", "bb", "bad", "c", "dddd")])
+        runner.notify()
+        for _ in range(100):
+            if store.get(job_id)["status"] == "done":
+                break
+            await asyncio.sleep(0.02)
+        await runner.stop()
+        job = store.get(job_id)
+        store.close()
+        return job, peak
+
+    job, peak = asyncio.run(main())
+    assert (job["status"], job["done"], job["failed"]) == ("done", 4, 1)
+    assert peak <= 3
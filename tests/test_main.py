@@ -0,0 +1,21 @@
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import app.main as main
+
+
+def test_checkpoint_version_changes_when_weights_are_rewritten(tmp_path):
+    weights = tmp_path / "model.safetensors"
+    weights.write_bytes(b"old weights")
+    before = main._checkpoint_version(str(tmp_path))
+    assert before.startswith(f"{tmp_path}@")
+    assert main._checkpoint_version(str(tmp_path)) == before
+
+    weights.write_bytes(b"retrained weights")
+    assert main._checkpoint_version(str(tmp_path)) != before
+    assert main._checkpoint_version("meta-llama/Meta-Llama-3-8B-Instruct") == "meta-llama/Meta-Llama-3-8B-Instruct"
@@ -0,0 +1,66 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from data.preprocess import parse_10k
+
+FILLER = "<p>Liquidity and interest rate risk &amp; counterparty exposure.</p>\n" * 40
+FILING = (
+    "<SEC-DOCUMENT>0001.txt\n<SEC-HEADER>\nCONFORMED PERIOD OF REPORT: 20231231\n</SEC-HEADER>\n"
+    "<DOCUMENT>\n<TYPE>10-K\n<TEXT>\n<html><body>\n"
+    "<p>Item 1A. Risk Factors and other things</p>\n"
+    f"{FILLER}<script>var hidden = 1;</script><!-- comment -->"
+    "<p>Item 1B. Unresolved Staff Comments</p>\n"
+    "<p>Item 7. Management's Discussion and Analysis</p>\n"
+    f"{FILLER}<p>Item 7A. Quantitative and Qualitative Disclosures</p>\n"
+    "</body></html>\n</TEXT>\n</DOCUMENT>\n"
+    "<DOCUMENT>\n<TYPE>EX-21\n<TEXT>\n<p>Subsidiaries</p>\n</TEXT>\n</DOCUMENT>\n</SEC-DOCUMENT>\n"
+)
+
+
+@pytest.fixture
+def filing(tmp_path):
+    path = tmp_path / "full-submission.txt"
+    path.write_text(FILING, encoding="utf-8")
+    return str(path)
+
+
+def test_text_does_not_depend_on_block_size(filing, monkeypatch):
+    reference = parse_10k.extract_text(filing)
+    assert "Risk Factors and other things" in reference
+    assert "hidden" not in reference and "Subsidiaries" not in reference
+    for block in (1, 2, 7, 64, 1000):
+        monkeypatch.setattr(parse_10k, "READ_BLOCK", block)
+        assert parse_10k.extract_text(filing) == reference, f"READ_BLOCK={block}"
+
+
+def test_sections_do_not_depend_on_block_size(filing, monkeypatch):
+    reference = parse_10k.parse_filing(filing)
+    assert [s["section"] for s in reference] == ["Item 1A", "Item 7"]
+    for block in (1, 5, 128):
+        monkeypatch.setattr(parse_10k, "READ_BLOCK", block)
+        assert parse_10k.parse_filing(filing) == reference, f"READ_BLOCK={block}"
+
+
+def test_matches_soup_parser(filing):
+    soup = {s["section"]: s["text"] for s in parse_10k.parse_filing_soup(filing)}
+    stream = {s["section"]: s["text"] for s in parse_10k.parse_filing(filing, ["Item 1A", "Item 7"])}
+    assert stream == soup
+
+
+def test_risk_factors_end_at_next_present_item_when_1b_is_missing(tmp_path):
+    path = tmp_path / "full-submission.txt"
+    path.write_text(
+        FILING.replace("<p>Item 1B. Unresolved Staff Comments</p>\n",
+                       "<p>Item 1C. Cybersecurity</p>\n<p>We run a security program.</p>\n"),
+        encoding="utf-8",
+    )
+    sections = {s["section"]: s["text"] for s in parse_10k.parse_filing(str(path), ["Item 1A", "Item 7"])}
+    assert sections["Item 1A"].startswith("and other things Liquidity")
+    assert sections["Item 1A"].endswith("counterparty exposure.")
+    assert "security program" not in sections["Item 1A"]
+    assert "Item 7" in sections
+    # The BeautifulSoup reference needs Item 1B and drops the section
+    assert [s["section"] for s in parse_10k.parse_filing_soup(str(path))] == ["Item 7"]
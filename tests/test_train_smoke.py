@@ -0,0 +1,73 @@
+import json
+import os
+import sys
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("peft")
+pq = pytest.importorskip("pyarrow.parquet")
+pa = pytest.importorskip("pyarrow")
+from tokenizers import Tokenizer, models, pre_tokenizers
+from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "train"))
+import train as train_script  # train/train.py, not the train/ directory
+from pretokenize import SFT_DIR
+from app.prompts import PromptBuilder
+
+WORDS = "the company faces risk from rates credit cyber supply liquidity what are primary factors based on text".split()
+
+
+def tiny_model(path):
+    """Random two-layer Llama with a word-level tokenizer that has no Llama 3 special tokens."""
+    vocab = {"<unk>": 0, "<s>": 1, "</s>": 2}
+    vocab.update({w: i + 3 for i, w in enumerate(WORDS)})
+    backend = Tokenizer(models.WordLevel(vocab, unk_token="<unk>"))
+    backend.pre_tokenizer = pre_tokenizers.Whitespace()
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=backend, unk_token="<unk>", bos_token="<s>", eos_token="</s>")
+    tokenizer.save_pretrained(path)
+    config = LlamaConfig(vocab_size=len(vocab), hidden_size=32, intermediate_size=64, num_hidden_layers=2,
+                         num_attention_heads=4, num_key_value_heads=2, max_position_embeddings=2048,
+                         bos_token_id=1, eos_token_id=2)
+    torch.manual_seed(0)
+    LlamaForCausalLM(config).save_pretrained(path)
+    return tokenizer
+
+
+def write_shards(sft_dir):
+    for split, n in (("train", 12), ("val", 3)):
+        rows = [{
+            "context": " ".join(WORDS[(i + j) % len(WORDS)] for j in range(5 + 7 * i)),
+            "query": "what are the primary risk factors",
+            "target": "credit risk and liquidity risk",
+        } for i in range(n)]
+        os.makedirs(os.path.join(sft_dir, split), exist_ok=True)
+        pq.write_table(pa.Table.from_pylist(rows), os.path.join(sft_dir, split, "part-0.parquet"))
+
+
+def test_prompt_builder_falls_back_to_eos_without_eot(tmp_path):
+    tokenizer = tiny_model(str(tmp_path / "tiny"))
+    builder = PromptBuilder(tokenizer)
+    assert builder.eot_id == tokenizer.eos_token_id
+    ids, n_prompt = builder.training_ids("credit risk", "what are the risk factors", "liquidity")
+    assert ids[-1] == tokenizer.eos_token_id and n_prompt < len(ids)
+
+
+@pytest.mark.parametrize("batching", ["packed", "grouped"])
+def test_pretokenize_pack_and_one_training_step(tmp_path, monkeypatch, batching):
+    model_dir = str(tmp_path / "tiny")
+    tiny_model(model_dir)
+    monkeypatch.chdir(tmp_path)
+    write_shards(SFT_DIR)
+
+    train_script.train(model_dir, batching, batch_size=2, max_steps=1)
+
+    with open(train_script.REPORT_FILE) as f:
+        report = json.load(f)
+    assert report["training"]["steps"] == 1
+    assert report["training"]["real_tokens"] > 0
+    assert report["padding"]["examples"] == 12
+    assert os.path.exists(os.path.join(train_script.NEW_MODEL_NAME, "adapter_config.json"))
@@ -0,0 +1,78 @@
+import os
+import json
+import time
+import argparse
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+from peft import PeftModel
+
+# Folds the LoRA adapter written by train.py into the base weights and saves
+# the result as a plain safetensors checkpoint. The API loads this directly
+# (MERGED_MODEL_PATH): the weights are memory-mapped and materialized on the
+# target device, with no base model download and no adapter to apply, which
+# takes most of the time out of a cold start.
+BASE_MODEL = "meta-llama/Meta-Llama-3-8B-Instruct"
+ADAPTER_PATH = "./llama-3-8b-financial-risk" # train.py's NEW_MODEL_NAME
+OUTPUT_PATH = "./llama-3-8b-financial-risk-merged"
+DTYPE = "float16" # Serving dtype (app/main.py loads float16)
+# Large enough that the export is one file: one mmap and no index lookups at load time
+MAX_SHARD_SIZE = "100GB"
+
+def export_merged(base_model=BASE_MODEL, adapter_path=ADAPTER_PATH, output_path=OUTPUT_PATH, dtype=DTYPE):
+    started = time.perf_counter()
+    torch_dtype = getattr(torch, dtype)
+    # Merge on CPU: the merged model is only written out, never run here
+    base = AutoModelForCausalLM.from_pretrained(
+        base_model,
+        torch_dtype=torch_dtype,
+        low_cpu_mem_usage=True,
+        token=os.getenv("HF_TOKEN"),
+    )
+    model = PeftModel.from_pretrained(base, adapter_path).merge_and_unload()
+    model.eval()
+
+    os.makedirs(output_path, exist_ok=True)
+    model.save_pretrained(output_path, safe_serialization=True, max_shard_size=MAX_SHARD_SIZE)
+    tokenizer = AutoTokenizer.from_pretrained(base_model, token=os.getenv("HF_TOKEN"))
+    tokenizer.save_pretrained(output_path)
+
+    meta = {
+        "base_model": base_model,
+        "adapter": os.path.abspath(adapter_path),
+        "dtype": dtype,
+        "seconds": round(time.perf_counter() - started, 1),
+    }
+    with open(os.path.join(output_path, "export_meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    print(f"✅ Merged {adapter_path} into {base_model}; saved to {output_path} in {meta['seconds']}s")
+    return model, tokenizer
+
+def verify(tokenizer, base_model, adapter_path, output_path, dtype):
+    """Logits of the reloaded export vs. base + adapter on a sample prompt."""
+    inputs = tokenizer("Item 1A. Risk Factors. Our business depends on", return_tensors="pt")
+    torch_dtype = getattr(torch, dtype)
+    with torch.no_grad():
+        reloaded = AutoModelForCausalLM.from_pretrained(output_path, torch_dtype=torch_dtype, low_cpu_mem_usage=True)
+        merged_logits = reloaded(**inputs).logits.float()
+        del reloaded
+        base = AutoModelForCausalLM.from_pretrained(base_model, torch_dtype=torch_dtype, low_cpu_mem_usage=True,
+                                                    token=os.getenv("HF_TOKEN"))
+        adapted_logits = PeftModel.from_pretrained(base, adapter_path)(**inputs).logits.float()
+    diff = (merged_logits - adapted_logits).abs().max().item()
+    same = bool((merged_logits.argmax(-1) == adapted_logits.argmax(-1)).all())
+    print(f"{'✅' if same else '❌'} Max logit difference {diff:.4g}; greedy tokens {'match' if same else 'differ'}.")
+    return same
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge the LoRA adapter into the base model for fast serving.")
+    parser.add_argument("--base-model", default=BASE_MODEL)
+    parser.add_argument("--adapter", default=ADAPTER_PATH)
+    parser.add_argument("--output", default=OUTPUT_PATH)
+    parser.add_argument("--dtype", default=DTYPE, choices=["float16", "bfloat16", "float32"])
+    parser.add_argument("--verify", action="store_true", help="Check the export against base + adapter")
+    args = parser.parse_args()
+    model, tokenizer = export_merged(args.base_model, args.adapter, args.output, args.dtype)
+    if args.verify:
+        del model
+        if not verify(tokenizer, args.base_model, args.adapter, args.output, args.dtype):
+            raise SystemExit(1)
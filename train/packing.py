@@ -0,0 +1,190 @@
+import time
+import bisect
+import random
+import numpy as np
+import torch
+from transformers import TrainerCallback
+
+# Batching over the token cache from pretokenize.py.
+#
+# "packed":  examples are bin-packed (best-fit decreasing) into rows of up to
+#            max_seq_length tokens. Each example keeps its own positions and a
+#            block-diagonal causal mask, so it never attends across the
+#            boundary to its neighbour and loss never crosses it either.
+# "grouped": one example per row, batched with examples of similar length so
+#            padding to the longest row in the batch stays small.
+#
+# In both modes the batches are formed here, up front, and every dataset
+# item is a whole batch (the Trainer runs with per_device_train_batch_size=1
+# and the collator unwraps it). Shuffling then reorders batches without
+# undoing the length grouping.
+PAD_TO_MULTIPLE_OF = 8
+MEGABATCH_FACTOR = 50 # Batches drawn together and sorted by length in "grouped" mode
+
+def pack_examples(lengths, max_len):
+    """Best-fit decreasing bin packing; returns rows as lists of example indices."""
+    order = sorted(range(len(lengths)), key=lambda i: -int(lengths[i]))
+    rows = []
+    free = [] # sorted (space left, row id)
+    for i in order:
+        n = min(int(lengths[i]), max_len)
+        pos = bisect.bisect_left(free, (n, -1))
+        if pos == len(free):
+            rows.append([i])
+            bisect.insort(free, (max_len - n, len(rows) - 1))
+        else:
+            space, row = free.pop(pos)
+            rows[row].append(i)
+            bisect.insort(free, (space - n, row))
+    for row in rows:
+        row.sort() # Keep corpus order within a row
+    return rows
+
+def make_batches(rows, row_lengths, batch_size, seed=42):
+    """
+    Shuffle rows deterministically, then sort each megabatch by length and
+    cut it into batches (like HF's LengthGroupedSampler).
+    """
+    order = list(range(len(rows)))
+    random.Random(seed).shuffle(order)
+    batches = []
+    step = batch_size * MEGABATCH_FACTOR
+    for start in range(0, len(order), step):
+        mega = sorted(order[start:start + step], key=lambda r: -row_lengths[r])
+        batches.extend([rows[r] for r in mega[i:i + batch_size]] for i in range(0, len(mega), batch_size))
+    return batches
+
+def build_batches(cache, mode, batch_size, max_len, seed=42):
+    if mode == "packed":
+        rows = pack_examples(cache.lengths, max_len)
+    elif mode == "grouped":
+        rows = [[i] for i in range(len(cache))]
+    else:
+        raise ValueError(f"Unknown batching mode: {mode}")
+    row_lengths = [min(int(sum(cache.lengths[i] for i in row)), max_len) for row in rows]
+    return make_batches(rows, row_lengths, batch_size, seed)
+
+def _padded_len(n):
+    return -(-n // PAD_TO_MULTIPLE_OF) * PAD_TO_MULTIPLE_OF
+
+def padding_ratio(batch_row_lengths, pad_to=None):
+    """Share of the tokens fed to the model that are padding."""
+    real = padded = 0
+    for lengths in batch_row_lengths:
+        width = pad_to or _padded_len(max(lengths))
+        real += sum(lengths)
+        padded += width * len(lengths)
+    return 1 - real / padded if padded else 0.0
+
+def padding_report(cache, batches, batch_size, max_len, seed=42):
+    """Padding ratio of the chosen batches vs. the unpacked, unsorted baselines."""
+    lengths = [min(int(n), max_len) for n in cache.lengths]
+    shuffled = list(range(len(lengths)))
+    random.Random(seed).shuffle(shuffled)
+    random_batches = [[lengths[i] for i in shuffled[j:j + batch_size]] for j in range(0, len(shuffled), batch_size)]
+    chosen = [[min(sum(lengths[i] for i in row), max_len) for row in batch] for batch in batches]
+    return {
+        "pad_to_max_length": padding_ratio(random_batches, pad_to=max_len),
+        "pad_to_longest_random": padding_ratio(random_batches),
+        "chosen": padding_ratio(chosen),
+        "examples": len(lengths),
+        "rows": sum(len(b) for b in batches),
+        "batches": len(batches),
+    }
+
+class BatchDataset(torch.utils.data.Dataset):
+    """Each item is one batch: a list of rows, each a list of token id arrays."""
+
+    def __init__(self, cache, batches):
+        self.cache = cache
+        self.batches = batches
+
+    def __len__(self):
+        return len(self.batches)
+
+    def __getitem__(self, i):
+        return [[self.cache[j] for j in row] for row in self.batches[i]]
+
+class BoundaryCollator:
+    """
+    Turns one pre-formed batch into model inputs.
+
+    Rows holding several examples get position ids that restart at each
+    example and a 4D block-diagonal causal mask (0 = attend, dtype min =
+    blocked), which eager and SDPA attention both accept. The first token of
+    every example is excluded from the loss so nothing is learned across a
+    boundary. Real and padded token counts are kept for throughput stats.
+    """
+
+    def __init__(self, pad_token_id, max_len, dtype=torch.float32):
+        self.pad_token_id = pad_token_id
+        self.max_len = max_len
+        self.dtype = dtype
+        self.real_tokens = 0
+        self.total_tokens = 0
+
+    def __call__(self, features):
+        (batch,) = features
+        rows = []
+        for row in batch:
+            ids, positions, segments = [], [], []
+            used = 0
+            for n, seq in enumerate(row):
+                seq = np.asarray(seq[:self.max_len - used], dtype=np.int64)
+                used += len(seq)
+                ids.append(seq)
+                positions.append(np.arange(len(seq)))
+                segments.append(np.full(len(seq), n + 1))
+            rows.append((np.concatenate(ids), np.concatenate(positions), np.concatenate(segments)))
+
+        width = _padded_len(max(len(r[0]) for r in rows))
+        input_ids = torch.full((len(rows), width), self.pad_token_id, dtype=torch.long)
+        labels = torch.full((len(rows), width), -100, dtype=torch.long)
+        position_ids = torch.zeros((len(rows), width), dtype=torch.long)
+        segment_ids = torch.zeros((len(rows), width), dtype=torch.long)
+        for r, (ids, positions, segments) in enumerate(rows):
+            n = len(ids)
+            input_ids[r, :n] = torch.from_numpy(ids)
+            labels[r, :n] = torch.from_numpy(ids)
+            labels[r, :n][torch.from_numpy(positions == 0)] = -100
+            position_ids[r, :n] = torch.from_numpy(positions)
+            segment_ids[r, :n] = torch.from_numpy(segments)
+        self.real_tokens += int((segment_ids > 0).sum())
+        self.total_tokens += input_ids.numel()
+
+        if max(len(row) for row in batch) == 1:
+            return {"input_ids": input_ids, "labels": labels, "attention_mask": (segment_ids > 0).long()}
+
+        causal = torch.tril(torch.ones(width, width, dtype=torch.bool))
+        same = segment_ids[:, :, None] == segment_ids[:, None, :]
+        allowed = same & causal & (segment_ids[:, :, None] > 0)
+        allowed |= torch.eye(width, dtype=torch.bool) # Padding attends to itself, so no row is fully masked
+        mask = torch.zeros(allowed.shape, dtype=self.dtype).masked_fill_(~allowed, torch.finfo(self.dtype).min)
+        return {"input_ids": input_ids, "labels": labels, "position_ids": position_ids, "attention_mask": mask[:, None]}
+
+class ThroughputCallback(TrainerCallback):
+    """Prints effective (non-padding) tokens/s and the padding ratio seen in training."""
+
+    def __init__(self, collator):
+        self.collator = collator
+        self.start = None
+        self.stats = {}
+
+    def on_train_begin(self, args, state, control, **kwargs):
+        self.start = time.perf_counter()
+        self.real0, self.total0 = self.collator.real_tokens, self.collator.total_tokens
+
+    def on_train_end(self, args, state, control, **kwargs):
+        seconds = time.perf_counter() - self.start
+        real = self.collator.real_tokens - self.real0
+        total = self.collator.total_tokens - self.total0
+        self.stats = {
+            "seconds": round(seconds, 2),
+            "steps": state.global_step,
+            "real_tokens": real,
+            "padded_tokens": total - real,
+            "effective_tokens_per_s": round(real / seconds, 1) if seconds else 0.0,
+            "padding_ratio": round(1 - real / total, 4) if total else 0.0,
+        }
+        print(f"Training throughput: {self.stats['effective_tokens_per_s']} effective tokens/s, "
+              f"padding ratio {self.stats['padding_ratio']:.1%} over {state.global_step} steps.")
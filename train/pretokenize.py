@@ -0,0 +1,136 @@
+import os
+import sys
+import glob
+import json
+import hashlib
+import argparse
+import numpy as np
+import pyarrow.parquet as pq
+from transformers import AutoTokenizer
+from tqdm import tqdm
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.prompts import TEMPLATE_ID, PromptBuilder
+
+# Offline tokenization of the SFT shards written by create_sft.py. Examples
+# are built by app/prompts.py, so training sees exactly the token ids the API
+# sends the model, ending with <|eot_id|> where serving stops. Token ids go
+# to a flat uint32 file per split that training memory-maps, under a
+# directory named after a hash of the tokenizer and prompt template, so a
+# different tokenizer or template never reuses stale ids:
+#
+#   data/processed/tokenized/{tokenizer hash}/{split}/tokens.bin    uint32, all examples back to back
+#                                                  /offsets.npy   int64 [n + 1]
+#                                                  /meta.json     source shards, counts
+MODEL_NAME = "meta-llama/Meta-Llama-3-8B-Instruct"
+SFT_DIR = "data/processed/sft"
+CACHE_DIR = "data/processed/tokenized"
+SPLITS = ("train", "val")
+MAX_SEQ_LENGTH = 1024 # Longer examples are truncated (create_sft.py windows keep them under it)
+BATCH_ROWS = 1024
+EXAMPLE_COLUMNS = ["context", "query", "target"]
+
+def tokenizer_fingerprint(tokenizer):
+    """Short hash of everything that decides the token ids."""
+    h = hashlib.sha256()
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    if backend is not None:
+        h.update(backend.to_str().encode("utf-8"))
+    else:
+        h.update(json.dumps(tokenizer.get_vocab(), sort_keys=True).encode("utf-8"))
+    h.update(json.dumps([tokenizer.eos_token_id, tokenizer.bos_token_id, MAX_SEQ_LENGTH, TEMPLATE_ID]).encode("utf-8"))
+    return h.hexdigest()[:16]
+
+def _sources(shard_dir):
+    paths = sorted(glob.glob(os.path.join(shard_dir, "*.parquet")))
+    return [{"path": p, "size": os.path.getsize(p), "mtime": os.path.getmtime(p)} for p in paths]
+
+def cache_path(tokenizer, cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, tokenizer_fingerprint(tokenizer))
+
+def is_fresh(split_dir, sources):
+    meta_path = os.path.join(split_dir, "meta.json")
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path) as f:
+        return json.load(f)["sources"] == sources
+
+def tokenize_split(shard_dir, split_dir, tokenizer, max_seq_length=MAX_SEQ_LENGTH):
+    """
+    Stream every shard's examples through the prompt builder and append the
+    ids to tokens.bin. Only the offsets are held in memory.
+    """
+    builder = PromptBuilder(tokenizer)
+    sources = _sources(shard_dir)
+    os.makedirs(split_dir, exist_ok=True)
+    offsets = [0]
+    truncated = 0
+    tmp = os.path.join(split_dir, "tokens.bin.tmp")
+    with open(tmp, "wb") as out:
+        for source in tqdm(sources, desc=os.path.basename(split_dir)):
+            for batch in pq.ParquetFile(source["path"]).iter_batches(batch_size=BATCH_ROWS, columns=EXAMPLE_COLUMNS):
+                for row in batch.to_pylist():
+                    ids, _ = builder.training_ids(row["context"], row["query"], row["target"])
+                    if len(ids) > max_seq_length:
+                        ids = ids[:max_seq_length - 1] + [builder.eot_id]
+                    truncated += len(ids) == max_seq_length
+                    out.write(np.asarray(ids, dtype=np.uint32).tobytes())
+                    offsets.append(offsets[-1] + len(ids))
+    os.replace(tmp, os.path.join(split_dir, "tokens.bin"))
+    np.save(os.path.join(split_dir, "offsets.npy"), np.asarray(offsets, dtype=np.int64))
+    meta = {
+        "tokenizer": getattr(tokenizer, "name_or_path", None),
+        "examples": len(offsets) - 1,
+        "tokens": offsets[-1],
+        "at_max_length": truncated,
+        "max_seq_length": max_seq_length,
+        "sources": sources,
+    }
+    with open(os.path.join(split_dir, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=1)
+    return meta
+
+def pretokenize(tokenizer, sft_dir=SFT_DIR, cache_dir=CACHE_DIR, force=False):
+    """Tokenize every split whose shards changed; returns the cache directory."""
+    root = cache_path(tokenizer, cache_dir)
+    for split in SPLITS:
+        shard_dir = os.path.join(sft_dir, split)
+        split_dir = os.path.join(root, split)
+        if not force and is_fresh(split_dir, _sources(shard_dir)):
+            print(f"Token cache for {split} is up to date ({split_dir}).")
+            continue
+        meta = tokenize_split(shard_dir, split_dir, tokenizer)
+        print(f"Tokenized {meta['examples']} {split} examples ({meta['tokens']} tokens) into {split_dir}")
+    return root
+
+class TokenCache:
+    """
+    Memory-mapped view of one tokenized split; `cache[i]` is a uint32 array
+    of ids. An empty split (e.g. no ticker hashed into val) has a zero-byte
+    tokens.bin, which cannot be memory-mapped, and gets an empty array.
+    """
+
+    def __init__(self, split_dir):
+        self.offsets = np.load(os.path.join(split_dir, "offsets.npy"))
+        tokens_path = os.path.join(split_dir, "tokens.bin")
+        if os.path.getsize(tokens_path):
+            self.tokens = np.memmap(tokens_path, dtype=np.uint32, mode="r")
+        else:
+            self.tokens = np.zeros(0, np.uint32)
+        self.lengths = np.diff(self.offsets)
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def __getitem__(self, i):
+        return self.tokens[self.offsets[i]:self.offsets[i + 1]]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tokenize the SFT shards into a memory-mapped cache.")
+    parser.add_argument("--model", default=MODEL_NAME, help="Tokenizer to use (must match training)")
+    parser.add_argument("--sft-dir", default=SFT_DIR)
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--force", action="store_true", help="Retokenize even if the cache is up to date")
+    args = parser.parse_args()
+    tokenizer = AutoTokenizer.from_pretrained(args.model, token=os.getenv("HF_TOKEN"))
+    pretokenize(tokenizer, args.sft_dir, args.cache_dir, args.force)
@@ -1,16 +1,18 @@
 import os
+import json
+import argparse
 import torch
-from datasets import load_dataset
 from transformers import (
     AutoModelForCausalLM,
     AutoTokenizer,
     BitsAndBytesConfig,
+    Trainer,
     TrainingArguments,
-    pipeline,
-    logging,
 )
-from peft import LoraConfig, PeftModel
-from trl import SFTTrainer, SFTConfig
+from peft import LoraConfig, get_peft_model, prepare_model_for_kbit_training
+
+from pretokenize import SPLITS, TokenCache, pretokenize
+from packing import BatchDataset, BoundaryCollator, ThroughputCallback, build_batches, padding_report
 
 # Configuration
 MODEL_NAME = "meta-llama/Meta-Llama-3-8B-Instruct" # In real life, use: "unsloth/llama-3-8b-instruct-bnb-4bit" for colab speed
@@ -21,10 +23,29 @@ MODEL_NAME = "meta-llama/Meta-Llama-3-8B-Instruct" # In real life, use: "unsloth
 # I'll add a check.
 
 NEW_MODEL_NAME = "llama-3-8b-financial-risk"
+MAX_SEQ_LENGTH = 1024
+BATCH_SIZE = 4
+# "packed": several examples per row with per-example attention; "grouped":
+# one example per row, batched by length. See packing.py.
+BATCHING = "packed"
+REPORT_FILE = "results/throughput.json"
+
+def train(model_name=MODEL_NAME, batching=BATCHING, batch_size=BATCH_SIZE, max_steps=-1):
+    # Tokenizer
+    tokenizer = AutoTokenizer.from_pretrained(model_name, trust_remote_code=True, token=os.getenv("HF_TOKEN"))
+    tokenizer.pad_token = tokenizer.eos_token
+    tokenizer.padding_side = "right"
 
-def train():
-    # Dataset
-    dataset = load_dataset("json", data_files={"train": "data/processed/train.jsonl", "validation": "data/processed/val.jsonl"})
+    # Dataset: token ids cached by pretokenize.py (built here if missing or stale)
+    cache_root = pretokenize(tokenizer)
+    caches = {split: TokenCache(os.path.join(cache_root, split)) for split in SPLITS}
+    batches = {split: build_batches(caches[split], batching, batch_size, MAX_SEQ_LENGTH) for split in SPLITS}
+    if not len(caches["val"]):
+        print("⚠️ The val split is empty. Training without an eval dataset.")
+    padding = padding_report(caches["train"], batches["train"], batch_size, MAX_SEQ_LENGTH)
+    print(f"Padding ratio: {padding['pad_to_max_length']:.1%} padded to {MAX_SEQ_LENGTH}, "
+          f"{padding['pad_to_longest_random']:.1%} padded to longest, {padding['chosen']:.1%} {batching} "
+          f"({padding['examples']} examples in {padding['rows']} rows, {padding['batches']} batches)")
 
     # QLoRA Config
     compute_dtype = getattr(torch, "float16")
@@ -42,12 +63,18 @@ def train():
     # If the user tries to run this on Mac, it might fail.
     
     device_map = "auto"
+    quantized = torch.cuda.is_available()
+    if not quantized:
+        # CPU (e.g. a smoke test with a tiny model): plain fp32, no bitsandbytes
+        compute_dtype = torch.float32
+        print("⚠️ No GPU detected. Training in fp32 on CPU without quantization.")
     
     try:
         model = AutoModelForCausalLM.from_pretrained(
-            MODEL_NAME,
-            quantization_config=bnb_config,
-            device_map=device_map,
+            model_name,
+            quantization_config=bnb_config if quantized else None,
+            device_map=device_map if quantized else None,
+            torch_dtype=compute_dtype,
             token=os.getenv("HF_TOKEN") # Needs token
         )
     except Exception as e:
@@ -57,11 +84,6 @@ def train():
     model.config.use_cache = False
     model.config.pretraining_tp = 1
 
-    # Tokenizer
-    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME, trust_remote_code=True, token=os.getenv("HF_TOKEN"))
-    tokenizer.pad_token = tokenizer.eos_token
-    tokenizer.padding_side = "right"
-
     # LoRA Config
     peft_config = LoraConfig(
         lora_alpha=16,
@@ -71,39 +93,56 @@ def train():
         task_type="CAUSAL_LM",
     )
 
-    # SFT Config
-    sft_config = SFTConfig(
-        dataset_text_field="text",
-        # max_seq_length=1024, # Moved outside to bypass version check
-        packing=False,
+    if quantized:
+        model = prepare_model_for_kbit_training(model)
+    model = get_peft_model(model, peft_config)
+
+    # Batches are formed by packing.py, so each dataset item is a whole batch
+    training_args = TrainingArguments(
         output_dir="./results",
         num_train_epochs=1,
-        per_device_train_batch_size=4,
+        max_steps=max_steps,
+        per_device_train_batch_size=1,
+        per_device_eval_batch_size=1,
         gradient_accumulation_steps=1,
         learning_rate=2e-4,
         logging_steps=25,
         save_steps=25,
+        remove_unused_columns=False,
+        report_to="none",
     )
-    sft_config.max_seq_length = 1024 # Manually set to ensure compatibility
+    collator = BoundaryCollator(tokenizer.pad_token_id, MAX_SEQ_LENGTH, dtype=compute_dtype)
+    throughput = ThroughputCallback(collator)
 
     # Trainer
-    trainer = SFTTrainer(
+    trainer = Trainer(
         model=model,
-        train_dataset=dataset["train"],
-        eval_dataset=dataset["validation"],
-        peft_config=peft_config,
-        processing_class=tokenizer, # Updated argument name
-        args=sft_config,
+        args=training_args,
+        train_dataset=BatchDataset(caches["train"], batches["train"]),
+        eval_dataset=BatchDataset(caches["val"], batches["val"]) if len(caches["val"]) else None,
+        data_collator=collator,
+        callbacks=[throughput],
     )
 
     # Train
     print("Starting training...")
     trainer.train()
+
+    os.makedirs(os.path.dirname(REPORT_FILE), exist_ok=True)
+    with open(REPORT_FILE, "w") as f:
+        json.dump({"batching": batching, "padding": padding, "training": throughput.stats}, f, indent=2)
+    print(f"Throughput report written to {REPORT_FILE}")
     
     # Save
     print("Saving model...")
     trainer.model.save_pretrained(NEW_MODEL_NAME)
-    trainer.tokenizer.save_pretrained(NEW_MODEL_NAME)
+    tokenizer.save_pretrained(NEW_MODEL_NAME)
 
 if __name__ == "__main__":
-    train()
+    parser = argparse.ArgumentParser(description="QLoRA fine-tuning on the pre-tokenized SFT data.")
+    parser.add_argument("--model", default=MODEL_NAME, help="Base model (a tiny local model works for CPU smoke tests)")
+    parser.add_argument("--batching", choices=["packed", "grouped"], default=BATCHING)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--max-steps", type=int, default=-1, help="Stop after N steps (default: one epoch)")
+    args = parser.parse_args()
+    train(args.model, args.batching, args.batch_size, args.max_steps)